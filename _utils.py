@@ -5,20 +5,34 @@ Ollama 工具函数模块
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import re
 import json
-import inspect
 import platform
-from typing import Dict, Any
-import fitz  # PyMuPDF
+from typing import Dict, Any, List, Optional, Tuple
 import hashlib
+import functools
+import sqlite3
+import threading
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from slugify import slugify
 from difflib import SequenceMatcher
+try:
+    from rapidfuzz import fuzz as _fuzz, process as _fuzz_process  # 可选依赖：C++ 实现的相似度计算，缺失时退回 difflib
+except ImportError:
+    _fuzz = _fuzz_process = None
+try:
+    import orjson  # 可选依赖：Rust 实现的 JSON 解析/序列化，缺失时退回标准库 json
+except ImportError:
+    orjson = None
 import logging
 import sys
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+import queue
+import atexit
 from dotenv import load_dotenv
 
 # ==============================
@@ -32,7 +46,12 @@ OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL    = os.getenv("OLLAMA_MODEL", "qwen2.5:7b")       # 默认模型
 DEEPSEEK_API_KEY= os.getenv("DEEPSEEK_API_KEY", "sk-xxxxxxxxxxx")
 OLLAMA_TIMEOUT  = int(os.getenv("OLLAMA_TIMEOUT", "300"))
+OLLAMA_CONNECT_TIMEOUT = int(os.getenv("OLLAMA_CONNECT_TIMEOUT", "10"))   # 连接超时单独设短，服务不可达时尽快失败
+OLLAMA_HTTP_TIMEOUT = (OLLAMA_CONNECT_TIMEOUT, OLLAMA_TIMEOUT)            # requests 的 (连接, 读取) 超时
 MAX_RETRIES     = int(os.getenv("MAX_RETRIES", "3"))
+OLLAMA_PARALLEL = int(os.getenv("OLLAMA_PARALLEL", "4"))   # 批量请求 Ollama 时的并发数
+BATCH_WORKERS   = int(os.getenv("BATCH_WORKERS", "1"))     # 批处理时同时处理的 PDF 文件数
+LLM_BATCH_SIZE  = int(os.getenv("LLM_BATCH_SIZE", "1"))    # 一次提示词中合并解析的版权页数量，1 表示不合并
 TARGET_SUFFIXES = os.getenv("TARGET_SUFFIXES", "_dual.pdf,_translated.pdf,_dual_智谱4Flash.pdf,_translated_智谱4Flash.pdf,_dual_Kimi+DeepSeek.pdf,_translated_Kimi+DeepSeek.pdf,_translated_Kimi+Qwen.pdf,_dual_Kimi+Qwen.pdf,.no_watermark.zh-CN.mono.pdf,.no_watermark.zh-CN.dual.pdf,_zh.pdf,_cn.pdf,_final.pdf,_bilingual.pdf").split(",")
 RENAME_PDF_FILES = os.getenv("RENAME_PDF_FILES", "true").lower() == "true"  # 是否重命名PDF文件
 
@@ -40,6 +59,7 @@ RENAME_PDF_FILES = os.getenv("RENAME_PDF_FILES", "true").lower() == "true"  # 
 # 2. 路径与日志
 # ==============================
 SCRIPT_DIR          = Path(__file__).parent.resolve()
+HOSTNAME            = platform.node()   # 进程内不变，只取一次
 WIKI_BASE_PATH: Path= Path(os.getenv("WIKI_BASE_PATH", ""))
 EOOKS_PATH: Path = Path(os.getenv("EOOKS_PATH", ""))
 
@@ -56,30 +76,33 @@ if http_proxy or https_proxy:
 
 DATA_DIR        = SCRIPT_DIR / "data"
 PROCESSING_DIR  = DATA_DIR / "processing"
+PROCESSING_JSON_PATH = DATA_DIR / "processing.json"   # 处理状态记录；放在这里，清理脚本无需导入 batch
 LOG_DIR         = SCRIPT_DIR / "logs"
 PROCESSING_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
 # 根据hostname设置不同的日志文件
-LOG_FILE = LOG_DIR / f"pdf_plumber_{platform.node()}.log"
+LOG_FILE = LOG_DIR / f"pdf_plumber_{HOSTNAME}.log"
 
 # 日志系统
 class Logger:
     """统一的日志类，支持不同级别日志和根据配置控制日志输出"""
     
+    # 级别名到整数的映射，避免每次调用都 getattr/upper
+    _LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warn': logging.WARNING, 'error': logging.ERROR}
+    
     def __init__(self, name):
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.DEBUG)
         
         # 避免重复添加处理器
         if not self.logger.handlers:
-            # 创建格式化器，移除了%(filename)s部分，因为我们已经在消息中包含了脚本名
-            formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] %(message)s', 
+            # 创建格式化器，脚本名由 logging 自身根据 stacklevel 解析为 %(filename)s
+            formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] [%(filename)s] %(message)s', 
                                         datefmt='%Y-%m-%d %H:%M:%S')
             
             # 控制台处理器
             console_handler = logging.StreamHandler(sys.stdout)
             console_handler.setFormatter(formatter)
-            self.logger.addHandler(console_handler)
             
             # 文件处理器 - 使用TimedRotatingFileHandler按天轮转日志
             file_handler = TimedRotatingFileHandler(
@@ -90,28 +113,31 @@ class Logger:
                 encoding='utf-8'
             )
             file_handler.setFormatter(formatter)
-            self.logger.addHandler(file_handler)
+            
+            # 业务线程只把日志放入队列，由后台线程写控制台和文件，避免磁盘 I/O 阻塞处理流程
+            log_queue = queue.SimpleQueue()
+            self.logger.addHandler(QueueHandler(log_queue))
+            listener = QueueListener(log_queue, console_handler, file_handler)
+            listener.start()
+            # 退出时处理完队列中剩余的日志
+            atexit.register(listener.stop)
         
         # 根据配置设置日志级别
         level = getattr(logging, LOG_LEVEL.upper(), logging.INFO)
         self.logger.setLevel(level)
     
-    def _get_caller_script(self):
-        """获取调用者的脚本名"""
-        # 获取调用栈，往上追溯3层：
-        # 第0层：_get_caller_script函数本身
-        # 第1层：debug/info等日志方法
-        # 第2层：Logger的方法（如_debug/_info等）
-        # 第3层：实际调用日志的业务代码
-        frame = inspect.currentframe().f_back.f_back.f_back
-        script = frame.f_globals.get("__file__", "<unknown>")
-        return script.split("/")[-1].split("\\")[-1]
+    def is_enabled(self, level) -> bool:
+        """该级别（'debug'/'info'/'warn'/'error'）的日志是否会输出；可在拼接开销大的日志前先判断"""
+        return self.logger.isEnabledFor(self._LEVELS[level])
     
     def _log_with_script(self, level, msg):
-        """包装日志方法，添加脚本名前缀"""
-        caller_script = self._get_caller_script()
-        formatted_msg = f"[{caller_script}] {msg}"
-        getattr(self.logger, level)(formatted_msg)
+        """包装日志方法，由 logging 定位实际调用日志的业务代码所在脚本"""
+        lvl = self._LEVELS[level]
+        # 级别被过滤时直接返回，不做任何处理
+        if not self.logger.isEnabledFor(lvl):
+            return
+        # stacklevel=3：跳过 _log_with_script 与 debug/info 等方法，定位到业务代码
+        self.logger.log(lvl, msg, stacklevel=3)
     
     def debug(self, msg):
         self._log_with_script('debug', msg)
@@ -128,6 +154,201 @@ class Logger:
 # 创建全局logger实例
 logger = Logger("pdfplumber")
 
+# ==============================
+# HTTP 会话（复用 TCP 连接，避免每次请求重新握手）
+# ==============================
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
+# 多个文件并行处理时，每个文件内部还可能并发请求 Ollama，连接池按两者乘积预留
+_http_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=max(10, OLLAMA_PARALLEL * max(1, BATCH_WORKERS)), max_retries=0)
+HTTP_SESSION.mount("http://", _http_adapter)
+HTTP_SESSION.mount("https://", _http_adapter)
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+def close_session():
+    """关闭全局 HTTP 会话，释放连接池"""
+    HTTP_SESSION.close()
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """第 attempt 次（从 0 开始）失败后的等待秒数：指数退避加随机抖动，避免并发请求同时重试"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def post_json(url: str, body: dict, timeout: float, headers: dict = None, stream: bool = False):
+    """用全局会话 POST JSON 请求体；请求体由 json_dumps（优先 orjson）序列化，不经 requests 内部的标准库 json"""
+    return HTTP_SESSION.post(url, data=json_dumps(body), headers={**_JSON_HEADERS, **(headers or {})},
+                             timeout=timeout, stream=stream)
+
+# ==============================
+# 磁盘缓存（跨进程复用模型检查、大模型判断等纯函数结果）
+# ==============================
+CACHE_DB        = DATA_DIR / "cache.sqlite3"
+MODEL_CHECK_TTL = 3600  # 模型检查结果有效期（秒）
+HTTP_CACHE_TTL  = 30 * 86400  # Google Books 等外部接口结果有效期（秒）；大模型结果不过期
+
+_cache_conn = None
+_cache_lock = threading.Lock()
+
+def _get_cache_conn() -> sqlite3.Connection:
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(CACHE_DB, timeout=30, check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v TEXT NOT NULL, ts REAL NOT NULL)")
+    return _cache_conn
+
+def make_cache_key(*parts) -> str:
+    """将若干字段拼接后取哈希，作为磁盘缓存的键"""
+    return get_text_hash("\x1f".join(str(p) for p in parts))
+
+def cache_get(key: str, ttl: float = None):
+    """
+    读取磁盘缓存
+    
+    Args:
+        key: 缓存键，通常由 make_cache_key 生成
+        ttl: 有效期（秒），为 None 时永不过期
+        
+    Returns:
+        缓存的值；未命中或已过期时返回 None
+    """
+    try:
+        with _cache_lock:
+            row = _get_cache_conn().execute("SELECT v, ts FROM kv WHERE k = ?", (key,)).fetchone()
+    except sqlite3.Error as e:
+        logger.debug(f"读取缓存失败: {e}")
+        return None
+    if row is None or (ttl is not None and time.time() - row[1] > ttl):
+        return None
+    return json_loads(row[0])
+
+def cache_set(key: str, value) -> None:
+    """写入磁盘缓存，value 需可被 JSON 序列化"""
+    try:
+        with _cache_lock:
+            conn = _get_cache_conn()
+            conn.execute("INSERT OR REPLACE INTO kv (k, v, ts) VALUES (?, ?, ?)",
+                         (key, json_dumps(value).decode("utf-8"), time.time()))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.debug(f"写入缓存失败: {e}")
+
+def cache_set_many(items: Dict[str, Any]) -> None:
+    """批量写入磁盘缓存 {key: value}，只提交一次事务"""
+    if not items:
+        return
+    now = time.time()
+    try:
+        with _cache_lock:
+            conn = _get_cache_conn()
+            conn.executemany("INSERT OR REPLACE INTO kv (k, v, ts) VALUES (?, ?, ?)",
+                             [(k, json_dumps(v).decode("utf-8"), now) for k, v in items.items()])
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.debug(f"写入缓存失败: {e}")
+
+def _post_cache_key(url: str, body: dict) -> str:
+    return make_cache_key("http_post", url, json.dumps(body, sort_keys=True, ensure_ascii=False))
+
+def seed_post_cache(url: str, body: dict, data) -> None:
+    """预先写入某个请求的响应（例如批量请求拆出来的单条结果），之后 cached_post_json 直接命中"""
+    cache_set(_post_cache_key(url, body), data)
+
+def cached_post_json(url: str, body: dict, timeout: float, headers: dict = None, ttl: float = None):
+    """
+    POST JSON 并返回解析后的响应；按 (url, 请求体) 缓存在磁盘上，重跑同一批 PDF 时不再请求网络。
+    只缓存成功的响应，请求失败时照常抛出异常。headers（如鉴权信息）不参与缓存键
+    """
+    disk_key = _post_cache_key(url, body)
+    cached = cache_get(disk_key, ttl=ttl)
+    if cached is not None:
+        return cached
+    resp = post_json(url, body, timeout, headers=headers)
+    resp.raise_for_status()
+    data = json_loads(resp.content)
+    cache_set(disk_key, data)
+    return data
+
+def _json_object_end(text: str, start: int = 0) -> int:
+    """返回从 start 处的 '{' 开始、括号配平的 JSON 对象结束位置（不含）；还没配平时返回 -1。会跳过字符串里的括号"""
+    depth = 0
+    in_str = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_str:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+def cached_generate_json_object(url: str, body: dict, timeout: float, max_chars_without_json: int = 4096):
+    """
+    流式调用 Ollama /api/generate，期望返回一个 JSON 对象：
+    第一个 JSON 对象的括号配平后立即断开连接，不再等模型输出后面的废话；
+    已经输出 max_chars_without_json 个字符仍没有出现 '{' 时也提前放弃。
+    
+    返回值与 cached_post_json 相同（{"response": 文本}），缓存键也相同（按 stream=False 的请求体），
+    所以非流式请求或批量预解析写入的缓存可以直接命中
+    """
+    body = {**body, "stream": False}
+    disk_key = _post_cache_key(url, body)
+    cached = cache_get(disk_key)
+    if cached is not None:
+        return cached
+    
+    parts = []
+    length = 0
+    brace = -1
+    with post_json(url, {**body, "stream": True}, timeout, stream=True) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            chunk = json_loads(line)
+            piece = chunk.get("response", "")
+            parts.append(piece)
+            length += len(piece)
+            if chunk.get("done"):
+                break
+            if brace < 0:
+                if "{" in piece:
+                    brace = length - len(piece) + piece.index("{")
+                elif length > max_chars_without_json:
+                    logger.warn(f"大模型已输出 {length} 个字符仍没有 JSON，提前结束")
+                    break
+            # 数据块很小，配平检查只在出现 '}' 时做
+            if brace >= 0 and "}" in piece and _json_object_end("".join(parts), brace) > 0:
+                break
+    
+    text = "".join(parts)
+    data = {"response": text}
+    # 只缓存包含完整 JSON 对象的回复；提前放弃或被截断的回复下次重新请求
+    if brace >= 0 and _json_object_end(text, brace) > 0:
+        cache_set(disk_key, data)
+    return data
+
+def cached_get_json(url: str, timeout: float, proxies: dict = None, ttl: float = HTTP_CACHE_TTL):
+    """GET 并返回解析后的 JSON 响应，按 url 缓存在磁盘上，默认 HTTP_CACHE_TTL 后过期"""
+    disk_key = make_cache_key("http_get", url)
+    cached = cache_get(disk_key, ttl=ttl)
+    if cached is not None:
+        return cached
+    resp = HTTP_SESSION.get(url, timeout=timeout, proxies=proxies)
+    resp.raise_for_status()
+    data = json_loads(resp.content)
+    cache_set(disk_key, data)
+    return data
+
 # 用于缓存模型检查结果的字典
 _model_check_cache = {}
 
@@ -155,13 +376,20 @@ def check_model_exists(base_url=None, model_name=None):
     if cache_key in _model_check_cache:
         return _model_check_cache[cache_key]
     
+    # 有效期内检查通过过，则不再请求服务
+    disk_key = make_cache_key("model_check", url, model)
+    if cache_get(disk_key, ttl=MODEL_CHECK_TTL):
+        _model_check_cache[cache_key] = True
+        return True
+    
     try:
         logger.info(f"正在检查远程模型是否存在：{url}")
-        r = requests.get(url, timeout=10)
+        r = HTTP_SESSION.get(url, timeout=10)
         r.raise_for_status()
-        data = r.json()
+        data = json_loads(r.content)
 
-        available_models = [m["name"] for m in data.get("models", [])]
+        # 一次遍历建立 名称 -> 大小 的映射
+        available_models = {m["name"]: m.get("size", "未知") for m in data.get("models", [])}
         if not available_models:
             logger.error("远程服务返回空模型列表！请确认 Ollama 已启动且有模型")
             raise SystemExit(1)
@@ -171,13 +399,13 @@ def check_model_exists(base_url=None, model_name=None):
             logger.info("请在服务器执行：")
             logger.info(f"   ollama pull {model}")
             logger.info("当前已安装模型：")
-            for m in available_models:
-                size = next((item["size"] for item in data["models"] if item["name"] == m), "未知")
+            for m, size in available_models.items():
                 logger.info(f"   • {m} ({size})")
             raise SystemExit(1)
 
         logger.info(f"模型检查通过：{model} 已就绪")
         _model_check_cache[cache_key] = True
+        cache_set(disk_key, True)
         return True
     except requests.exceptions.ConnectionError:
         logger.error(f"无法连接 Ollama 服务 {base_url or OLLAMA_BASE_URL}")
@@ -187,6 +415,32 @@ def check_model_exists(base_url=None, model_name=None):
         logger.error(f"检查模型时出错：{e}")
         raise SystemExit(1)
 
+_model_check_lock = threading.Lock()
+
+def ensure_model(base_url=None, model_name=None) -> bool:
+    """首次真正需要模型时再检查（导入模块时不再阻塞）；多线程下只检查一次"""
+    with _model_check_lock:
+        return check_model_exists(base_url, model_name)
+
+def json_loads(data):
+    """解析 JSON（str 或 bytes），优先使用 orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    """序列化为 UTF-8 编码的 JSON 字节串（不转义中文），indent=True 时缩进 2 格"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """先写同目录下的 .tmp 临时文件再 os.replace，中途退出也不会留下写了一半的文件"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
 def load_json_file(json_path: Path) -> Dict[Any, Any]:
     """
     读取JSON文件并返回其内容
@@ -205,11 +459,20 @@ def load_json_file(json_path: Path) -> Dict[Any, Any]:
         raise FileNotFoundError(f"JSON文件不存在: {json_path}")
     
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except json.JSONDecodeError as e:
+        return json_loads(json_path.read_bytes())
+    except json.JSONDecodeError as e:  # orjson.JSONDecodeError 是其子类
         raise json.JSONDecodeError(f"JSON文件格式错误: {json_path}", e.doc, e.pos)
 
+_TARGET_LIST = [s for s in TARGET_SUFFIXES if s]
+
+# str.endswith 支持元组，一次 C 层调用即可判断所有后缀
+_TARGET_TUPLE = tuple(_TARGET_LIST)
+
+# 所有后缀倒序后合并为一个正则，长的在前；对倒序的文件名做锚定匹配，得到最长的匹配后缀
+_REVERSED_SUFFIX_RE = re.compile('|'.join(
+    re.escape(s[::-1]) for s in sorted(_TARGET_LIST, key=len, reverse=True)
+) or r'(?!)')
+
 def is_target_file(filename: str) -> bool:
     """判断文件是否为目标文件（即需要被忽略的文件）
     
@@ -219,10 +482,7 @@ def is_target_file(filename: str) -> bool:
     Returns:
         bool: 如果是目标文件返回True，否则返回False
     """
-    for suffix in TARGET_SUFFIXES:
-        if filename.endswith(suffix):
-            return True
-    return False
+    return filename.endswith(_TARGET_TUPLE)
 
 def is_target_file_2(filename: str) -> str:
     """判断文件是否为目标文件（即需要被忽略的文件）
@@ -231,32 +491,147 @@ def is_target_file_2(filename: str) -> str:
         filename: 文件名
         
     Returns:
-        str: 返回特定后缀
+        str: 返回特定后缀（多个后缀同时匹配时返回最长的一个），不匹配返回空字符串
     """
-    for suffix in TARGET_SUFFIXES:
-        if filename.endswith(suffix):
-            return suffix
-    return ""
+    m = _REVERSED_SUFFIX_RE.match(filename[::-1])
+    return m.group()[::-1] if m else ""
 
-def get_safe_title(meta) -> str:
-    safe_title= slugify(meta.get("title", "")) + "-" + meta.get("id", "").lower()
+def walk_pdfs(root: Path):
+    """
+    递归遍历目录下的所有 .pdf 文件；os.scandir 返回的 DirEntry 自带文件类型，比 Path.rglob 少很多 stat 调用
+    
+    Args:
+        root: 根目录
+        
+    Yields:
+        Path: PDF 文件路径
+    """
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from walk_pdfs(entry.path)
+                elif entry.name.endswith(".pdf"):
+                    yield Path(entry.path)
+    except OSError as e:  # 无权限等情况，与 rglob 一样跳过该目录
+        logger.debug(f"遍历目录失败: {root}: {e}")
+
+# 已是规范 slug 的标题（小写字母数字，单个连字符分隔），slugify 结果与其本身一致
+_SLUG_RE = re.compile(r'^[a-z0-9]+(?:-[a-z0-9]+)*$')
+
+@functools.lru_cache(maxsize=1024)
+def _slugify_title(title: str) -> str:
+    lowered = title.lower()
+    if lowered.isascii() and _SLUG_RE.match(lowered):
+        return lowered
+    from slugify import slugify  # 延迟导入，只在确实需要转换时加载
+    return slugify(title)
+
+@functools.lru_cache(maxsize=4096)
+def _safe_title(title: str, books_id: str) -> str:
+    safe_title= _slugify_title(title) + "-" + books_id.lower()
     if safe_title.startswith("-") or safe_title.endswith("-"):
         logger.debug(f"获取到 safe_title 有问题: {safe_title}")
         return ""
     return safe_title
 
+def get_safe_title(meta) -> str:
+    # meta 是 dict 不能直接做缓存键，取出 (title, id) 再缓存
+    return _safe_title(meta.get("title", ""), meta.get("id", ""))
+
+def _pdf_cache_key(pdf_path) -> tuple:
+    """以 (路径, 修改时间, 大小) 作为缓存键，文件被修改后自动失效"""
+    st = os.stat(pdf_path)
+    return (str(pdf_path), st.st_mtime_ns, st.st_size)
+
+# PyMuPDF 不支持多线程同时调用，所有 fitz 操作需持有此锁
+PDF_LOCK = threading.RLock()
+
+# (路径, 修改时间, 大小) -> (页数, 书签, 标题, 元数据)；每项都很小，整个批次都保留
+_pdf_info_cache: Dict[tuple, tuple] = {}
+
+def _doc_info(doc) -> tuple:
+    # 大纲（Outline）即书签；无大纲时为空。书签和元数据都转成元组，避免缓存中的对象被调用方修改
+    metadata = doc.metadata or {}
+    toc = tuple(tuple(entry) for entry in doc.get_toc())
+    return doc.page_count, toc, metadata.get("title", ""), tuple(metadata.items())
+
+def _inspect_pdf(key: tuple) -> tuple:
+    info = _pdf_info_cache.get(key)
+    if info is None:
+        import fitz  # PyMuPDF，延迟导入，不处理 PDF 的脚本无需加载
+        with PDF_LOCK, fitz.open(key[0]) as doc:
+            info = _pdf_info_cache[key] = _doc_info(doc)
+    return info
+
+def remember_pdf_info(pdf_path, doc) -> None:
+    """已经打开了 PDF 的调用方顺便记下页数、书签等信息，之后 inspect_pdf 不必再打开文件"""
+    _pdf_info_cache[_pdf_cache_key(pdf_path)] = _doc_info(doc)
+
+def inspect_pdf(pdf_path) -> Dict[str, Any]:
+    """
+    打开一次 PDF，同时获取页数、是否有书签、标题和文档元数据
+    
+    Returns:
+        dict: {'page_count': int, 'has_bookmarks': bool, 'title': str, 'metadata': dict}
+    """
+    page_count, toc, title, metadata = _inspect_pdf(_pdf_cache_key(pdf_path))
+    return {"page_count": page_count, "has_bookmarks": bool(toc), "title": title, "metadata": dict(metadata)}
+
+def get_pdf_toc(pdf_path) -> List[list]:
+    """
+    获取 PDF 书签列表 [[层级, 标题, 页码], ...]，与 fitz 的 get_toc() 格式一致；
+    与页数等信息共用缓存，同一文件在批处理中只打开一次
+    """
+    return [list(entry) for entry in _inspect_pdf(_pdf_cache_key(pdf_path))[1]]
+
 def get_pdf_page_count(pdf_path):
     """
     获取PDF文件的总页数
     """
-    doc = fitz.open(pdf_path)
-    page_count = doc.page_count
-    doc.close()
-    return page_count
+    return inspect_pdf(pdf_path)["page_count"]
 
 def get_text_md5(text: str) -> str:
+    # 结果会写入元数据（filenameMD5），需保持 MD5 格式不变
     return hashlib.md5(text.encode('utf-8')).hexdigest()
 
+def get_text_hash(text, digest_size: int = 16) -> str:
+    """
+    计算文本哈希（blake2b），仅用于内部缓存键等场景，比 MD5 更快
+    
+    Args:
+        text: 字符串或已编码的 bytes
+        digest_size: 摘要字节数
+    """
+    data = text if isinstance(text, bytes) else text.encode('utf-8')
+    return hashlib.blake2b(data, digest_size=digest_size).hexdigest()
+
+def similarity_ratio(text1: str, text2: str) -> float:
+    """
+    计算两段文本的相似度（0~1），优先使用 rapidfuzz，未安装时使用 difflib
+    """
+    if _fuzz is not None:
+        return _fuzz.ratio(text1, text2) / 100.0
+    return SequenceMatcher(None, text1, text2).ratio()
+
+def similar_choices(text: str, choices: List[str], min_ratio: float) -> List[Tuple[int, float]]:
+    """
+    一次比较 text 与 choices 中的所有文本，返回相似度≥min_ratio 的 [(下标, 相似度), ...]；
+    有 rapidfuzz 时整批交给 process.extract 在 C++ 层完成
+    """
+    if _fuzz_process is not None:
+        return [(idx, score / 100.0) for _, score, idx in
+                _fuzz_process.extract(text, choices, scorer=_fuzz.ratio, limit=None, score_cutoff=min_ratio * 100)]
+    results = []
+    for idx, choice in enumerate(choices):
+        # 相似度上限为 2*min(len)/(len1+len2)，长度差距过大时无需计算
+        if 2 * min(len(text), len(choice)) < min_ratio * (len(text) + len(choice)):
+            continue
+        ratio = 1.0 if text == choice else SequenceMatcher(None, text, choice).ratio()
+        if ratio >= min_ratio:
+            results.append((idx, ratio))
+    return results
+
 def is_highly_similar(text1, text2, threshold=0.99):
     """
     判断两段文本是否相同或相似度≥99%
@@ -266,30 +641,25 @@ def is_highly_similar(text1, text2, threshold=0.99):
     if text1 == text2:
         return True
     
+    # 相似度上限为 2*min(len)/(len1+len2)，长度差距过大时不可能达到阈值，无需计算
+    len1, len2 = len(text1), len(text2)
+    if 2 * min(len1, len2) < threshold * (len1 + len2):
+        return False
+    
     # 计算相似度
-    similarity = SequenceMatcher(None, text1, text2).ratio()
-    return similarity >= threshold
+    return similarity_ratio(text1, text2) >= threshold
 
 def has_bookmarks(pdf_path: Path) -> bool:
-    with fitz.open(pdf_path) as doc:
-        # 大纲（Outline）即书签；无大纲时返回空列表
-        return bool(doc.get_toc())   # True → 有书签，False → 无书签
+    return inspect_pdf(pdf_path)["has_bookmarks"]   # True → 有书签，False → 无书签
 
 # 规范化 ISBN 方便比较
 def _normalize_isbn(s):
     return re.sub(r'[^0-9Xx]', '', s or '')
 
-def has_explanatory_note(src: str, trans: str) -> bool:
+def _explanatory_note_precheck(src: str, trans: str) -> Optional[bool]:
     """
-    判断翻译内容是否带有解释性说明。
-    如果包含常见的解释性短语（如“根据上下文”、“注：”、“建议”、“应当直接翻译为”等），返回 True。
-    
-    参数:
-        src (str): 原文
-        trans (str): 译文
-    
-    返回:
-        bool: 有解释性说明返回 True，否则 False
+    不请求模型就能得出的判断：有解释性说明返回 True，没有返回 False；
+    需要交给 LLM 判断时返回 None
     """
     # 有多行内容，说明有注释
     # 如：【仪表礼仪 для成功
@@ -299,12 +669,94 @@ def has_explanatory_note(src: str, trans: str) -> bool:
         logger.debug(f"翻译有换行：{trans}")
         return True
 
-    # 先快速正则匹配
+    # 中文占比过半且没有括号、“注：”“说明：”等标记，是正常译文（绝大多数情况到此返回）
+    if len(_CJK_CHAR_RE.findall(trans)) > 0.5 * len(trans) and not _NOTE_MARKER_RE.search(trans):
+        return False
+
+    # 结尾多出一段原文没有的括号说明，如“容器编排（此处指 Kubernetes 的调度）”；
+    # 也可能只是书名里的括号，如“数据库系统（第3版）”，交给 LLM 判断
+    if _TRAILING_NOTE_RE.search(trans) and not _TRAILING_NOTE_RE.search(src):
+        logger.debug(f"翻译结尾有括号说明：{trans}")
+        return None
+
+    # 先快速正则匹配，命中关键词后才交给 LLM 判断
     if has_explanatory_note_re(trans.replace('\n', ' ')):
-        return has_explained_content_llm  # LLM 判断
+        return None
  
     return False
+
+def has_explanatory_note(src: str, trans: str) -> bool:
+    """
+    判断翻译内容是否带有解释性说明。
+    如果包含常见的解释性短语（如“根据上下文”、“注：”、“建议”、“应当直接翻译为”等），返回 True。
+    
+    参数:
+        src (str): 原文
+        trans (str): 译文
+    
+    返回:
+        bool: 有解释性说明返回 True，否则 False
+    """
+    verdict = _explanatory_note_precheck(src, trans)
+    if verdict is None:
+        return has_explained_content_llm(src, trans)  # LLM 判断
+    return verdict
+    
+def has_explanatory_notes(pairs: List[Tuple[str, str]]) -> List[bool]:
+    """
+    批量版 has_explanatory_note：先逐组做不请求模型的判断，
+    剩下需要 LLM 判断的几组交给 has_explained_content_llm_batch 并发请求
+    
+    Args:
+        pairs: [(原文, 译文), ...]
+        
+    Returns:
+        List[bool]: 每组的判断结果，顺序与 pairs 一致
+    """
+    verdicts = [_explanatory_note_precheck(src, trans) for src, trans in pairs]
+    pending = [i for i, v in enumerate(verdicts) if v is None]
+    for i, v in zip(pending, has_explained_content_llm_batch([pairs[i] for i in pending])):
+        verdicts[i] = v
+    return verdicts
     
+# 常见的解释性关键词和模式（可根据实际日志扩展）
+_EXPLAIN_PATTERNS = [
+    r'译',
+    # r'译文',
+    # r'翻译',
+    # r'译为',
+    r'原文',
+    r'建议',
+    r'根据',
+    r'纠正',
+    # r'应译为',
+    # r'建议.*翻译为',
+    # r'应翻译为',
+    # r'应当翻译为.*或',
+    # r'直接翻译',
+    r'注[:：]',              # 注释开头
+    r'备注[:：]',
+    r'说明[:：]',
+    # r'建议根据',
+    r'上下文',          # 如“根据上下文\依据上下文”
+    r'无需.*说明',
+    r'若未明确指示',
+    r'按照.*指导',
+    r'如需',
+    r'不必考虑',
+    r'简化为',
+    # r'如原文中出现',
+]
+# 合并为一个大正则，只在导入时编译一次
+_EXPLAIN_RE = re.compile('|'.join(_EXPLAIN_PATTERNS))
+# 所有模式的首字符；文本中一个都不含时必然不匹配，可跳过正则
+_EXPLAIN_TRIGGERS = frozenset(p[0] for p in _EXPLAIN_PATTERNS)
+# 结尾的括号说明（至少 3 个字符）
+_TRAILING_NOTE_RE = re.compile(r'[（(][^）)]{3,}[）)]\s*$')
+# 括号说明或“注：”“说明：”等标记；中文占比高且不含这些标记的译文不必再检查
+_NOTE_MARKER_RE = re.compile(r'[（(][^）)]{3,}[）)]\s*$|注[:：]|说明[:：]')
+_CJK_CHAR_RE = re.compile(r'[\u4e00-\u9fff]')
+
 def has_explanatory_note_re(text: str) -> bool:
     """
     通过正则表达式判断翻译内容是否带有解释性说明。
@@ -316,41 +768,20 @@ def has_explanatory_note_re(text: str) -> bool:
     返回:
         bool: 有解释性说明返回 True，否则 False
     """
-    if not text:
+    if not text or _EXPLAIN_TRIGGERS.isdisjoint(text):
         return False
     
-    # 常见的解释性关键词和模式（可根据实际日志扩展）
-    patterns = [
-        r'译',
-        # r'译文',
-        # r'翻译',
-        # r'译为',
-        r'原文',
-        r'建议',
-        r'根据',
-        r'纠正',
-        # r'应译为',
-        # r'建议.*翻译为',
-        # r'应翻译为',
-        # r'应当翻译为.*或',
-        # r'直接翻译',
-        r'注：',                 # 注释开头
-        r'备注：',
-        # r'建议根据',
-        r'上下文',          # 如“根据上下文\依据上下文”
-        r'无需.*说明',
-        r'若未明确指示',
-        r'按照.*指导',
-        r'如需',
-        r'不必考虑',
-        r'简化为',
-        # r'如原文中出现',
-    ]
-    
-    # 合并为一个大正则
-    combined_pattern = '|'.join(patterns)
-    
-    return bool(re.search(combined_pattern, text))
+    return bool(_EXPLAIN_RE.search(text))
+
+# 解释性内容判断提示词的固定部分
+_EXPLAIN_PROMPT_HEAD = (
+    "你是一名严格的翻译质检员。下面给你两段中文：\n"
+    "第一段【原文】是标准答案，不含任何解释、注释、说明、理由等；\n"
+    "第二段【译文】是待检查版本。\n"
+    "请判断【译文】是否**额外出现**了解释、注释、说明、理由、补充等“解释性内容”。\n"
+    "注意：不能仅凭几个词就下结论，要综合语义判断；如果【译文】只是用词不同而没有额外解释，请返回 false。\n"
+    "请只回答 true 或 false，不要输出任何额外文字。\n\n"
+)
 
 def has_explained_content_llm(src: str, mt: str) -> bool:
     """
@@ -359,16 +790,13 @@ def has_explained_content_llm(src: str, mt: str) -> bool:
     mt 是译文。
     返回 True 表示 mt 里**多出了**解释性内容，False 表示没有。
     """
-    prompt = (
-        "你是一名严格的翻译质检员。下面给你两段中文：\n"
-        "第一段【原文】是标准答案，不含任何解释、注释、说明、理由等；\n"
-        "第二段【译文】是待检查版本。\n"
-        "请判断【译文】是否**额外出现**了解释、注释、说明、理由、补充等“解释性内容”。\n"
-        "注意：不能仅凭几个词就下结论，要综合语义判断；如果【译文】只是用词不同而没有额外解释，请返回 false。\n"
-        "请只回答 true 或 false，不要输出任何额外文字。\n\n"
-        f"【原文】\n{src}\n\n"
-        f"【译文】\n{mt}"
-    )
+    prompt = f"{_EXPLAIN_PROMPT_HEAD}【原文】\n{src}\n\n【译文】\n{mt}"
+
+    # 同一模型对同一组原文/译文的判断结果是确定的，命中缓存则不再请求
+    disk_key = make_cache_key("explain", OLLAMA_MODEL, src, mt)
+    cached = cache_get(disk_key)
+    if cached is not None:
+        return cached
 
     payload = {
         "model": OLLAMA_MODEL,
@@ -378,33 +806,65 @@ def has_explained_content_llm(src: str, mt: str) -> bool:
     }
 
     try:
-        resp = requests.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json=payload,
-            timeout=OLLAMA_TIMEOUT
-        )
+        resp = post_json(f"{OLLAMA_BASE_URL}/api/generate", payload, OLLAMA_HTTP_TIMEOUT)
         resp.raise_for_status()
-        answer = resp.json()["response"].strip().lower()
-        return answer == "true"
+        answer = json_loads(resp.content)["response"].strip().lower()
+        result = answer == "true"
+        cache_set(disk_key, result)
+        return result
     except Exception as e:
         logger.warn(f"Ollama call failed: {e}")
         return False
 
+def has_explained_content_llm_batch(pairs: List[Tuple[str, str]]) -> List[bool]:
+    """
+    批量判断译文是否含解释性内容，并发请求 Ollama，结果顺序与 pairs 一致
+    
+    Args:
+        pairs: [(原文, 译文), ...]
+        
+    Returns:
+        List[bool]: 每组的判断结果
+    """
+    if not pairs:
+        return []
+    workers = max(1, min(OLLAMA_PARALLEL, len(pairs)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda p: has_explained_content_llm(*p), pairs))
+
 # ==============================
 # 4. 深度清理标题（重点！解决 &#10; 换行问题）
 # ==============================
+_XML_NL_RE    = re.compile(r'&#(?:x0?[0A9D]|10|13);')   # XML 实体换行
+_SURROGATE_RE = re.compile(r'[\ud800-\udfff]')            # 非法字符
+_WS_RE        = re.compile(r'\s+')                         # 连续空白
+_BATCH_SEP    = '\x1f'                                      # 批量清理时的分隔符（\s 也会匹配它，需排除）
+_BATCH_WS_RE  = re.compile(r'[^\S\x1f]+')
+# 真实换行 + 各种空格，一次 translate 完成替换
+_TITLE_TRANS  = str.maketrans({
+    '\n': ' ', '\r': ' ', '\t': ' ',
+    '\u00a0': ' ', '\u2009': ' ', '\u200b': None, '\ufeff': None,
+})
+
+@functools.lru_cache(maxsize=8192)   # 纯函数；同一书签名在导出、提取、替换时会被反复清理
 def deep_clean_title(text: str) -> str:
     """彻底清除 PDF 书签中的换行符、控制字符、XML 实体"""
     if not text:
         return ""
-    # XML 实体换行
-    text = re.sub(r'&#(?:x0?[0A9D]|10|13);', ' ', text)
-    # 真实换行
-    text = text.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
-    # 各种空格
-    text = text.replace('\u00a0', ' ').replace('\u2009', ' ').replace('\u200b', '').replace('\ufeff', '')
-    # 非法字符
-    text = re.sub(r'[\ud800-\udfff]', '', text)
+    text = _XML_NL_RE.sub(' ', text)
+    text = text.translate(_TITLE_TRANS)
+    text = _SURROGATE_RE.sub('', text)
     # 合并空格
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
\ No newline at end of file
+    return _WS_RE.sub(' ', text).strip()
+
+def deep_clean_titles(titles: List[str]) -> List[str]:
+    """批量版 deep_clean_title：拼接后整体只做一遍替换，再拆回列表，结果与逐条清理一致"""
+    titles = [t or "" for t in titles]
+    if any(_BATCH_SEP in t for t in titles):
+        return [deep_clean_title(t) for t in titles]
+    text = _BATCH_SEP.join(titles)
+    text = _XML_NL_RE.sub(' ', text)
+    text = text.translate(_TITLE_TRANS)
+    text = _SURROGATE_RE.sub('', text)
+    text = _BATCH_WS_RE.sub(' ', text)
+    return [t.strip() for t in text.split(_BATCH_SEP)]
\ No newline at end of file
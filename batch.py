@@ -1,15 +1,21 @@
 
-import json
-import secrets
-import string
+import atexit
+import copy
+import errno
+import functools
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from _utils import logger, check_model_exists,is_target_file, load_json_file, get_safe_title, has_bookmarks
-from _utils import OLLAMA_BASE_URL, OLLAMA_MODEL, WIKI_BASE_PATH, LOG_DIR, DATA_DIR, EOOKS_PATH, RENAME_PDF_FILES
+from typing import Tuple
+from _utils import logger, ensure_model, is_target_file, load_json_file, json_dumps, atomic_write_bytes, get_safe_title, has_bookmarks, walk_pdfs
+from _utils import OLLAMA_BASE_URL, OLLAMA_MODEL, WIKI_BASE_PATH, LOG_DIR, PROCESSING_JSON_PATH, EOOKS_PATH, RENAME_PDF_FILES, BATCH_WORKERS, LLM_BATCH_SIZE
 import time  # 添加时间模块用于统计
-from batch_01_cip_parser import cip_parser
+from batch_01_cip_parser import cip_parser, prefetch_metadata_llm, random_id_12, META_DIR
 from batch_02_rename import rename_related_pdfs, find_related_files
 from batch_03_toc import translate_toc, pdf_import_toc_xml, TOC_DIR
-from batch_04_md import build_markdown
+from batch_04_md import build_markdown, prefetch_covers
 
 """
 将处理的数据存在下面的 processing.json 文件中，避免重复做：
@@ -43,14 +49,245 @@ from batch_04_md import build_markdown
 
 # ----------- 配置 -------------
 
-# 立即执行检查
-check_model_exists(OLLAMA_BASE_URL, OLLAMA_MODEL)
 
-# Processing JSON 文件路径
-PROCESSING_JSON_PATH = DATA_DIR / "processing.json"
 temporarily_file = LOG_DIR / "temporarily_files.txt"
 MD_DIR = WIKI_BASE_PATH
 
+# 各处理阶段在状态掩码中的位，四位全部为 1 说明已全部处理完
+STATUS_BITS = {"rename_done": 0b0001, "parse_metadata": 0b0010, "trans_toc": 0b0100, "build_md": 0b1000}
+ALL_DONE = 0b1111
+
+def status_mask(processed_info: dict) -> int:
+    """根据 status 计算状态掩码；未开启重命名、确认没有书签的文件，对应阶段视为已完成"""
+    status = processed_info.get("status", {})
+    mask = 0
+    for key, bit in STATUS_BITS.items():
+        if status.get(key):
+            mask |= bit
+    if not RENAME_PDF_FILES:
+        mask |= STATUS_BITS["rename_done"]
+    keyinfo = processed_info.get("keyinfo", {})
+    if keyinfo.get("toc_checked") and not keyinfo.get("has_toc", True):
+        mask |= STATUS_BITS["trans_toc"]
+    return mask
+
+@functools.lru_cache(maxsize=None)
+def dir_files(directory: Path) -> frozenset:
+    """
+    目录下的文件名集合，每次运行每个目录只列一次，代替逐个文件 is_file() 的 stat 调用。
+    只用于判断之前运行的产物是否存在；本次运行中刚写入的文件不会出现在这里
+    """
+    try:
+        return frozenset(os.listdir(directory))
+    except OSError:
+        return frozenset()
+
+def is_fully_processed(processed_info: dict) -> bool:
+    """所有阶段都已完成，且生成的 meta、md、目录 xml 文件都还在"""
+    if status_mask(processed_info) != ALL_DONE:
+        return False
+    meta_json = processed_info.get("meta_json")
+    md_file = processed_info.get("md_file")
+    if not meta_json or not md_file:
+        return False
+    if meta_json not in dir_files(META_DIR) or md_file not in dir_files(MD_DIR):
+        return False
+    if processed_info.get("keyinfo", {}).get("has_toc", True):
+        toc_trans_xml = processed_info.get("toc_trans_xml")
+        if not toc_trans_xml or toc_trans_xml not in dir_files(TOC_DIR):
+            return False
+    return True
+
+class PhaseTimer:
+    """阶段计时器，可多次 start/stop 累加，也可用作 with 上下文"""
+    __slots__ = ("_start", "elapsed_ns")
+    
+    def __init__(self):
+        self._start = 0
+        self.elapsed_ns = 0
+    
+    def start(self) -> "PhaseTimer":
+        self._start = time.perf_counter_ns()
+        return self
+    
+    def stop(self) -> "PhaseTimer":
+        self.elapsed_ns += time.perf_counter_ns() - self._start
+        return self
+    
+    @property
+    def seconds(self) -> float:
+        return self.elapsed_ns / 1e9
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
+
+def _merge_entry(existing: dict, new: dict):
+    """
+    智能合并条目，保留非空值：
+    status 中为 True 的状态都会保留；keyinfo 按子键覆盖；
+    其他字段（包括 standard_name）只有旧值为空时才用新值
+    """
+    for key, value in new.items():
+        if key == "status":
+            status_old = existing.setdefault("status", {})
+            for status_key, status_value in (value or {}).items():
+                if status_value:
+                    status_old[status_key] = True
+        elif key == "keyinfo":
+            existing.setdefault("keyinfo", {}).update(value or {})
+        elif not existing.get(key):
+            existing[key] = value
+
+def _filled_count(entry: dict) -> int:
+    """条目中非空字段的个数，用于去重时挑选保留的条目"""
+    return sum(1 for v in entry.values() if v)
+
+def _dedupe_entries(entries: list) -> Tuple[list, dict]:
+    """
+    启动时一次性去重：按 norm_isbn / books_id / standard_name 分组，
+    每组保留非空字段最多的条目，其余条目合并进去后丢弃；保持原有先后顺序
+    
+    Returns:
+        (保留的条目列表, 被合并条目的 standard_name -> 保留条目)
+    """
+    groups = defaultdict(list)
+    no_key = []
+    for entry in entries:
+        key = entry.get("norm_isbn") or entry.get("books_id") or entry.get("standard_name")
+        if key:
+            groups[key].append(entry)
+        else:
+            no_key.append(entry)
+    
+    winners = []
+    aliases = {}
+    for key, group in groups.items():
+        if len(group) > 1:
+            # sorted 是稳定排序，字段数相同时保留先出现的条目
+            group = sorted(group, key=_filled_count, reverse=True)
+            logger.debug(f"processing.json 中 {key} 有 {len(group)} 条记录，合并为一条")
+        winner = group[0]
+        keyinfo = dict(winner.get("keyinfo") or {})
+        for loser in group[1:]:
+            _merge_entry(winner, loser)
+            if loser.get("standard_name"):
+                aliases[loser["standard_name"]] = winner
+        if len(group) > 1 and keyinfo:
+            # keyinfo 以保留条目自己的值为准，其余条目只补充缺少的子键
+            winner["keyinfo"].update(keyinfo)
+        winners.append(winner)
+    return winners + no_key, aliases
+
+class ProcessingStore:
+    """
+    processing.json 的内存索引：启动时只读一次文件，按 standard_name / norm_isbn / books_id 建立索引，
+    查找和合并都是 O(1)，索引中的条目与列表中的条目是同一个对象
+    """
+    
+    def __init__(self, json_path: Path):
+        self.json_path = json_path
+        self.entries = []
+        if json_path.exists():
+            try:
+                self.entries = load_json_file(json_path)
+            except Exception as e:
+                logger.debug(f"读取 processing.json 时出错: {e}")
+                self.entries = []
+        raw_count = len(self.entries)
+        self.entries, aliases = _dedupe_entries(self.entries)
+        self.by_name = {}
+        self.by_isbn = {}
+        self.by_id = {}
+        # 加载时去重不算改动：只导入本模块（如读取配置）的脚本退出时不能写回文件；
+        # 有新的改动时 flush 自然会写回去重后的条目
+        self.dirty = False
+        if len(self.entries) != raw_count:
+            logger.info(f"processing.json 去重：{raw_count} -> {len(self.entries)} 条")
+        # 多线程处理文件时保护索引和写文件
+        self._lock = threading.RLock()
+        for entry in self.entries:
+            self._index(entry)
+        # 被合并条目的文件名仍指向保留的条目，这些文件不会被当成新文件重新处理
+        for name, entry in aliases.items():
+            self.by_name.setdefault(name, entry)
+    
+    def _index(self, entry: dict):
+        """把条目加入索引；同一个键以先出现的条目为准（加载时已去重，一般不会冲突）"""
+        if entry.get("standard_name"):
+            self.by_name.setdefault(entry["standard_name"], entry)
+        if entry.get("norm_isbn"):
+            self.by_isbn.setdefault(entry["norm_isbn"], entry)
+        if entry.get("books_id"):
+            self.by_id.setdefault(entry["books_id"], entry)
+    
+    def non_book_names(self) -> set:
+        """标记为非书籍（keyinfo.is_book 为 false）的文件名集合"""
+        with self._lock:
+            return {name for name, entry in self.by_name.items()
+                    if not entry.get("keyinfo", {}).get("is_book", True)}
+    
+    def find(self, filename: str) -> dict:
+        """按 standard_name 查找，返回副本，修改后需调用 upsert 才会合并进来"""
+        with self._lock:
+            entry = self.by_name.get(filename)
+            return copy.deepcopy(entry) if entry else {}
+    
+    def upsert(self, processed_info: dict):
+        """
+        合并或新增条目，只标记为待写入，由 flush 统一写回文件
+        
+        Args:
+            processed_info: 处理信息字典
+        """
+        with self._lock:
+            # 获取关键字段
+            norm_isbn = processed_info.get("norm_isbn", "")
+            books_id = processed_info.get("books_id", "")
+            standard_name = processed_info.get("standard_name", "")
+        
+            # 按ISBN或books_id查找匹配条目
+            entry = None
+            if norm_isbn:  # 如果ISBN不为空
+                entry = self.by_isbn.get(norm_isbn)
+                if entry is not None:
+                    logger.debug(f"发现重复的ISBN: {norm_isbn}，合并条目")
+            elif books_id:  # 如果没有ISBN但有books_id（非书籍类文档）
+                entry = self.by_id.get(books_id)
+                if entry is not None:
+                    logger.debug(f"发现重复的books_id: {books_id}，合并条目")
+        
+            if entry is None:  # 再按 standard_name 查找
+                entry = self.by_name.get(standard_name)
+            
+            if entry is not None:
+                _merge_entry(entry, processed_info)
+                self._index(entry)
+            else:
+                # 添加新条目，存副本，避免调用方后续修改直接影响已保存的数据
+                entry = copy.deepcopy(processed_info)
+                self.entries.append(entry)
+                self._index(entry)
+        
+            self.dirty = True
+    
+    def flush(self):
+        """有改动时写回文件；先写临时文件再替换，避免中途退出导致文件损坏"""
+        with self._lock:
+            if not self.dirty:
+                return
+            try:
+                atomic_write_bytes(self.json_path, json_dumps(self.entries, indent=True))
+                self.dirty = False
+            except Exception as e:
+                logger.error(f"写入 processing.json 时出错: {e}")
+
+# 全局只加载一次 processing.json，退出时写回未保存的改动
+store = ProcessingStore(PROCESSING_JSON_PATH)
+atexit.register(store.flush)
+
 def find_processed_file_info(filename: str) -> dict:
     """
     在processing.json中查找匹配的standard_name，并返回相关信息
@@ -61,21 +298,7 @@ def find_processed_file_info(filename: str) -> dict:
     Returns:
         dict: 匹配的条目信息，如果没有匹配项则返回空字典
     """
-    # 如果processing.json文件不存在，则返回空字典
-    if not PROCESSING_JSON_PATH.exists():
-        return {}
-    
-    try:
-        processing_data = load_json_file(PROCESSING_JSON_PATH)
-        # 遍历processing.json中的所有条目
-        for entry in processing_data:
-            # 检查standard_name是否匹配
-            if entry.get("standard_name") == filename:
-                return entry
-        return {}
-    except Exception as e:
-        logger.debug(f"读取或解析processing.json时出错: {e}")
-        return {}
+    return store.find(filename)
 
 def save_processing_info(processed_info: dict):
     """
@@ -84,162 +307,320 @@ def save_processing_info(processed_info: dict):
     Args:
         processed_info: 处理信息字典
     """
-    processing_data = []
-    
-    # 如果processing.json文件存在，则读取现有数据
-    if PROCESSING_JSON_PATH.exists():
-        try:
-            processing_data = load_json_file(PROCESSING_JSON_PATH)
-        except Exception as e:
-            logger.debug(f"读取 processing.json 时出错: {e}")
-            processing_data = []
-    
-    # 获取关键字段
-    norm_isbn = processed_info.get("norm_isbn", "")
-    books_id = processed_info.get("books_id", "")
-    standard_name = processed_info.get("standard_name", "")
-    
-    existing_isbn_index = None
-    existing_books_id_index = None
-    existing_name_index = None
-    merged = False
-    
-    # 首先按standard_name查找匹配条目
-    for i, entry in enumerate(processing_data):
-        if entry.get("standard_name") == standard_name:
-            existing_name_index = i
-            break
-    
-    # 然后按ISBN或books_id查找匹配条目
-    if norm_isbn:  # 如果ISBN不为空
-        for i, entry in enumerate(processing_data):
-            # 检查是否有相同的ISBN
-            if entry.get("norm_isbn") == norm_isbn:
-                existing_isbn_index = i
-                # 记录日志
-                logger.debug(f"发现重复的ISBN: {norm_isbn}，合并条目")
-                
-                # 智能合并条目，保留非空值
-                for key, value in processed_info.items():
-                    if key == "status":
-                        # 合并状态信息，确保所有为True的状态都被保留
-                        status_old = entry.get("status", {})
-                        status_new = processed_info.get("status", {})
-                        for status_key in status_new:
-                            if status_new[status_key]:
-                                status_old[status_key] = True
-                    elif key == "standard_name":
-                        # 保留原有的standard_name（如果已存在）
-                        if not entry.get("standard_name"):
-                            entry[key] = value
-                    else:
-                        # 对于其他字段，只有当新值非空且旧值为空时才更新
-                        if value and not entry.get(key):
-                            entry[key] = value
-                        elif not value and not entry.get(key):
-                            entry[key] = value
-                        
-                merged = True
-                break
-    elif books_id:  # 如果没有ISBN但有books_id（非书籍类文档）
-        for i, entry in enumerate(processing_data):
-            # 检查是否有相同的books_id
-            if entry.get("books_id") == books_id:
-                existing_books_id_index = i
-                # 记录日志
-                logger.debug(f"发现重复的books_id: {books_id}，合并条目")
-                
-                # 智能合并条目，保留非空值
-                for key, value in processed_info.items():
-                    if key == "status":
-                        # 合并状态信息，确保所有为True的状态都被保留
-                        status_old = entry.get("status", {})
-                        status_new = processed_info.get("status", {})
-                        for status_key in status_new:
-                            if status_new[status_key]:
-                                status_old[status_key] = True
-                    elif key == "standard_name":
-                        # 保留原有的standard_name（如果已存在）
-                        if not entry.get("standard_name"):
-                            entry[key] = value
-                    else:
-                        # 对于其他字段，只有当新值非空且旧值为空时才更新
-                        if value and not entry.get(key):
-                            entry[key] = value
-                        elif not value and not entry.get(key):
-                            entry[key] = value
-                        
-                merged = True
-                break
-    
-    # 根据是否合并过来决定更新策略
-    if merged and (existing_isbn_index is not None or existing_books_id_index is not None):
-        # 已经合并过了，不需要额外操作
-        pass
-    elif existing_name_index is not None:
-        # 更新已有的文件名条目，智能合并信息
-        existing_entry = processing_data[existing_name_index]
-        
-        # 智能合并所有字段
-        for key, value in processed_info.items():
-            if key == "status":
-                # 合并状态信息，确保所有为True的状态都被保留
-                status_old = existing_entry.get("status", {})
-                status_new = processed_info.get("status", {})
-                for status_key in status_new:
-                    if status_new[status_key]:
-                        status_old[status_key] = True
-            else:
-                # 对于其他字段，只有当新值非空且旧值为空时才更新
-                if value and not existing_entry.get(key):
-                    existing_entry[key] = value
-                elif not value and not existing_entry.get(key):
-                    existing_entry[key] = value
-                    
-    elif existing_isbn_index is not None and not merged:
-        # 有相同ISBN但未合并（可能是首次处理），则更新该条目
-        processing_data[existing_isbn_index] = processed_info
-    elif existing_books_id_index is not None and not merged:
-        # 有相同books_id但未合并（可能是首次处理），则更新该条目
-        processing_data[existing_books_id_index] = processed_info
-    else:
-        # 添加新条目
-        processing_data.append(processed_info)
-    
-    # 写回文件
-    try:
-        with open(PROCESSING_JSON_PATH, 'w', encoding='utf-8') as f:
-            json.dump(processing_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"写入 processing.json 时出错: {e}")
+    store.upsert(processed_info)
 
-def check_entry_exists(file_path: Path, entry: str) -> bool:
+def load_entries(file_path: Path) -> set:
     """
-    检查文件中是否已存在要写入的条目
+    读取记录文件中的所有条目（去除首尾空白，忽略空行）
     
     Args:
-        file_path: 要检查的文件路径
-        entry: 要查找的条目字符串
+        file_path: 记录文件路径
         
     Returns:
-        bool: 如果文件中存在该条目返回True，否则返回False
+        set: 条目集合，文件不存在或读取失败时返回空集合
     """
     if not file_path.exists():
-        return False
+        return set()
     
     try:
         with open(file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            for line in lines:
-                # 去除行首尾空白字符进行比较
-                if line.strip() == entry.strip():
-                    return True
-        return False
+            return {line.strip() for line in f if line.strip()}
     except Exception as e:
-        logger.error(f"检查条目是否存在时出错: {e}")
-        return False
+        logger.error(f"读取记录文件时出错: {e}")
+        return set()
+
+# 暂时无法处理的文件，启动时读入内存，之后只做集合判断
+SKIP_SET = load_entries(temporarily_file)
+_skip_lock = threading.Lock()
 
 ## 总的方法
+def sync_related_files(src_file: Path, processed_info: dict) -> int:
+    """
+    已全部处理完的书之后仍可能新增译文 PDF（带特定后缀的文件）：
+    与完整流程一样重命名相关文件，并写入已翻译好的中文目录
+    
+    Returns:
+        int: 重命名的相关文件数
+    """
+    renamed_count = rename_related_pdfs(src_file.parent, src_file, processed_info["standard_name"])
+    toc_trans_xml = processed_info.get("toc_trans_xml")
+    if processed_info.get("keyinfo", {}).get("has_toc", True) and toc_trans_xml:
+        for related_pdf in find_related_files(src_file.parent, src_file.stem):
+            pdf_import_toc_xml(TOC_DIR / toc_trans_xml, related_pdf)
+    return renamed_count
+
+def process_one(src_file: Path) -> Tuple[int, int]:
+    """处理单个 PDF 文件的四个阶段
+    
+    Args:
+        src_file: 基础 PDF 文件路径
+        
+    Returns:
+        Tuple[int, int]: (处理的文件数, 重命名的文件数)
+    """
+    processed_count = 0
+    renamed_count = 0
+    
+    logger.info("="*100)
+    # 在所有处理之前，先根据文件名去和 processing.json 中的 standard_name 去匹配，如果有匹配值，表明之前处理过，可以获取所有状态值
+    processed_info = find_processed_file_info(src_file.name)
+    if not processed_info:
+        # 如果在processing.json中没有找到该文件的记录，则创建一个新条目
+        # 初始化所有必要字段，包括可能通过后续步骤填充的 norm_isbn 和 books_id
+        processed_info = {
+            "status": {
+                "rename_done": False,                   
+                "parse_metadata": False,
+                "request_google_api": False,
+                "trans_toc": False,
+                "build_md": False
+            },
+            "books_id": "",              # 来自 Google Books API 或生成的 NLJR-xxxxx 格式 ID
+            "norm_isbn": "",             # 规范化的 ISBN，用于唯一标识书籍
+            "original_name": src_file.name,  # 原始文件名，用于跟踪重命名历史
+            "standard_name": src_file.name,   # 标准文件名，作为匹配键，标准格式为 {title} ({year}){edition_part} - {title_zh}.pdf
+            "safe_title": "",            # 安全文件名（用于 JSON/MD 文件）
+            "meta_json": "",             # 对应的元数据 JSON 文件名
+            "md_file": "",               # 生成的 Markdown 展示文件名
+            "toc_trans_xml":"",
+            "keyinfo": {
+                "is_book": True,        # 默认认为是书籍，有ISBN
+                "has_toc": True,        # 默认认为是有书签的
+            }
+        }
+        # save_processing_info(processed_info) !!注：这里不能保存，否则会多出很多空 books_id 的条目
+    else:
+        # 如果找到了已有的记录，确保它有 original_name 字段
+        if "original_name" not in processed_info:
+            # 对于旧记录，我们无法知道确切的原始名称，所以使用 standard_name 作为后备
+            processed_info["original_name"] = processed_info.get("standard_name", src_file.name)
+            # save_processing_info(processed_info) !!注：这里不能保存，否则会多出很多空 books_id 的条目
+
+    # 非书籍不再解析，避免调用大模型、api去解析浪费时间（已记录的非书籍在 main 中就已排除）
+    if not processed_info.get("keyinfo", {}).get("is_book", True):
+        return processed_count, renamed_count
+    
+    # 全部处理完毕（有 build_md 说明一切都已经处理完毕），可以跳过所有步骤
+    if is_fully_processed(processed_info):
+        logger.debug(f"文件 {src_file.name} 已全部处理完毕，只同步相关文件")
+        renamed_count += sync_related_files(src_file, processed_info)
+        return processed_count, renamed_count
+
+    # 获取状态信息
+    status = processed_info.get("status", {})
+    
+    meta = {}
+    
+    # 初始化时间统计
+    total_timer = PhaseTimer().start()
+    phase1 = PhaseTimer()  # 解析PDF元数据阶段
+    phase2 = PhaseTimer()  # 重命名文件阶段
+    phase3 = PhaseTimer()  # 翻译目录阶段
+    phase4 = PhaseTimer()  # 生成MD文件阶段
+    
+    ## ----------- 1、先解析 pdf，生成 meta.json -----------
+    phase1.start()
+    # 调用 cip_parser 中的方法，获取新文件名。只管获取，如果失败则会记录在跳过列表中
+    logger.info(f"----------- 1、先解析 pdf，生成 meta.json -----------")
+    meta_json_path = META_DIR
+    # 检查是否已经解析过元数据
+    if status.get("parse_metadata", False):
+        # 直接使用已有的meta_json文件；记录里没有文件名时才按 safe_title 推算
+        meta_json_path = META_DIR / (processed_info.get("meta_json") or f"{processed_info.get('safe_title')}.json")
+        logger.info(f"使用已存在的元数据文件: {meta_json_path.name}")
+        meta = load_json_file(meta_json_path)
+        processed_info["meta_json"] = meta_json_path.name
+        processed_info["books_id"] = meta.get('id', '')
+        processed_info["norm_isbn"] = meta.get("isbn", False)
+        processed_info["standard_name"] = meta.get("filename") # 每次都用元数据文件中的文件名；如果修改了pdf文件名，同步修改meta文件中的文件名
+        processed_info["safe_title"] = get_safe_title(meta)
+        save_processing_info(processed_info)
+    else:
+        # 需要重新解析PDF文件
+        logger.info(f"处理基础文件: {src_file.name}")
+        processed_info = cip_parser(src_file, processed_info)
+        if not processed_info:
+            cannot_be_processed_temporarily(src_file.name, "没有版权信息")
+            return processed_count, renamed_count
+        if not processed_info.get("safe_title"):
+            # 如果解析完成了，但是没有找到标题，则跳过。原因是 json 文件名来自 safe_title，而 safe_title 来自于标题名
+            # 将没有标题的文件名写入单独的文件中备查
+            cannot_be_processed_temporarily(src_file.name, "没有标题")
+            return processed_count, renamed_count
+        meta_json_path = META_DIR / processed_info.get("meta_json")
+        # save_processing_info(processed_info) !! 在没有获取标准名之前保存，都会产生两条记录，一条原文件名肯定没有books_id
+
+        if meta_json_path.is_file():  # 如果还是目录，说明还没解析赋值
+            meta = load_json_file(meta_json_path)
+            # 更新ISBN和books_id信息
+            norm_isbn = meta.get('isbn', '')
+            books_id = meta.get('id', '') or meta.get('books_id', '')
+            
+            # 如果不是书，肯定没有 ISBN，则跳过。大概率要通过手动来设置
+            if processed_info.get("keyinfo", {}).get("is_book", True):
+                if norm_isbn:
+                    processed_info["norm_isbn"] = norm_isbn
+                    processed_info["status"]["handle_isbn"] = True
+                else:
+                    # 没有ISBN的情况下，设置handle_isbn为True，并确保books_id存在
+                    processed_info["status"]["handle_isbn"] = True
+                
+            if books_id:
+                processed_info["books_id"] = books_id
+            else:
+                # 如果既没有ISBN也没有books_id，则生成一个
+                books_id = random_id_12()
+                processed_info["books_id"] = books_id
+            
+            # 更新状态：元数据解析完成
+            processed_info["status"]["parse_metadata"] = True
+            processed_info["standard_name"] = meta.get("filename")
+            processed_info["meta_json"] = meta_json_path.name
+            processed_info["safe_title"] = get_safe_title(meta)
+            # 保存更新后的状态
+            save_processing_info(processed_info)
+        else:
+            logger.debug(f"元数据解析失败: {src_file}")
+            # 可能需要在这里处理失败情况，比如跳过当前文件
+            return processed_count, renamed_count
+    
+    phase1.stop()
+    
+    # 阶段 1 之后 processed_info 不会再被替换，常用字段绑定为局部变量
+    books_id = processed_info.get("books_id", "")
+    info_status = processed_info.setdefault("status", {})
+    keyinfo = processed_info.setdefault("keyinfo", {})
+    
+    # 封面只依赖元数据，趁重命名和目录翻译期间在后台下载
+    if not info_status.get("build_md", False):
+        prefetch_covers([meta])
+    
+    ## ----------- 2、再根据 meta.json 重命名 pdf 文件及相关文件 -----------
+    phase2.start()
+    logger.info(f"----------- 2、再根据 meta.json 重命名 pdf 文件及相关文件 -----------")
+    new_name = meta.get('filename')
+    new_file = src_file.with_name(new_name)
+    
+            # 检查是否启用了重命名功能
+    if not RENAME_PDF_FILES:
+        logger.debug(f"重命名功能已禁用，跳过重命名文件 {src_file.name}")
+    else:
+        # 检查是否已经完成重命名
+        if status.get("rename_done", False):
+            if processed_info.get("standard_name") :
+                logger.debug(f"文件 {src_file} 已经完成重命名，跳过重命名步骤")
+        elif status.get("rename_done", False) == False and new_name != src_file.name:  # 同一目录，只需比较文件名
+            try:
+                os.replace(src_file, new_file)
+            except OSError as e:
+                if e.errno == errno.ENAMETOOLONG:  # File name too long
+                    cannot_be_processed_temporarily(src_file.name, "文件名过长")
+                    return processed_count, renamed_count
+            if new_file.is_file():
+                renamed_count += 1
+                processed_count += 1
+                # 更新状态：重命名完成
+                info_status["rename_done"] = True
+                # 保存更新后的状态
+                save_processing_info(processed_info)
+        else:
+            logger.debug(f"重命名文件 {src_file} 发生未知情况，请查明原因:{processed_info}")
+
+    # 处理相关文件（带后缀的文件）
+    related_renamed_count = rename_related_pdfs(src_file.parent, src_file, processed_info["standard_name"])
+    renamed_count += related_renamed_count
+    # repo_related_renamed_count=rename_related_pdfs("/Volumes/personal_folder/Resources/Library/EBooks/翻译库/对比翻译", src_file, new_filename)
+    # renamed_count += repo_related_renamed_count
+    phase2.stop()
+    
+    ## ----------- 3、如果 pdf 有书目，获取书目，并翻译成中文 -----------
+    phase3.start()
+    logger.info(f"----------- 3、如果 pdf 有书目，获取书目，并翻译成中文 -----------")
+    prefix = books_id[-12:]
+    toc_trans_xml = TOC_DIR / f"{prefix}_trans.xml"
+    has_toc = True
+    if not info_status.get("trans_toc", False): # 如果没有处理过目录，才需要判断是否有书签
+        if keyinfo.get("toc_checked"):
+            # 已经打开检查过的文件直接用记录的结果，否则总是会卡1～2秒
+            has_toc = keyinfo.get("has_toc", True)
+        elif new_file.is_file():
+            has_toc = has_bookmarks(new_file)
+            keyinfo["has_toc"] = has_toc
+            keyinfo["toc_checked"] = True
+            save_processing_info(processed_info)
+        else:
+            has_toc = False
+            logger.info(f"文件 {new_file} 不存在目录，跳过翻译步骤")
+    
+    # 检查是否已经完成目录翻译
+    if has_toc:
+        check_tocxml = False
+        if status.get("trans_toc", False) and toc_trans_xml.is_file():
+            logger.info(f"文件 {src_file} 已经完成目录翻译，并且书目xml文件已存在，跳过翻译步骤")
+            processed_info["toc_trans_xml"] = toc_trans_xml.name
+            save_processing_info(processed_info)
+            check_tocxml = True
+        
+        if check_tocxml == False and new_file.is_file():
+            toc_trans_xml = translate_toc(new_file, prefix) 
+            # 更新状态：目录翻译完成
+            if toc_trans_xml.is_file():  # 确保翻译成功
+                info_status["trans_toc"] = True
+                processed_info["toc_trans_xml"] = toc_trans_xml.name 
+                save_processing_info(processed_info)
+                check_tocxml = True
+            else:
+                logger.debug(f"目录翻译文件不存在，翻译失败: {toc_trans_xml}")
+
+        # 如果有相关翻译完成的文件，写入新的中文目录
+        if check_tocxml and toc_trans_xml.is_file():
+            relate_files = find_related_files(src_file.parent, src_file.stem)
+            for related_pdf in relate_files:
+                if is_target_file(related_pdf.name):
+                    pdf_import_toc_xml(toc_trans_xml,related_pdf)
+                    continue
+    else:
+        keyinfo["has_toc"] = False
+        save_processing_info(processed_info)
+        
+    phase3.stop()
+    
+    ## ----------- 4、制作 md 文件，方便发布查看和编辑 -----------
+    phase4.start()
+    logger.info(f"----------- 4、制作 md 文件，方便发布查看和编辑文 -----------")
+    # 检查是否已经生成MD文件
+    check_md = False
+    if status.get("build_md", False):
+        # 优先使用记录中的 md 文件名，没有时才按 safe_title 推算
+        md_file = MD_DIR / (processed_info.get("md_file") or f"{processed_info.get('safe_title')}.md")
+        if md_file.is_file(): # 无论如何都能覆盖md文件，因为可能编辑过，除非没用自己删掉
+            logger.info(f"文件 {src_file} 已经生成 Markdown 文件 {md_file.name}，跳过生成步骤")
+            info_status["build_md"] = True
+            processed_info["md_file"] = md_file.name
+            save_processing_info(processed_info)
+            check_md = True
+        else:
+            logger.warn(f"processing.json 记录中的文件 {md_file.name} 不存在")
+    
+    if check_md == False:
+        md_file = build_markdown(meta)
+        if md_file.is_file():
+            # 更新状态：MD文件生成完成
+            info_status["build_md"] = True
+            processed_info["md_file"] = md_file.name
+            save_processing_info(processed_info)
+            logger.info(f"[info] 全流程跑完，文件 {meta.get('filename')} 生成 Markdown 文件成功 [ {md_file.name} ]")
+    phase4.stop()
+    
+    if check_md == False:
+        # 计算总耗时
+        total_time = total_timer.stop().seconds
+        # 输出各阶段耗时统计
+        logger.info(f"BOOK_ID:[ {books_id} ] 处理完成统计：\n  阶段1(解析PDF元数据)耗时 {phase1.seconds:.2f} 秒，\n  阶段2(重命名文件)耗时 {phase2.seconds:.2f} 秒，\n  阶段3(翻译目录)耗时 {phase3.seconds:.2f} 秒，\n  阶段4(生成MD文件)耗时 {phase4.seconds:.2f} 秒，\n  总耗时 {total_time:.2f} 秒")
+    
+    return processed_count, renamed_count
+
+
 def main():
     """遍历目录并重命名PDF文件
     
@@ -262,264 +643,31 @@ def main():
     if not base_dir.exists():
         logger.error("未找到有效的目录路径，请检查配置文件")
         return
+
+    # 真正开始处理前检查一次模型，失败则尽早退出
+    ensure_model(OLLAMA_BASE_URL, OLLAMA_MODEL)
     
     processed_count = 0
     renamed_count = 0
     
      # 遍历目录查找PDF文件
-    for src_file in base_dir.rglob("*.pdf"):
-        # 检查是否应该排除此文件（即是否为目标文件）
-        if is_target_file(src_file.name):
-            logger.debug(f"不属于目标文件，跳过: {src_file}")
-            continue
-        
-        if check_entry_exists(temporarily_file, src_file.name):
-            continue
-        
-        logger.info("="*100)
-        # 在所有处理之前，先根据文件名去和 processing.json 中的 standard_name 去匹配，如果有匹配值，表明之前处理过，可以获取所有状态值
-        processed_info = find_processed_file_info(src_file.name)
-        if not processed_info:
-            # 如果在processing.json中没有找到该文件的记录，则创建一个新条目
-            # 初始化所有必要字段，包括可能通过后续步骤填充的 norm_isbn 和 books_id
-            processed_info = {
-                "status": {
-                    "rename_done": False,                   
-                    "parse_metadata": False,
-                    "request_google_api": False,
-                    "trans_toc": False,
-                    "build_md": False
-                },
-                "books_id": "",              # 来自 Google Books API 或生成的 NLJR-xxxxx 格式 ID
-                "norm_isbn": "",             # 规范化的 ISBN，用于唯一标识书籍
-                "original_name": src_file.name,  # 原始文件名，用于跟踪重命名历史
-                "standard_name": src_file.name,   # 标准文件名，作为匹配键，标准格式为 {title} ({year}){edition_part} - {title_zh}.pdf
-                "safe_title": "",            # 安全文件名（用于 JSON/MD 文件）
-                "meta_json": "",             # 对应的元数据 JSON 文件名
-                "md_file": "",               # 生成的 Markdown 展示文件名
-                "toc_trans_xml":"",
-                "keyinfo": {
-                    "is_book": True,        # 默认认为是书籍，有ISBN
-                    "has_toc": True,        # 默认认为是有书签的
-                }
-            }
-            # save_processing_info(processed_info) !!注：这里不能保存，否则会多出很多空 books_id 的条目
-        else:
-            # 如果找到了已有的记录，确保它有 original_name 字段
-            if "original_name" not in processed_info:
-                # 对于旧记录，我们无法知道确切的原始名称，所以使用 standard_name 作为后备
-                processed_info["original_name"] = processed_info.get("standard_name", src_file.name)
-                # save_processing_info(processed_info) !!注：这里不能保存，否则会多出很多空 books_id 的条目
-
-        # 后面添加一个不是书籍的列表，供解析，避免调用大模型、api去解析浪费时间
-        if processed_info.get("keyinfo", {}).get("is_book", True):
-            # 添加书籍列表
-            # BOOK_LIST.append(src_file)
-            pass
-        else:
-            # 添加非书籍列表
-            # NON_BOOK_LIST.load(src_file)
-            continue
-
-        # 获取状态信息
-        status = processed_info.get("status", {})
-        
-        meta = {}
-        
-        # 初始化总计数器和时间统计
-        total_start_time = time.time()
-        phase1_time = 0  # 解析PDF元数据阶段时间
-        phase2_time = 0  # 重命名文件阶段时间
-        phase3_time = 0  # 翻译目录阶段时间
-        phase4_time = 0  # 生成MD文件阶段时间
-        
-        ## ----------- 1、先解析 pdf，生成 meta.json -----------
-        phase1_start = time.time()  # 阶段1开始时间
-        # 调用 cip_parser 中的方法，获取新文件名。只管获取，如果失败则会记录在跳过列表中
-        logger.info(f"----------- 1、先解析 pdf，生成 meta.json -----------")
-        meta_json_path = WIKI_BASE_PATH / "meta"
-        # 检查是否已经解析过元数据
-        if status.get("parse_metadata", False):
-            # 直接使用已有的meta_json文件
-            meta_json_path = WIKI_BASE_PATH / "meta" / processed_info.get("meta_json")
-            logger.info(f"使用已存在的元数据文件: {meta_json_path.name}")
-            meta = load_json_file(meta_json_path)
-            processed_info["books_id"] = meta.get('id', '')
-            processed_info["norm_isbn"] = meta.get("isbn", False)
-            processed_info["standard_name"] = meta.get("filename") # 每次都用元数据文件中的文件名；如果修改了pdf文件名，同步修改meta文件中的文件名
-            processed_info["safe_title"] = get_safe_title(meta)
-            save_processing_info(processed_info)
-        else:
-            # 需要重新解析PDF文件
-            logger.info(f"处理基础文件: {src_file.name}")
-            processed_info = cip_parser(src_file, processed_info)
-            if not processed_info:
-                cannot_be_processed_temporarily(src_file.name, "没有版权信息")
-                continue
-            if not processed_info.get("safe_title"):
-                # 如果解析完成了，但是没有找到标题，则跳过。原因是 json 文件名来自 safe_title，而 safe_title 来自于标题名
-                # 将没有标题的文件名写入单独的文件中备查
-                cannot_be_processed_temporarily(src_file.name, "没有标题")
-                continue
-            meta_json_path = WIKI_BASE_PATH / "meta" / processed_info.get("meta_json")
-            # save_processing_info(processed_info) !! 在没有获取标准名之前保存，都会产生两条记录，一条原文件名肯定没有books_id
-
-            if meta_json_path.is_file():  # 如果还是目录，说明还没解析赋值
-                meta = load_json_file(meta_json_path)
-                # 更新ISBN和books_id信息
-                norm_isbn = meta.get('isbn', '')
-                books_id = meta.get('id', '') or meta.get('books_id', '')
-                
-                # 如果不是书，肯定没有 ISBN，则跳过。大概率要通过手动来设置
-                if processed_info.get("keyinfo", {}).get("is_book", True):
-                    if norm_isbn:
-                        processed_info["norm_isbn"] = norm_isbn
-                        processed_info["status"]["handle_isbn"] = True
-                    else:
-                        # 没有ISBN的情况下，设置handle_isbn为True，并确保books_id存在
-                        processed_info["status"]["handle_isbn"] = True
-                    
-                if books_id:
-                    processed_info["books_id"] = books_id
-                else:
-                    # 如果既没有ISBN也没有books_id，则生成一个
-                    alphabet = string.ascii_letters + string.digits
-                    books_id = "NLJR-"+''.join(secrets.choice(alphabet) for _ in range(12))
-                    processed_info["books_id"] = books_id
-                
-                # 更新状态：元数据解析完成
-                processed_info["status"]["parse_metadata"] = True
-                processed_info["standard_name"] = meta.get("filename")
-                processed_info["meta_json"] = meta_json_path.name
-                processed_info["safe_title"] = get_safe_title(meta)
-                # 保存更新后的状态
-                save_processing_info(processed_info)
-            else:
-                logger.debug(f"元数据解析失败: {src_file}")
-                # 可能需要在这里处理失败情况，比如跳过当前文件
-                continue
-        
-        phase1_end = time.time()  # 阶段1结束时间
-        phase1_time += (phase1_end - phase1_start)  # 累加阶段1时间
-        
-        ## ----------- 2、再根据 meta.json 重命名 pdf 文件及相关文件 -----------
-        phase2_start = time.time()  # 阶段2开始时间
-        logger.info(f"----------- 2、再根据 meta.json 重命名 pdf 文件及相关文件 -----------")
-        new_file = Path(src_file.parent / meta.get('filename'))
-        
-                # 检查是否启用了重命名功能
-        if not RENAME_PDF_FILES:
-            logger.debug(f"重命名功能已禁用，跳过重命名文件 {src_file.name}")
-        else:
-            # 检查是否已经完成重命名
-            if status.get("rename_done", False):
-                if processed_info.get("standard_name") :
-                    logger.debug(f"文件 {src_file} 已经完成重命名，跳过重命名步骤")
-            elif status.get("rename_done", False) == False and new_file != src_file:
-                try:
-                    src_file.rename(new_file)
-                except OSError as e:
-                    if e.errno == 36:  # File name too long
-                        cannot_be_processed_temporarily(src_file.name, "文件名过长")
-                        continue
-                if new_file.is_file():
-                    renamed_count += 1
-                    processed_count += 1
-                    # 更新状态：重命名完成
-                    processed_info["status"]["rename_done"] = True
-                    # 保存更新后的状态
-                    save_processing_info(processed_info)
-            else:
-                logger.debug(f"重命名文件 {src_file} 发生未知情况，请查明原因:{processed_info}")
-
-        # 处理相关文件（带后缀的文件）
-        related_renamed_count = rename_related_pdfs(src_file.parent, src_file, processed_info["standard_name"])
-        renamed_count += related_renamed_count
-        # repo_related_renamed_count=rename_related_pdfs("/Volumes/personal_folder/Resources/Library/EBooks/翻译库/对比翻译", src_file, new_filename)
-        # renamed_count += repo_related_renamed_count
-        phase2_end = time.time()  # 阶段2结束时间
-        phase2_time += (phase2_end - phase2_start)  # 累加阶段2时间
-        
-        ## ----------- 3、如果 pdf 有书目，获取书目，并翻译成中文 -----------
-        phase3_start = time.time()  # 阶段3开始时间
-        logger.info(f"----------- 3、如果 pdf 有书目，获取书目，并翻译成中文 -----------")
-        prefix = processed_info.get('books_id')[-12:]
-        toc_trans_xml = TOC_DIR / f"{prefix}_trans.xml"
-        has_toc = True
-        if processed_info.get("trans_toc","") == False: # 如果没有处理过目录，才需要判断是否有书签，否则总是会卡1～2秒
-            if new_file.is_file():
-                has_toc = has_bookmarks(new_file)
-            else:
-                has_toc = False
-                logger.info(f"文件 {new_file} 不存在目录，跳过翻译步骤")
-        
-        # 检查是否已经完成目录翻译
-        if has_toc:
-            check_tocxml = False
-            if status.get("trans_toc", False) and toc_trans_xml.is_file():
-                logger.info(f"文件 {src_file} 已经完成目录翻译，并且书目xml文件已存在，跳过翻译步骤")
-                processed_info["toc_trans_xml"] = toc_trans_xml.name
-                save_processing_info(processed_info)
-                check_tocxml = True
-            
-            if check_tocxml == False and new_file.is_file():
-                toc_trans_xml = translate_toc(new_file, prefix) 
-                # 更新状态：目录翻译完成
-                if toc_trans_xml.is_file():  # 确保翻译成功
-                    processed_info["status"]["trans_toc"] = True
-                    processed_info["toc_trans_xml"] = toc_trans_xml.name 
-                    save_processing_info(processed_info)
-                    check_tocxml = True
-                else:
-                    logger.debug(f"目录翻译文件不存在，翻译失败: {toc_trans_xml}")
-
-            # 如果有相关翻译完成的文件，写入新的中文目录
-            if check_tocxml and toc_trans_xml.is_file():
-                relate_files = find_related_files(src_file.parent, src_file.stem)
-                for related_pdf in relate_files:
-                    if is_target_file(related_pdf.name):
-                        pdf_import_toc_xml(toc_trans_xml,related_pdf)
-                        continue
-        else:
-            processed_info["keyinfo"]["has_toc"] = False
-            
-        phase3_end = time.time()  # 阶段3结束时间
-        phase3_time += (phase3_end - phase3_start)  # 累加阶段3时间
-        
-        ## ----------- 4、制作 md 文件，方便发布查看和编辑 -----------
-        phase4_start = time.time()  # 阶段4开始时间
-        logger.info(f"----------- 4、制作 md 文件，方便发布查看和编辑文 -----------")
-        # 检查是否已经生成MD文件
-        check_md = False
-        if status.get("build_md", False):
-            md_file = MD_DIR / f"{processed_info.get('safe_title')}.md"
-            if md_file.is_file(): # 无论如何都能覆盖md文件，因为可能编辑过，除非没用自己删掉
-                logger.info(f"文件 {src_file} 已经生成 Markdown 文件 {md_file.name}，跳过生成步骤")
-                processed_info["status"]["build_md"] = True
-                processed_info["md_file"] = md_file.name
-                save_processing_info(processed_info)
-                check_md = True
-            else:
-                logger.warn(f"processing.json 记录中的文件 {md_file.name} 不存在")
-        
-        if check_md == False:
-            md_file = build_markdown(meta)
-            if md_file.is_file():
-                # 更新状态：MD文件生成完成
-                processed_info["status"]["build_md"] = True
-                processed_info["md_file"] = md_file.name
-                save_processing_info(processed_info)
-                logger.info(f"[info] 全流程跑完，文件 {meta.get('filename')} 生成 Markdown 文件成功 [ {processed_info.get('safe_title')}.md ]")
-        phase4_end = time.time()  # 阶段4结束时间
-        phase4_time += (phase4_end - phase4_start)  # 累加阶段4时间
-        
-        if check_md == False:
-            # 计算总耗时
-            total_end_time = time.time()
-            total_time = total_end_time - total_start_time
-            # 输出各阶段耗时统计
-            logger.info(f"BOOK_ID:[ {processed_info.get("books_id")} ] 处理完成统计：\n  阶段1(解析PDF元数据)耗时 {phase1_time:.2f} 秒，\n  阶段2(重命名文件)耗时 {phase2_time:.2f} 秒，\n  阶段3(翻译目录)耗时 {phase3_time:.2f} 秒，\n  阶段4(生成MD文件)耗时 {phase4_time:.2f} 秒，\n  总耗时 {total_time:.2f} 秒")
-                
+    # 先排除目标文件（即带特定后缀的译文文件）、暂时无法处理的文件和非书籍，只留下需要处理的基础文件
+    non_books = store.non_book_names()
+    # 先把目录遍历完再开始处理，避免长时间处理期间一直占用目录句柄
+    pdf_files = [p for p in walk_pdfs(base_dir)
+                 if not is_target_file(p.name) and p.name.strip() not in SKIP_SET and p.name not in non_books]
+    if LLM_BATCH_SIZE > 1:
+        # 还没解析过元数据的文件，先把版权页打包交给大模型解析，结果写入缓存供后面逐个处理时使用
+        pending = [p for p in pdf_files if not store.find(p.name).get("status", {}).get("parse_metadata")]
+        prefetch_metadata_llm(pending, LLM_BATCH_SIZE)
+    # 各文件相互独立，耗时主要在等待大模型/网络，可用多线程并行；BATCH_WORKERS=1 时与逐个处理一致
+    with ThreadPoolExecutor(max_workers=max(1, BATCH_WORKERS)) as executor:
+        for processed, renamed in executor.map(process_one, pdf_files):
+            processed_count += processed
+            renamed_count += renamed
+            # 每处理完一个文件写一次
+            store.flush()
+    
     logger.debug(f"处理完成。总共处理了 {processed_count} 个文件，重命名了 {renamed_count} 个文件。")
     
 def cannot_be_processed_temporarily(entry: str, reason: str = ""):
@@ -532,10 +680,12 @@ def cannot_be_processed_temporarily(entry: str, reason: str = ""):
         reason: 无法处理的原因（用于日志记录）
     """
     # 检查文件是否已存在于暂时无法处理的记录文件中
-    if not check_entry_exists(temporarily_file, entry):
-        logger.error(f"跳过文件 ({reason}): {entry}")
-        with open(temporarily_file, "a", encoding="utf-8") as f:
-            f.write(f"{entry}\n")
+    with _skip_lock:
+        if entry.strip() not in SKIP_SET:
+            logger.error(f"跳过文件 ({reason}): {entry}")
+            SKIP_SET.add(entry.strip())
+            with open(temporarily_file, "a", encoding="utf-8") as f:
+                f.write(f"{entry}\n")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,19 +4,19 @@
 用法: python pdf2meta_ollama.py xxx.pdf
 输出: output/xxx.json  +  output/the-art-of-xxx.md
 """
-import fitz, re, json, sys, requests
-from rapidocr_onnxruntime import RapidOCR
+import re, json, sys, os, functools, threading, requests
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Union, Any
 from pathlib import Path
 # 导入公共模型检查工具
-from _utils import logger, check_model_exists, get_pdf_page_count, get_safe_title, get_text_md5, deep_clean_title, has_explanatory_note
-from _utils import OLLAMA_BASE_URL, OLLAMA_MODEL, WIKI_BASE_PATH, DEEPSEEK_API_KEY,PROXIES
+from _utils import logger, ensure_model, similarity_ratio, inspect_pdf, remember_pdf_info, get_pdf_page_count, get_safe_title, get_text_md5, deep_clean_title, has_explanatory_note, json_loads, json_dumps, atomic_write_bytes
+from _utils import OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_HTTP_TIMEOUT, WIKI_BASE_PATH, DEEPSEEK_API_KEY,PROXIES, PDF_LOCK, LLM_BATCH_SIZE, cached_post_json, cached_get_json, cached_generate_json_object, seed_post_cache, HTTP_SESSION
 
-# 立即执行检查
-check_model_exists(OLLAMA_BASE_URL, OLLAMA_MODEL)
 
 # ------------ 变量 -------------
 OCR_DPI    = 200
+OCR_DPI_FAST = 150 # OCR 先用低分辨率试一遍，找不到版权页再用 OCR_DPI
+PRE_COPYRIGHT_PAGE_CHARS = 2000 # 版权页之前的每一页最多保留的字符数
 MAX_FILENAME_LENGTH = 255 # 生成的文件名超长处理
 
 # 基于基础目录定义存储路径
@@ -28,70 +28,114 @@ if not MD_DIR.exists():
     raise SystemExit(1)
 
 # -------------- OCR + 版权页定位 --------------
-ocr_engine = RapidOCR()
-def find_copyright_page(pdf_path: Path):
-    doc = fitz.open(pdf_path)
+_ocr_engine = None
+_ocr_lock = threading.Lock()
+
+def _create_ocr_engine():
+    """
+    装了 rapidocr_openvino 就优先用（Intel CPU 上比 onnxruntime 快）；
+    否则用 rapidocr_onnxruntime，有 CUDA / DirectML 时启用，并让推理用满所有 CPU 核
+    """
+    try:
+        from rapidocr_openvino import RapidOCR  # 可选依赖
+        logger.info("OCR 使用 OpenVINO 推理")
+        return RapidOCR()
+    except ImportError:
+        pass
+    
+    from rapidocr_onnxruntime import RapidOCR
+    from onnxruntime import get_available_providers
+    providers = get_available_providers()
+    options = {"intra_op_num_threads": os.cpu_count() or -1}
+    for provider, flag in (("CUDAExecutionProvider", "use_cuda"), ("DmlExecutionProvider", "use_dml")):
+        if provider in providers:
+            options.update({f"det_{flag}": True, f"cls_{flag}": True, f"rec_{flag}": True})
+            break
+    logger.info(f"OCR 可用推理后端: {providers}")
+    return RapidOCR(**options)
+
+def get_ocr():
+    """首次需要 OCR 时才加载 RapidOCR（会加载多个 ONNX 模型，耗时且占内存）"""
+    global _ocr_engine
+    with _ocr_lock:
+        if _ocr_engine is None:
+            _ocr_engine = _create_ocr_engine()
+    return _ocr_engine
+
+# 版权页标志，一次扫描同时匹配所有关键词，不用先把整页转成小写
+COPYRIGHT_RE = re.compile(r"isbn|©|copyright", re.IGNORECASE)
+def find_copyright_page(pdf):
+    """pdf 可以是路径，也可以是已经打开的 fitz.Document（此时由调用方负责关闭）"""
+    import fitz  # PyMuPDF，延迟导入，只查看帮助或不解析 PDF 时无需加载
+    if not isinstance(pdf, fitz.Document):
+        with fitz.open(pdf) as doc:
+            return find_copyright_page(doc)
+    doc = pdf
     
     # 限制搜索范围为前10页或总页数（取较小值）
     max_pages = min(10, doc.page_count)
     
     # 存储所有已解析页面的文字内容
     all_text_before_copyright = []
-    copyright_found = False
+    txt = ""
         
     # 1. 先找文字页
-    for idx, page in enumerate(doc):
-        # 如果超出限制页数则停止
-        if idx >= max_pages:
-            break
-            
-        txt = page.get_text()
-   
-        # 检查是否有明显的版权标志
-        if ("©" in txt or 
-            "Copyright" in txt or 
-            "copyright" in txt.lower() or
-            "ISBN" in txt or
-            "isbn" in txt.lower()):
-            copyright_found = True
+    # 只加载前 max_pages 页，不再为了判断是否超出限制而多加载一页
+    for idx in range(max_pages):
+        txt = doc.load_page(idx).get_text()
         
-        # 如果发现了版权标志并且文本中包含ISBN相关信息
-        if copyright_found and ("ISBN" in txt or "isbn" in txt.lower()):
-            # 找到版权页，返回之前所有页面的文字加上当前页文字
-            all_text_before_copyright.append(txt)
-            return "\n".join(all_text_before_copyright)
-        elif copyright_found and ("©" in txt or "Copyright" in txt or "copyright" in txt.lower()):
-            # 找到版权页，返回之前所有页面的文字加上当前页文字
+        # 检查是否有明显的版权标志；版权信息可能在页面底部，所以整页提取
+        if COPYRIGHT_RE.search(txt):
+            # 找到版权页，立即返回之前所有页面的文字加上当前页文字（书名常在版权页之前的扉页上），后面的页不再提取
             all_text_before_copyright.append(txt)
             return "\n".join(all_text_before_copyright)
-        else:
-            # 未找到版权页，将当前页面文字加入列表
-            all_text_before_copyright.append(txt)
+        
+        # 版权页之前的页面只是给大模型提供书名等上下文，长篇的前言、献词等只保留开头，减少提示词长度
+        all_text_before_copyright.append(txt[:PRE_COPYRIGHT_PAGE_CHARS])
             
     # 2. OCR 前 5 页（或者不超过max_pages）
     if not txt : # 只有在没有文本返回的情况下，才执行OCR
         logger.info(f"[info] 在前 {max_pages} 页面没有找到版权信息. Trying OCR...")
-        for idx in range(min(5, max_pages)):
-            pix = doc.load_page(idx).get_pixmap(dpi=OCR_DPI)
-            result, _ = ocr_engine(pix.tobytes("png"))
-            # 修复：检查result是否为None
-            if result is None:
-                logger.warn(f"OCR未能识别第 {idx+1} 页内容，可能是空白页，请检查文件。")
-                continue
-            txt = " ".join([line[1] for line in result])
-            # 检查OCR结果是否为版权页
-            if "©" in txt.lower() or "isbn" in txt.lower():
-                # 找到版权页，返回之前所有页面的文字
-                return "\n".join(all_text_before_copyright)
-            else:
-                # 如果前面没有通过文本提取找到版权页，这里也要注意避免重复添加
-                # 因为OCR的是前3页，而文本提取可能是全部前10页
-                # 为简化处理，这里不再添加OCR内容到all_text_before_copyright
-                pass
+        import numpy as np  # rapidocr 的依赖，只有走到 OCR 时才需要
+        ocr_engine = get_ocr()
+        # 先用较低 DPI 快速识别（光栅化耗时与 DPI 的平方成正比），找不到再用 OCR_DPI 重试；一旦命中立即返回，后面的页不再光栅化
+        for dpi in (OCR_DPI_FAST, OCR_DPI):
+            ocr_texts = []
+            for idx in range(min(5, max_pages)):
+                # 直接渲染灰度图并把像素交给 RapidOCR，省去 PNG 编码再解码；灰度图内存只有 RGB 的三分之一
+                pix = doc.load_page(idx).get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+                img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+                pix = None
+                result, _ = ocr_engine(img)
+                # 修复：检查result是否为None
+                if result is None:
+                    if dpi == OCR_DPI:
+                        logger.warn(f"OCR未能识别第 {idx+1} 页内容，可能是空白页，请检查文件。")
+                    continue
+                txt = " ".join([line[1] for line in result])
+                ocr_texts.append(txt)
+                # 检查OCR结果是否为版权页
+                if COPYRIGHT_RE.search(txt):
+                    # 找到版权页，返回 OCR 识别出的前面几页加当前页的文字（文字层本来就是空的）
+                    logger.info(f"OCR 在第 {idx+1} 页（{dpi} DPI）找到版权信息")
+                    return "\n".join(ocr_texts)
             
     # 如果没找到版权页，返回已收集的前几页内容
     return "\n".join(all_text_before_copyright) if all_text_before_copyright else ""
 
+@functools.lru_cache(maxsize=256)
+def _copyright_page_cached(path: str, mtime_ns: int, size: int) -> str:
+    import fitz  # PyMuPDF，延迟导入
+    # 只打开一次：顺便记下页数、书签、元数据，后面 get_pdf_page_count / has_bookmarks 不必再打开
+    with PDF_LOCK, fitz.open(path) as doc:
+        remember_pdf_info(path, doc)
+        return find_copyright_page(doc)
+
+def get_copyright_page(pdf_path: Path) -> str:
+    """带缓存的 find_copyright_page：批量预解析时已经读过的版权页（包括 OCR）不再重复读取"""
+    st = os.stat(pdf_path)
+    return _copyright_page_cached(str(pdf_path), st.st_mtime_ns, st.st_size)
+
 
 # -------------- 提示词 --------------
 TRANS_SYS_PROMPT = (
@@ -142,24 +186,64 @@ TOC_SYS_PROMPT = (
            - publishedDate: "" (empty string)
            - country: "" (empty string)
            - edition: 1 (number)
-        5. Extract edition as a number (e.g., "Tenth Edition" -> 10)
+        5. "edition" MUST be an integer, never a word or a string. Examples:
+           "Tenth Edition" -> 10, "7th ed." -> 7, "Second edition" -> 2, "Revised edition" or no edition -> 1
         6. Format publishedDate as YYYY (4 digits)
         7. Extract all authors into the array
         8. Remove any non-digit characters from ISBN
     """
 )
 
+# -------------- 正则表达式（模块加载时编译一次） --------------
+_JSON_FENCE_RE     = re.compile(r"^```json\s*|\s*```$")            # 大模型输出外面的 ```json 包裹
+_QUOTED_TITLE_RE   = re.compile(r'"([^"]+)"\s*/\s*([^/\n]+)')      # "Economics"/Stephen L. Slavin
+_TITLE_LINE_RES    = (re.compile(r'^[A-Z][^A-Z]*[a-z]$'), re.compile(r'^[A-Z][a-zA-Z\s\-:]+$'))
+_AUTHOR_RES        = (re.compile(r'(?:Author|Written by|By)[:\s]+([^\n]+)'),
+                      re.compile(r'([A-Z][a-z]+(?:\s+[A-Z]\.?\s*[A-Z][a-z]+)+)'))
+_ISBN_RE           = re.compile(r'(?:ISBN|isbn)[:\s]*([0-9Xx\-]+)')
+_NON_ISBN_CHARS_RE = re.compile(r'[^0-9Xx]')
+_BARE_ISBN13_RE    = re.compile(r'(?<!\d)97[89][\d\-]{10,14}(?!\d)')        # 元数据关键词里不带 "ISBN" 前缀的 ISBN-13
+_COPYRIGHT_YEAR_RE = re.compile(r'Copyright.*?(\d{4})')
+_PUBLISHER_RES     = (re.compile(r'(?:Published by|Publisher)[:\s]+([^\n]+)', re.IGNORECASE),
+                      re.compile(r'(McGraw-Hill[/\s][^\n]+)', re.IGNORECASE),
+                      re.compile(r'((?:Prentice|Pearson|Addison|Wesley|Springer|Cambridge)[^\n]*)', re.IGNORECASE))
+_EDITION_RE        = re.compile(r'(?:Edition|edition)[:\s]*(\d+)(?:st|nd|rd|th)?', re.IGNORECASE)
+# 英文序数词版次（如 Tenth Edition -> 10）
+EDITION_WORDS = {
+    'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5,
+    'sixth': 6, 'seventh': 7, 'eighth': 8, 'ninth': 9, 'tenth': 10,
+    'eleventh': 11, 'twelfth': 12, 'thirteenth': 13, 'fourteenth': 14, 'fifteenth': 15
+}
+_EDITION_WORD_RE   = re.compile(r'\b(' + '|'.join(EDITION_WORDS) + r')\s+edition\b', re.IGNORECASE)
+_ORDINAL_WORD_RE   = re.compile(r'\b(' + '|'.join(EDITION_WORDS) + r')\b', re.IGNORECASE)
+_EDITION_ORDINAL_RE = re.compile(r'\b(\d+)(?:st|nd|rd|th)\s+ed(?:ition\b|\.)', re.IGNORECASE)  # 7th edition / 7th ed.
+_DIGITS_RE         = re.compile(r"(\d+)")
+_YEAR_RE           = re.compile(r'\d{4}')
+_FNAME_ILLEGAL_RE  = re.compile(r'[\\/:*?"<>|]')                   # 文件名中不允许的字符
+_TITLE_DASH_RE     = re.compile(r'[–—\-－―﹣－—]')                  # 各种破折号
+_TITLE_ZH_DASH_RE  = re.compile(r'[–—\-－―﹣－—；;]')                # 各种破折号和分号
+# 作者之间的分隔符（", " 或 " & "），以及作者文本中需要清理的字符
+_AUTHOR_SPLIT_RE   = re.compile(r", | & ")
+# 一次 translate 完成字符映射：各种换行、制表符、特殊空格换成普通空格，零宽字符直接删除
+_AUTHOR_TRANS      = str.maketrans({"\n": " ", "\r": " ", "\t": " ", "\u00a0": " ", "\u2009": " ",
+                                    "\u200b": None, "\ufeff": None})
+_SPACES_RE         = re.compile(r"\s+")
+
 # -------------- 大模型元数据解析 --------------
+# 从大模型解析结果中采用的字段
+_CIP_FIELDS = ("title", "subtitle", "authors", "isbn", "publisher", "publishedDate", "edition")
+
+def _metadata_llm_payload(cip_text: str) -> Dict[str, Any]:
+    return {
+        "model": OLLAMA_MODEL,
+        "prompt": TOC_SYS_PROMPT + "\n\n" + cip_text,
+        "stream": False
+    }
+
 def parse_metadata_llm(cip_text: str, meta:Dict[str, Any], is_book = True):
     try:
-        payload = {
-            "model": OLLAMA_MODEL,
-            "prompt": TOC_SYS_PROMPT + "\n\n" + cip_text,
-            "stream": False
-        }
-        resp = requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, timeout=300)
-        resp.raise_for_status()
-        response_data = resp.json()
+        payload = _metadata_llm_payload(cip_text)
+        response_data = cached_generate_json_object(f"{OLLAMA_BASE_URL}/api/generate", payload, timeout=OLLAMA_HTTP_TIMEOUT)
         raw = response_data.get("response", "").strip()
         
         # 检查响应是否为空
@@ -168,7 +252,7 @@ def parse_metadata_llm(cip_text: str, meta:Dict[str, Any], is_book = True):
             return meta  # 返回原始meta而不报错
             
         # 去掉可能的 ```json 包裹
-        raw = re.sub(r"^```json\s*|\s*```$", "", raw.strip())
+        raw = _JSON_FENCE_RE.sub("", raw.strip())
         
         # 检查清理后的JSON字符串是否为空
         if not raw:
@@ -177,26 +261,23 @@ def parse_metadata_llm(cip_text: str, meta:Dict[str, Any], is_book = True):
             
         # 尝试解析JSON
         try:
-            cip_json = json.loads(raw)
+            cip_json = json_loads(raw)
         except json.JSONDecodeError as e:
             logger.warn(f"JSON 解析失败，原始响应内容: {response_data.get('response', '')}")
             # 尝试从非标准响应中提取信息
             extracted_meta = extract_meta_from_non_json_response(response_data.get('response', ''))
             if extracted_meta:
                 # 合并提取的信息到meta中
-                for key, value in extracted_meta.items():
-                    meta[key] = value
+                meta.update(extracted_meta)
                 logger.info(f"成功从非标准响应中提取元数据: " + str(extracted_meta))
             # 如果响应看起来不像JSON，直接返回原始meta
             return meta
         
-        meta = _process_cip_fields("title", cip_json,meta)
-        meta = _process_cip_fields("subtitle", cip_json,meta)
-        meta = _process_cip_fields("authors", cip_json,meta)
-        meta = _process_cip_fields("isbn", cip_json,meta)
-        meta = _process_cip_fields("publisher", cip_json,meta)
-        meta = _process_cip_fields("publishedDate", cip_json,meta)
-        meta = _process_cip_fields("edition", cip_json,meta)
+        if not isinstance(cip_json, dict):
+            logger.warn(f"大模型返回的不是 JSON 对象: {raw}")
+            return meta
+        # 只取有值的字段
+        meta.update({key: cip_json[key] for key in _CIP_FIELDS if cip_json.get(key)})
         
         if is_book:
             # 大模型解析的 ISBN 多个是数组，单个是字符串，需要处理
@@ -208,8 +289,8 @@ def parse_metadata_llm(cip_text: str, meta:Dict[str, Any], is_book = True):
                 try:
                     meta["edition"] = int(edition_value)
                 except (ValueError, TypeError):
-                    # 尝试通过大模型从版权页，再次专门提取 edition
-                    edition = llm_handle_edition(cip_text)
+                    # 大模型偶尔返回文字形式的版次，本地解析（先看返回值，再看版权页原文）
+                    edition = parse_edition(edition_value, cip_text)
                     if edition:
                         meta["edition"] = edition
                         
@@ -224,14 +305,69 @@ def parse_metadata_llm(cip_text: str, meta:Dict[str, Any], is_book = True):
     logger.info(f"大模型解析版权页 ➜ " + str(meta))
     return meta
 
-def _process_cip_fields (key:str, cip_json:Dict, meta:Dict):
+def parse_metadata_llm_batch(cip_texts: List[str]) -> List[Dict[str, Any]]:
+    """
+    把多页版权页放进一个提示词，让大模型返回 JSON 数组，减少请求次数和提示词预处理开销
+    
+    Args:
+        cip_texts: 版权页文本列表
+        
+    Returns:
+        List[Dict]: 与 cip_texts 一一对应的解析结果（原始 JSON 对象）；解析失败的位置为 {}
+    """
+    if not cip_texts:
+        return []
+    items = "\n".join(f"[{i}]\n{text}" for i, text in enumerate(cip_texts, 1))
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": (TOC_SYS_PROMPT
+                   + f"\nThere are {len(cip_texts)} copyright pages below. Instead of a single JSON, "
+                   + "return a JSON array with exactly one object per item, in the same order. Items:\n"
+                   + items),
+        "stream": False
+    }
     try:
-        if cip_json.get(key):
-            meta[key] = cip_json[key]
+        raw = cached_post_json(f"{OLLAMA_BASE_URL}/api/generate", payload, timeout=OLLAMA_HTTP_TIMEOUT).get("response", "").strip()
+        raw = _JSON_FENCE_RE.sub("", raw)
+        results = json_loads(raw)
     except Exception as e:
-        logger.warn(f"[warn] 处理 {key} 字段时出错: {e}")
+        logger.warn(f"大模型批量解析版权页失败: {e}")
+        return [{} for _ in cip_texts]
+    if not isinstance(results, list) or len(results) != len(cip_texts):
+        logger.warn(f"大模型批量解析返回 {len(results) if isinstance(results, list) else 0} 条结果，与 {len(cip_texts)} 页版权页数量不一致，丢弃")
+        return [{} for _ in cip_texts]
+    return [r if isinstance(r, dict) else {} for r in results]
+
+def prefetch_metadata_llm(pdf_paths: List[Path], batch_size: int = LLM_BATCH_SIZE) -> int:
+    """
+    批处理开始前按 batch_size 打包解析版权页，并把每页的结果写入 parse_metadata_llm 的请求缓存，
+    之后逐个处理文件时直接命中缓存
     
-    return meta
+    Returns:
+        int: 预先得到结果的版权页数量
+    """
+    if batch_size <= 1 or not pdf_paths:
+        return 0
+    texts = []
+    for pdf_path in pdf_paths:
+        try:
+            text = get_copyright_page(pdf_path)
+        except Exception as e:
+            logger.debug(f"预读取版权页失败 {pdf_path}: {e}")
+            continue
+        if text:
+            texts.append(text)
+    
+    url = f"{OLLAMA_BASE_URL}/api/generate"
+    seeded = 0
+    for start in range(0, len(texts), batch_size):
+        chunk = texts[start:start + batch_size]
+        for text, cip_json in zip(chunk, parse_metadata_llm_batch(chunk)):
+            if cip_json:
+                seed_post_cache(url, _metadata_llm_payload(text), {"response": json_dumps(cip_json).decode("utf-8")})
+                seeded += 1
+    logger.info(f"批量预解析版权页完成：{seeded}/{len(texts)} 页")
+    return seeded
 
 # 添加新函数：从非标准响应中提取元数据
 def extract_meta_from_non_json_response(response_text: str) -> Dict[str, Any]:
@@ -249,7 +385,7 @@ def extract_meta_from_non_json_response(response_text: str) -> Dict[str, Any]:
     first_lines = ' '.join(lines[:10])  # 前10行
     
     # 查找类似 "Economics/Stephen L. Slavin" 这样的模式
-    title_match = re.search(r'"([^"]+)"\s*/\s*([^/\n]+)', first_lines)
+    title_match = _QUOTED_TITLE_RE.search(first_lines)
     if title_match:
         meta["title"] = title_match.group(1).strip()
         # 可以尝试提取作者，但已有专门处理作者的函数
@@ -263,51 +399,40 @@ def extract_meta_from_non_json_response(response_text: str) -> Dict[str, Any]:
             if 3 < len(line) < 100 and not any(word in line.lower() for word in 
                 ['based on', 'details provided', 'textbook', 'contents', 'information', 'request', 'question']):
                 # 检查是否看起来像书名（首字母大写等）
-                if re.match(r'^[A-Z][^A-Z]*[a-z]$', line) or re.match(r'^[A-Z][a-zA-Z\s\-:]+$', line):
+                if any(title_re.match(line) for title_re in _TITLE_LINE_RES):
                     meta["title"] = line
                     break
     
     # 提取作者
-    author_patterns = [
-        r'(?:Author|Written by|By)[:\s]+([^\n]+)',
-        r'([A-Z][a-z]+(?:\s+[A-Z]\.?\s*[A-Z][a-z]+)+)'
-    ]
-    
-    for pattern in author_patterns:
-        author_match = re.search(pattern, response_text)
+    for author_re in _AUTHOR_RES:
+        author_match = author_re.search(response_text)
         if author_match:
             author_str = author_match.group(1).strip()
             meta["authors"] = [author_str]  # 简化处理，后续会由handle_llm_authors处理
             break
     
     # 提取ISBN
-    isbn_match = re.search(r'(?:ISBN|isbn)[:\s]*([0-9Xx\-]+)', response_text)
+    isbn_match = _ISBN_RE.search(response_text)
     if isbn_match:
         # 清理ISBN，只保留数字和X
-        isbn_clean = re.sub(r'[^0-9Xx]', '', isbn_match.group(1))
+        isbn_clean = _NON_ISBN_CHARS_RE.sub('', isbn_match.group(1))
         if len(isbn_clean) in [10, 13]:
             meta["isbn"] = isbn_clean
     
     # 提取出版年份
-    year_match = re.search(r'Copyright.*?(\d{4})', response_text)
+    year_match = _COPYRIGHT_YEAR_RE.search(response_text)
     if year_match:
         meta["publishedDate"] = year_match.group(1)
     
     # 提取出版社
-    publisher_patterns = [
-        r'(?:Published by|Publisher)[:\s]+([^\n]+)',
-        r'(McGraw-Hill[/\s][^\n]+)',
-        r'((?:Prentice|Pearson|Addison|Wesley|Springer|Cambridge)[^\n]*)'
-    ]
-    
-    for pattern in publisher_patterns:
-        pub_match = re.search(pattern, response_text, re.IGNORECASE)
+    for publisher_re in _PUBLISHER_RES:
+        pub_match = publisher_re.search(response_text)
         if pub_match:
             meta["publisher"] = pub_match.group(1).strip()
             break
     
     # 提取版次
-    edition_match = re.search(r'(?:Edition|edition)[:\s]*(\d+)(?:st|nd|rd|th)?', response_text, re.IGNORECASE)
+    edition_match = _EDITION_RE.search(response_text)
     if edition_match:
         try:
             meta["edition"] = int(edition_match.group(1))
@@ -316,15 +441,9 @@ def extract_meta_from_non_json_response(response_text: str) -> Dict[str, Any]:
     
     # 从文本中提取版次（如 Tenth Edition -> 10）
     if not meta.get("edition"):
-        edition_words = {
-            'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5,
-            'sixth': 6, 'seventh': 7, 'eighth': 8, 'ninth': 9, 'tenth': 10,
-            'eleventh': 11, 'twelfth': 12, 'thirteenth': 13, 'fourteenth': 14, 'fifteenth': 15
-        }
-        for word, num in edition_words.items():
-            if re.search(r'\b' + word + r'\s+edition\b', response_text, re.IGNORECASE):
-                meta["edition"] = num
-                break
+        word_match = _EDITION_WORD_RE.search(response_text)
+        if word_match:
+            meta["edition"] = EDITION_WORDS[word_match.group(1).lower()]
     
     return meta
 
@@ -357,24 +476,11 @@ def handle_llm_authors(authors: Union[str, List[str]]) -> List[str]:
     if not isinstance(authors, str):
         return []
     
-    # 清理各种空格和控制字符
-    authors = authors.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
-    authors = authors.replace('\u00a0', ' ').replace('\u2009', ' ').replace('\u200b', '').replace('\ufeff', '')
-    
-    # 合并多个空格为单个空格
-    authors = re.sub(r'\s+', ' ', authors).strip()
-    
-    # 使用逗号和 & 符号分割作者
-    # 先按逗号分割，然后再按 & 符号分割
-    author_list = []
-    parts = authors.split(', ')
-    for part in parts:
-        if ' & ' in part:
-            # 如果部分中包含 & 符号，则进一步分割
-            sub_parts = part.split(' & ')
-            author_list.extend([author.strip() for author in sub_parts])
-        else:
-            author_list.append(part.strip())
+    # 清理各种空格和控制字符，合并多个空格为单个空格
+    authors = clean_author_text(authors)
+    
+    # 使用逗号和 & 符号分割作者，一次切分
+    author_list = [author.strip() for author in _AUTHOR_SPLIT_RE.split(authors)]
     
     # 过滤掉空字符串
     author_list = [author for author in author_list if author]
@@ -386,12 +492,9 @@ def clean_author_text(text: str) -> str:
     if not text:
         return ""
     
-    # 清理各种空格和控制字符
-    text = text.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
-    text = text.replace('\u00a0', ' ').replace('\u2009', ' ').replace('\u200b', '').replace('\ufeff', '')
-    
-    # 合并多个空格为单个空格
-    text = re.sub(r'\s+', ' ', text).strip()
+    # 清理各种空格和控制字符，再合并多个空格为单个空格
+    text = text.translate(_AUTHOR_TRANS)
+    text = _SPACES_RE.sub(' ', text).strip()
     
     return text
 
@@ -422,29 +525,25 @@ def llm_handle_isbn (isbn: Union[str, List[str], None]) -> str:
     normalized_isbns = []
     for i in isbns:
         # 移除非ISBN字符（保留数字和X）
-        clean_isbn = re.sub(r'[^0-9Xx]', '', str(i))
+        clean_isbn = _NON_ISBN_CHARS_RE.sub('', str(i))
         if len(clean_isbn) in [10, 13]:  # 有效ISBN长度
             normalized_isbns.append(clean_isbn)
     
+    # 大模型经常重复返回同一个 ISBN，按出现顺序去重，避免对同一个号码重复验证
+    normalized_isbns = list(dict.fromkeys(normalized_isbns))
+    
     # 优先选择ISBN13
     isbn13_candidates = [i for i in normalized_isbns if len(i) == 13]
     
-    # 如果有多个ISBN13，尝试验证哪个在Google Books中有结果
+    # 如果有多个ISBN13，按顺序验证，第一个在Google Books中有结果的即返回，其余不再请求
     if len(isbn13_candidates) > 1:
         for isbn13 in isbn13_candidates:
             if _validate_isbn_with_google_books(isbn13):
                 return isbn13
         # 如果都没有结果，返回第一个
-        return isbn13_candidates[0] if isbn13_candidates else ""
-    
-    # 如果只有一个ISBN13，直接返回
-    if len(isbn13_candidates) == 1:
-        # 验证有效性，如果无效则尝试找其他选项
-        if _validate_isbn_with_google_books(isbn13_candidates[0]):
-            return isbn13_candidates[0]
-        # 如果无效，继续查找其他可能的有效ISBN
+        return isbn13_candidates[0]
     
-    # 如果有单个ISBN13但未通过验证，也返回它（因为可能API暂时不可用）
+    # 只有一个ISBN13时无论验证结果如何都会返回它（验证不通过可能只是API暂时不可用），不必请求
     if isbn13_candidates:
         return isbn13_candidates[0]
     
@@ -460,113 +559,165 @@ def llm_handle_isbn (isbn: Union[str, List[str], None]) -> str:
     
     return ""
 
-# 新增：从文本中用本地 Ollama 推断 edition（仅返回数字或空）
-def llm_handle_edition(text):
+def parse_edition(edition_value, cip_text: str = "") -> int:
     """
-    将 title/subtitle/description 发给本地 Ollama，尝试提取版本号（例如 'seventh edition' -> 返回 '7'）。
-    返回数字字符串（例如 '7'）或空字符串。
+    本地解析版次，不再为此单独请求大模型：
+    先看大模型返回的 edition 值（如 "Tenth Edition"、"7th ed."、"Seventh"），再看版权页原文。
+    
+    Returns:
+        int: 版次数字；无法确定时返回 0
     """
-    if not text.strip():
-        return ""
-    prompt = (
-        "请从下面的书籍元信息文本中判断该书是否提到“第几版”或“第 N 版”（例如 'seventh edition'、'7th edition' 等）。"
-        " 如果能识别出版本，请仅返回数字，例如 7；如果无法确定或未提及，请仅返回空字符串。\n\n"
-        f"文本：\n{text}\n\n只返回例如 '7' 或 ''，不要其他说明。"
-    )
-    payload = {
-        "model": OLLAMA_MODEL,
-        "prompt": prompt,
-        "stream": False,
-        "options": {"temperature": 0.0}
-    }
-    try:
-        resp = requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, timeout=120)
-        resp.raise_for_status()
-        raw = resp.json().get("response", "").strip()
-        # 优先用数字
-        m = re.search(r"(\d+)", raw)
+    value = str(edition_value or "")
+    m = _DIGITS_RE.search(value)
+    if m:
+        return int(m.group(1))
+    m = _ORDINAL_WORD_RE.search(value)
+    if m:
+        return EDITION_WORDS[m.group(1).lower()]
+    
+    if cip_text:
+        m = _EDITION_ORDINAL_RE.search(cip_text)
         if m:
-            return m.group(1)
-        # 若没有数字，尝试常见序数词映射
-        s = raw.lower()
-        ord_map = {
-            "first": "1", "second": "2", "third": "3", "fourth": "4", "fifth": "5",
-            "sixth": "6", "seventh": "7", "eighth": "8", "ninth": "9", "tenth": "10"
-        }
-        for word, num in ord_map.items():
-            if word in s:
-                return num
-        return ""
-    except Exception as e:
-        logger.warn(f"LLM 解析 edition 失败: {e}")
-        return ""
+            return int(m.group(1))
+        m = _EDITION_WORD_RE.search(cip_text)
+        if m:
+            return EDITION_WORDS[m.group(1).lower()]
+        # "Edition: 3"；"edition 2010" 这类后面跟的是年份，不算
+        m = _EDITION_RE.search(cip_text)
+        if m and int(m.group(1)) < 100:
+            return int(m.group(1))
+    return 0
 
-# -------------- Google Books 补数据 --------------
-# 默认不带版本 edition，需要自己通过其他方式获取
-def parse_metadata_gogl(isbn=None):
+def _is_valid_isbn13(isbn: str) -> bool:
+    """ISBN-13 校验位检查"""
+    if len(isbn) != 13 or not isbn.isdigit():
+        return False
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(isbn[:12]))
+    return (10 - total % 10) % 10 == int(isbn[12])
+
+def isbn_from_pdf_metadata(pdf_path: Path) -> str:
     """
-    调用 Google Books API，仅返回核心字段，键名与官方保持一致。
-    参数优先使用 ISBN，不使用书名，不准确
+    从 PDF 文档元数据（标题、主题、关键词等）中找 ISBN-13，不少出版社会写在这里
+    
+    Returns:
+        str: 通过校验的 ISBN-13；没有时返回空字符串
     """
     try:
-        # 构造查询 URL
-        if isbn:
-            url = f"https://www.googleapis.com/books/v1/volumes?q=isbn:{requests.utils.quote(str(isbn))}"
-        else:
-            return {}
+        metadata = inspect_pdf(pdf_path)["metadata"]
+    except Exception as e:
+        logger.debug(f"读取 PDF 元数据失败: {e}")
+        return ""
+    for value in metadata.values():
+        if not value or not isinstance(value, str):
+            continue
+        for isbn_re in (_ISBN_RE, _BARE_ISBN13_RE):
+            for m in isbn_re.finditer(value):
+                isbn = _NON_ISBN_CHARS_RE.sub('', m.group(1) if m.groups() else m.group())
+                if _is_valid_isbn13(isbn):
+                    return isbn
+    return ""
 
-        rsp = requests.get(url, timeout=20, proxies=PROXIES)
-        rsp.raise_for_status()
-        data = rsp.json()
+# -------------- Google Books 补数据 --------------
+GOGL_API_URL     = "https://www.googleapis.com/books/v1/volumes?q="
+GOGL_TITLE_MATCH = 0.85  # 按书名查询时，返回的书名与大模型解析的书名相似度至少要达到这个值才采用
 
-        if data.get("totalItems", 0) == 0 or "items" not in data:
-            return {}
+def _gogl_query(query: str) -> list:
+    """查询 Google Books，返回 items 列表；失败或没有结果时返回 []"""
+    try:
+        data = cached_get_json(GOGL_API_URL + query, timeout=20, proxies=PROXIES)
+    except Exception as e:
+        logger.warn("Google Books 抓取失败:" + str(e))
+        return []
+    if data.get("totalItems", 0) == 0:
+        return []
+    return data.get("items", [])
 
-        vol = data["items"][0]          # 取第一条记录
-        vi  = vol.get("volumeInfo", {})
+def _gogl_pick_by_title(items: list, title: str):
+    """从书名查询结果中挑出书名与 title 足够相似的第一条记录，没有则返回 None"""
+    title = title.lower()
+    for vol in items[:5]:
+        vol_title = vol.get("volumeInfo", {}).get("title", "")
+        if vol_title and similarity_ratio(vol_title.lower(), title) >= GOGL_TITLE_MATCH:
+            return vol
+    return None
 
-        # 只提取你需要的字段，保持原名
-        result = {
-            "title"            : vi.get("title"),
-            "subtitle"         : vi.get("subtitle"),
-            "authors"          : vi.get("authors"),
-            "publisher"        : vi.get("publisher"),
-            "publishedDate"    : vi.get("publishedDate"),
-            "description"      : vi.get("description"),
-            "categories"       : vi.get("categories"),
-            #"imageLinks"       : vi.get("imageLinks"),
-            "language"         : vi.get("language"),
-            #"industryIdentifiers": vi.get("industryIdentifiers"),
-            "id"               : vol.get("id")   # Google Books 唯一 ID
-        }
-            
-        # 处理ISBN
-        # "industryIdentifiers": [
-        #   {
-        #     "type": "ISBN_10",
-        #     "identifier": "935260640X"
-        #   },
-        #   {
-        #     "type": "ISBN_13",
-        #     "identifier": "9789352606405"
-        #   }
-        # ]
-        isbns=vi.get("industryIdentifiers","")
-        if isbns:
-            for identifier in vi.get("industryIdentifiers"):
-                if identifier.get("type") == "ISBN_13":
-                    result["isbn"] = identifier.get("identifier")
-                    break
-                      
-        # 处理imagelink
-        cover_images = vi.get("imageLinks", "")
-        if cover_images:
-            result["imageLink"] = cover_images.get("thumbnail","")
+def _gogl_volume_meta(vol: Dict[str, Any]) -> Dict[str, Any]:
+    """把 Google Books 的一条记录转换为元数据，仅返回核心字段，键名与官方保持一致"""
+    vi  = vol.get("volumeInfo", {})
+
+    # 只提取你需要的字段，保持原名
+    result = {
+        "title"            : vi.get("title"),
+        "subtitle"         : vi.get("subtitle"),
+        "authors"          : vi.get("authors"),
+        "publisher"        : vi.get("publisher"),
+        "publishedDate"    : vi.get("publishedDate"),
+        "description"      : vi.get("description"),
+        "categories"       : vi.get("categories"),
+        #"imageLinks"       : vi.get("imageLinks"),
+        "language"         : vi.get("language"),
+        #"industryIdentifiers": vi.get("industryIdentifiers"),
+        "id"               : vol.get("id")   # Google Books 唯一 ID
+    }
         
+    # 处理ISBN
+    # "industryIdentifiers": [
+    #   {
+    #     "type": "ISBN_10",
+    #     "identifier": "935260640X"
+    #   },
+    #   {
+    #     "type": "ISBN_13",
+    #     "identifier": "9789352606405"
+    #   }
+    # ]
+    isbns=vi.get("industryIdentifiers","")
+    if isbns:
+        for identifier in vi.get("industryIdentifiers"):
+            if identifier.get("type") == "ISBN_13":
+                result["isbn"] = identifier.get("identifier")
+                break
+                  
+    # 处理imagelink
+    cover_images = vi.get("imageLinks", "")
+    if cover_images:
+        result["imageLink"] = cover_images.get("thumbnail","")
+    
 
-        # 去掉值为 None 的键，保持干净
-        return {k: v for k, v in result.items() if v is not None}
+    # 去掉值为 None 的键，保持干净
+    return {k: v for k, v in result.items() if v is not None}
 
+# 默认不带版本 edition，需要自己通过其他方式获取
+def parse_metadata_gogl(isbn=None, title=None, authors=None):
+    """
+    调用 Google Books API，仅返回核心字段，键名与官方保持一致。
+    参数优先使用 ISBN；书名查询不准确，只在 ISBN 查不到时作为后备，
+    并且要求返回的书名与大模型解析的书名足够相似。两个查询同时发出，总耗时与只查一次相当
+    """
+    if not isbn and not title:
+        return {}
+    try:
+        pool = ThreadPoolExecutor(max_workers=2)
+        isbn_future = pool.submit(_gogl_query, f"isbn:{requests.utils.quote(str(isbn))}") if isbn else None
+        title_future = None
+        if title:
+            query = f"intitle:{requests.utils.quote(title)}"
+            author = authors[0] if isinstance(authors, list) and authors else authors
+            if author and isinstance(author, str):
+                query += f"+inauthor:{requests.utils.quote(author)}"
+            title_future = pool.submit(_gogl_query, query)
+        # ISBN 命中时不必等书名查询结束（它的结果照样会写入缓存）
+        pool.shutdown(wait=False)
+        
+        vol = None
+        if isbn_future is not None:
+            items = isbn_future.result()
+            vol = items[0] if items else None   # 取第一条记录
+        if vol is None and title_future is not None:
+            vol = _gogl_pick_by_title(title_future.result(), title)
+            if vol is not None:
+                logger.info(f"ISBN 在 Google Books 中没有结果，按书名找到: {vol.get('volumeInfo', {}).get('title')}")
+        return _gogl_volume_meta(vol) if vol is not None else {}
     except Exception as e:
         logger.warn("Google Books 抓取失败:" + str(e))
         return {}
@@ -623,49 +774,63 @@ def parse_metadata(text, pdf_path):
         "llm_categories": []
     }
     
-    llm_meta = parse_metadata_llm(text, meta)
-    # Google Books 补数据
-    gogl_meta = parse_metadata_gogl(llm_meta.get("isbn"))
-    # 合并两个元数据源，优先使用Google Books的数据
-    # 先复制llm_meta的所有数据到meta
-    for key, value in llm_meta.items():
-        meta[key] = value
-    # 然后用gogl_meta的数据覆盖相同键的值（优先使用Google Books数据）
-    for key, value in gogl_meta.items():
-        if value is not None:  # 只有当gogl_meta中的值不是None时才覆盖
-            meta[key] = value
-    # 保存大模型的分类结果，以便后续合并使用；大模型自身的书籍类型分析，还比较准的
-    meta["llm_categories"] = llm_meta.get("categories", [])
-    # --- 合并完成 ---
-    
-    # 翻译简介，如果没有则使用英文description
-    description = meta.get("description","")
-    if description:
-        meta["description_zh"] = translate_with_llm(description) if description else ""
-    
-    title = meta.get("title")
-    if title: # 有title才需要后续处理的部分
-        # 合并title和subtitle进行翻译
-        full_title = title
-        if meta.get("subtitle"):
-            full_title = f"{full_title}: {meta['subtitle']}"
-        if description:
-            custom_prompt = f"1、当前翻译内容是书籍标题；2、请参考书籍简介：{description}，要求做到信雅达。"
+    # 读取页数、翻译简介与后面的网络请求互不依赖，放到线程池里与之重叠执行
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        page_count_future = pool.submit(get_pdf_page_count, pdf_path)
+    
+        # PDF 自带元数据里有 ISBN-13，并且 Google Books 能查到这本书时，不再调用大模型
+        gogl_meta = {}
+        pdf_isbn = isbn_from_pdf_metadata(pdf_path)
+        if pdf_isbn:
+            gogl_meta = parse_metadata_gogl(pdf_isbn)
+        if gogl_meta.get("title"):
+            logger.info(f"PDF 元数据中的 ISBN {pdf_isbn} 在 Google Books 中有结果，跳过大模型解析")
+            llm_meta = {"isbn": pdf_isbn}
+            # Google Books 不带版次，从版权页原文解析
+            edition = parse_edition("", text)
+            if edition:
+                llm_meta["edition"] = edition
         else:
-            custom_prompt = "当前翻译内容是书籍标题，要求做到信雅达。"
-        title_zh = translate_with_deepseek_api(full_title,custom_prompt) or translate_with_llm(full_title)
-        if has_explanatory_note(full_title, title_zh):
-            logger.warn(f"中文文件名{title_zh}有翻译注释，将使用本地大模型重新翻译")
-            title_zh = translate_with_llm(full_title,"请将以下书籍名称翻译成简体中文，要求做到信雅达，仅输出译文，禁止任何解释、括号、引号、备注、说明、标点扩展：")
-        meta["title_zh"] = deep_clean_title(title_zh) # 出现过生成的文件名出现连续空格的问题
+            llm_meta = parse_metadata_llm(text, meta)
+            # Google Books 补数据
+            gogl_meta = parse_metadata_gogl(llm_meta.get("isbn"), llm_meta.get("title"), llm_meta.get("authors"))
+        # 合并两个元数据源，优先使用Google Books的数据
+        # 先复制llm_meta的所有数据到meta，然后用gogl_meta中不为None的值覆盖
+        meta.update(llm_meta)
+        meta.update({key: value for key, value in gogl_meta.items() if value is not None})
+        # 保存大模型的分类结果，以便后续合并使用；大模型自身的书籍类型分析，还比较准的
+        meta["llm_categories"] = llm_meta.get("categories", [])
+        # --- 合并完成 ---
+    
+        # 翻译简介，如果没有则使用英文description；与下面的标题翻译同时进行
+        description = meta.get("description","")
+        description_future = pool.submit(translate_with_llm, description) if description else None
+    
+        title = meta.get("title")
+        if title: # 有title才需要后续处理的部分
+            # 合并title和subtitle进行翻译
+            full_title = title
+            if meta.get("subtitle"):
+                full_title = f"{full_title}: {meta['subtitle']}"
+            if description:
+                custom_prompt = f"1、当前翻译内容是书籍标题；2、请参考书籍简介：{description}，要求做到信雅达。"
+            else:
+                custom_prompt = "当前翻译内容是书籍标题，要求做到信雅达。"
+            title_zh = translate_with_deepseek_api(full_title,custom_prompt) or translate_with_llm(full_title)
+            if has_explanatory_note(full_title, title_zh):
+                logger.warn(f"中文文件名{title_zh}有翻译注释，将使用本地大模型重新翻译")
+                title_zh = translate_with_llm(full_title,"请将以下书籍名称翻译成简体中文，要求做到信雅达，仅输出译文，禁止任何解释、括号、引号、备注、说明、标点扩展：")
+            meta["title_zh"] = deep_clean_title(title_zh) # 出现过生成的文件名出现连续空格的问题
         
-        meta["filename"] = build_filename(meta)
-        meta["filenameMD5"] = get_text_md5(title)
-    else:
-        logger.error("缺少书籍标题，请检查大模型解析的元数据是否正确")
+            meta["filename"] = build_filename(meta)
+            meta["filenameMD5"] = get_text_md5(title)
+        else:
+            logger.error("缺少书籍标题，请检查大模型解析的元数据是否正确")
     
-    # 设置页数为PDF实际页数
-    meta["pageCount"] = get_pdf_page_count(pdf_path)
+        if description_future is not None:
+            meta["description_zh"] = description_future.result()
+        # 设置页数为PDF实际页数
+        meta["pageCount"] = page_count_future.result()
     
     isbn = meta.get("isbn", "")
     if isbn:
@@ -698,9 +863,7 @@ def translate_with_llm(text:str, custom_prompt = TRANS_USR_PROMPT):
         }
     }
     try:
-        resp = requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, timeout=300)
-        resp.raise_for_status()
-        result = resp.json()["response"].strip()
+        result = cached_post_json(f"{OLLAMA_BASE_URL}/api/generate", payload, timeout=OLLAMA_HTTP_TIMEOUT)["response"].strip()
         return result
     except Exception as e:
         logger.warn(f"LLM翻译失败: {e}")
@@ -710,7 +873,7 @@ def translate_with_deepseek_api(text:str, extra_prompt = ""):
     """
     使用 DeepSeek API 进行翻译
     """
-    headers = {"Authorization": f"Bearer {DEEPSEEK_API_KEY}", "Content-Type": "application/json"}
+    headers = {"Authorization": f"Bearer {DEEPSEEK_API_KEY}"}
     data = {
         "model": "deepseek-reasoner",
         "messages": [
@@ -721,10 +884,8 @@ def translate_with_deepseek_api(text:str, extra_prompt = ""):
     }
     #logger.info(翻译 ➜", data)
     try:
-        response = requests.post("https://api.deepseek.com/v1/chat/completions", headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        #logger.info(翻译 ➜", response.json())
-        result = response.json()["choices"][0]["message"]["content"]
+        response_data = cached_post_json("https://api.deepseek.com/v1/chat/completions", data, timeout=60, headers=headers)
+        result = response_data["choices"][0]["message"]["content"]
         return result
     except Exception as e:
         logger.error(f"翻译失败: {e}")
@@ -740,8 +901,8 @@ def save_meta_json(meta) -> Path:
     
     # 修改JSON文件名为与MD文件名一致的格式
     json_path = META_DIR / f"{safe_title}.json"
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+    # 原子写入：元数据文件存在即视为已处理，不能留下写了一半的文件
+    atomic_write_bytes(json_path, json_dumps(meta, indent=True))
     logger.info("已生成元数据文件" + json_path.name)
     logger.debug("元数据:" + str(meta))
     return json_path
@@ -774,10 +935,17 @@ def merge_categories(meta: Dict[str, object]) -> str:
 
 import secrets, string
 # 如果没有GoogleID，生成12位随机ID
+_ID_ALPHABET = string.ascii_letters + string.digits  # abc...ABC...012...9
+
 def random_id_12() -> str:
     """12 位 *URL-safe* 随机 ID（数字 + 大小写字母）"""
-    alphabet = string.ascii_letters + string.digits  # abc...ABC...012...9
-    return "NLJR-"+''.join(secrets.choice(alphabet) for _ in range(12))
+    # 只取一次系统随机数，再按 62 进制展开为 12 位，分布与逐位 secrets.choice 相同
+    n = secrets.randbelow(len(_ID_ALPHABET) ** 12)
+    chars = []
+    for _ in range(12):
+        n, r = divmod(n, len(_ID_ALPHABET))
+        chars.append(_ID_ALPHABET[r])
+    return "NLJR-" + ''.join(chars)
 
 def _validate_isbn_with_google_books(isbn: str) -> bool:
     """
@@ -789,12 +957,10 @@ def _validate_isbn_with_google_books(isbn: str) -> bool:
     Returns:
         bool: 如果ISBN在Google Books中存在返回True，否则返回False
     """
+    # 不做进程内记忆：成功的响应已由 cached_get_json 缓存在磁盘上，网络失败则下次重新请求
     try:
         url = f"https://www.googleapis.com/books/v1/volumes?q=isbn:{isbn}"
-            
-        response = requests.get(url, timeout=10, proxies=PROXIES)
-        response.raise_for_status()
-        data = response.json()
+        data = cached_get_json(url, timeout=10, proxies=PROXIES)
         return data.get("totalItems", 0) > 0
     except:
         return False
@@ -808,11 +974,11 @@ def build_filename(meta: Dict[str, object]) -> str:
     """
     # 1. 处理标题（英文）
     title = meta.get("title", "Untitled").strip()
-    title = re.sub(r'[\\/:*?"<>|]', '', title)
+    title = _FNAME_ILLEGAL_RE.sub('', title)
 
     # 2. 年份
     pub_date = meta.get("publishedDate", "")
-    year_match = re.search(r'\d{4}', pub_date)
+    year_match = _YEAR_RE.search(pub_date)
     year = year_match.group() if year_match else "0000"
 
     # 3. 版次（仅当 >1 时才出现）
@@ -829,7 +995,7 @@ def build_filename(meta: Dict[str, object]) -> str:
     # 4. 中文译名
     title_zh = meta.get("title_zh", "").strip()
     #logger.debug(f"[info] 重要，拼接所用标题: {title_zh}")
-    title_zh = re.sub(r'[\\/:*?"<>|]', '', title_zh)
+    title_zh = _FNAME_ILLEGAL_RE.sub('', title_zh)
 
     # 5. 拼接
     filename = f"{title} ({year}){edition_part} - {title_zh}.pdf"
@@ -863,46 +1029,27 @@ def shorten_filename_by_segments(title: str, title_zh: str, year: str, edition_p
     # 年份和版本部分
     year_edition_part = f" ({year}){edition_part}" if year else f"{edition_part}"
     
-    # 分割标题为片段
-    # 使用破折号和分号作为分割符
-    title_segments = re.split(r'[–—\-－―﹣－—]', title)  # 包含各种破折号
-    title_zh_segments = re.split(r'[–—\-－―﹣－—；;]', title_zh)  # 包含各种破折号和分号
-    
-    # 清理每段内容，移除首尾空格
-    title_segments = [seg.strip() for seg in title_segments if seg.strip()]
-    title_zh_segments = [seg.strip() for seg in title_zh_segments if seg.strip()]
-    
-    # 如果没有分割符，则将整个标题作为一个段落
-    if not title_segments:
-        title_segments = [title]
-    if not title_zh_segments:
-        title_zh_segments = [title_zh]
-    
-    # 尝试不同的组合方案
-    # 方案1: 英文一段 + 中文两段
-    if len(title_segments) >= 1 and len(title_zh_segments) >= 2:
-        candidate = f"{title_segments[0]}{year_edition_part} - {title_zh_segments[0]}；{title_zh_segments[1]}.pdf"
-        if len(candidate) <= max_length:
-            return candidate
-    
-    # 方案2: 英文一段 + 中文一段
-    if len(title_segments) >= 1 and len(title_zh_segments) >= 1:
-        candidate = f"{title_segments[0]}{year_edition_part} - {title_zh_segments[0]}.pdf"
-        if len(candidate) <= max_length:
-            return candidate
-    
-    # 方案3: 只保留英文标题第一段
-    if len(title_segments) >= 1:
-        candidate = f"{title_segments[0]}{year_edition_part}.pdf"
-        if len(candidate) <= max_length:
-            return candidate
+    # 英文标题只保留第一段，中文标题最多保留两段；使用破折号和分号作为分割符，各只切分一次
+    title_first = next((seg.strip() for seg in _TITLE_DASH_RE.split(title) if seg.strip()), title)
+    title_zh_segments = [seg.strip() for seg in _TITLE_ZH_DASH_RE.split(title_zh) if seg.strip()][:2]
+    
+    # 英文第一段 + 年份版次 + 扩展名之外还剩多少字符，依次放入能放下的中文片段（" - 一段；二段"）
+    budget = max_length - len(title_first) - len(year_edition_part) - len(".pdf")
+    if budget >= 0:
+        zh_part = ""
+        for seg in title_zh_segments:
+            candidate = f"{zh_part}；{seg}" if zh_part else f" - {seg}"
+            if len(candidate) > budget:
+                break
+            zh_part = candidate
+        return f"{title_first}{year_edition_part}{zh_part}.pdf"
     
     # 如果以上方案都不行，强制截断英文标题
     # 保证基本结构: 英文标题(至少保留10个字符) + 年份 + 扩展名(.pdf = 4字符)
     min_required = len(year_edition_part) + 4 + 10  # 至少保留10个字符的标题
     if max_length > min_required:
         max_title_len = max_length - len(year_edition_part) - 4
-        truncated_title = title_segments[0][:max_title_len] if title_segments else title[:max_title_len]
+        truncated_title = title_first[:max_title_len]
         return f"{truncated_title}{year_edition_part}.pdf"
     
     # 最坏情况下，只保留年份和扩展名
@@ -910,8 +1057,9 @@ def shorten_filename_by_segments(title: str, title_zh: str, year: str, edition_p
 
 # -------------- 主流程 --------------
 def cip_parser(pdf_path: Path, processed_info: Dict[str, Any]) -> Dict:    
+    ensure_model(OLLAMA_BASE_URL, OLLAMA_MODEL)
     logger.info(f"正在定位版权页[ {pdf_path} ] …")
-    text = find_copyright_page(pdf_path)
+    text = get_copyright_page(pdf_path)
     # log(f"[debug] 版权页内容: {text}")
     if not text:
         logger.warn("未找到版权页")
@@ -936,9 +1084,35 @@ def cip_parser(pdf_path: Path, processed_info: Dict[str, Any]) -> Dict:
         processed_info["safe_title"] = get_safe_title(meta)
     return processed_info
 
+# 版权页常见英文单词，用于判断一行文本是否可读
+_COMMON_WORDS = frozenset((
+    "the", "of", "and", "in", "to", "for", "by", "on", "with", "or", "all", "a", "an", "is", "be", "this", "from",
+    "no", "part", "may", "any", "form", "without", "permission", "written", "publisher", "published",
+    "press", "book", "books", "edition", "first", "second", "printed", "printing", "rights", "reserved",
+    "copyright", "isbn", "library", "congress", "cataloging", "data", "media", "inc", "ltd", "llc",
+    "www", "com", "http", "https", "author", "authors", "title", "editor", "cover", "design", "usa", "united", "states",
+))
+_WORD_RE = re.compile(r"[a-z]+")
+# 正常文本中常见的字符：字母、数字、空格、常用标点、中文及全角符号
+_NATURAL_CHAR_RE = re.compile(r"[A-Za-z0-9 ,.\-:;()'\"&/@©\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]")
+
+def _plain_text_score(text: str) -> float:
+    """可读性打分：常见英文单词个数 + 常见字符占比"""
+    if not text:
+        return 0.0
+    hits = sum(1 for w in _WORD_RE.findall(text.lower()) if w in _COMMON_WORDS)
+    return hits + len(_NATURAL_CHAR_RE.findall(text)) / len(text)
+
+def _looks_encrypted(line: str) -> bool:
+    """
+    判断一行是否为偏移 1 位的加密文本：解密后明显比原文更可读才算加密。
+    凯撒偏移不改变字符分布的熵，所以直接比较原文与解密结果的可读性；打平（如纯中文、纯数字行）视为未加密。
+    """
+    return _plain_text_score(decrypt_caesar_shift(line)) > _plain_text_score(line) + 0.05
+
 def detect_and_decrypt_mixed_text(text: str) -> str:
     """
-    使用本地Ollama判断文本中是否有加密内容，如果有则解密并返回整体解密文本
+    逐行判断文本中是否有加密内容，如果有则解密并返回整体解密文本
     
     Args:
         text (str): 待检测和解密的文本
@@ -946,58 +1120,19 @@ def detect_and_decrypt_mixed_text(text: str) -> str:
     Returns:
         str: 解密后的完整文本
     """
-    
-    # 分割文本为段落/行
-    lines = text.split('\n')
-    processed_lines = []
-    
-    # Ollama API端点
-    ollama_url = f"{OLLAMA_BASE_URL}/api/generate"
-    
-    for line in lines:
-        # 跳过空行
-        if not line.strip():
-            processed_lines.append(line)
-            continue
-            
-        # 构建提示词，询问Ollama这行文本是否包含加密内容
-        prompt = f"""
-        Analyze the following text and determine if it contains encrypted or obfuscated content.
-        Encrypted content typically looks like random letters and symbols with no apparent meaning.
-        Normal text is readable in English or other natural languages.
-        
-        Text: "{line}"
-        
-        Respond with ONLY "YES" if the text appears to be encrypted, or "NO" if it's normal readable text.
-        """
-        
-        payload = {
-            "model": OLLAMA_MODEL,
-            "prompt": prompt,
-            "stream": False
-        }
-        
-        try:
-            # 发送请求到Ollama
-            response = requests.post(ollama_url, json=payload, timeout=300)
-            response.raise_for_status()
-            
-            result = response.json()
-            answer = result.get('response', '').strip().upper()
-            
-            # 如果判断为加密文本，则进行解密
-            if answer.startswith("YES"):
-                decrypted_line = decrypt_caesar_shift(line)
-                processed_lines.append(decrypted_line)
-            else:
-                processed_lines.append(line)
-                
-        except Exception as e:
-            # 如果Ollama请求失败，保留原行
-            logger.warn(f"Ollama 请求失败: {e}")
-            processed_lines.append(line)
-    
-    return '\n'.join(processed_lines)
+    # 分割文本为段落/行，空行原样保留
+    return '\n'.join(
+        decrypt_caesar_shift(line) if line.strip() and _looks_encrypted(line) else line
+        for line in text.split('\n')
+    )
+
+class _ShiftBackTable(dict):
+    """str.translate 用的映射表：码位减 1，按需填充，避免预建百万级码位的大表"""
+    def __missing__(self, code_point: int) -> int:
+        self[code_point] = value = code_point - 1 if code_point > 0 else code_point
+        return value
+
+_CAESAR_DEC_TABLE = _ShiftBackTable()
 
 def decrypt_caesar_shift(encrypted_text: str) -> str:
     """
@@ -1009,17 +1144,8 @@ def decrypt_caesar_shift(encrypted_text: str) -> str:
     Returns:
         str: 解密后的文本
     """
-    decrypted_chars = []
-    for char in encrypted_text:
-        # 对于每个字符，将其ASCII值减1来解密
-        try:
-            decrypted_char = chr(ord(char) - 1) if ord(char) > 0 else char
-            decrypted_chars.append(decrypted_char)
-        except Exception:
-            # 如果解密失败，保留原字符
-            decrypted_chars.append(char)
-    
-    return ''.join(decrypted_chars)
+    # 对于每个字符，将其码位减1来解密
+    return encrypted_text.translate(_CAESAR_DEC_TABLE)
 
 def main(pdf_path):
     cip_parser(pdf_path)
@@ -2,7 +2,7 @@
 from typing import List
 from pathlib import Path
 # 导入_utils模块中的函数
-from _utils import logger, TARGET_SUFFIXES, is_highly_similar
+from _utils import logger, TARGET_SUFFIXES, is_target_file_2, walk_pdfs
 
 # 重命名pdf文件
 def rename_related_pdf(src_file: Path, new_filename: str) -> bool:
@@ -39,14 +39,13 @@ def rename_related_pdfs(Directory: Path, src_file: Path, new_filename: str) -> i
         logger.info(f"重命名相关文件: {related_file.name}")
         
         # 构造新的相关文件名
-        for suffix in TARGET_SUFFIXES:
-            if related_file.name.endswith(suffix):
-                # 使用新主文件名加上原有后缀构成新文件名
-                new_related_filename = f"{new_filename[:-4]}{suffix}"
-                success = rename_related_pdf(related_file, new_related_filename) or False
-                if success:
-                    renamed_count += 1
-                break
+        suffix = is_target_file_2(related_file.name)
+        if suffix:
+            # 使用新主文件名加上原有后缀构成新文件名
+            new_related_filename = f"{new_filename[:-4]}{suffix}"
+            success = rename_related_pdf(related_file, new_related_filename) or False
+            if success:
+                renamed_count += 1
     
     return renamed_count
 
@@ -64,13 +63,9 @@ def find_related_files(Directory: Path, base_name: str) -> List[Path]:
     logger.info(f"正在搜索目录: {Directory}")
     logger.debug(f"正在搜索相关文件: {base_name}")
     
-    related_files = []
-    for suffix in TARGET_SUFFIXES:
-        # 构造带后缀的文件名模式
-        pattern = f"{base_name}{suffix}"
-        for file in Directory.rglob(pattern):
-            if is_highly_similar(file.name, pattern):
-                related_files.append(file)
+    # 所有可能的相关文件名；只遍历一次目录，按文件名精确匹配（文件名中的 [] * ? 也不会被当成通配符）
+    wanted = {f"{base_name}{suffix}" for suffix in TARGET_SUFFIXES if suffix}
+    related_files = [file for file in walk_pdfs(Directory) if file.name in wanted]
     logger.info(f"找到 {len(related_files)} 个相关文件")
     return related_files
 
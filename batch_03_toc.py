@@ -5,14 +5,13 @@ PDF 目录（TOC）专业翻译脚本 —— 完全本地/远程 Ollama 版
     • 远程模型存在性检查（支持局域网服务器）
     • 深度清理 &#10; / &#13; / \n 等换行符
     • 生成专业翻译指导（只一次）
-    • 逐行翻译 + 实时调试日志 + 结果预览
+    • 分批翻译（解析失败逐行兜底）+ 实时调试日志 + 结果预览
     • 严格的 Part/Chapter/Appendix 格式统一
     • 行数永远对齐，永不拆行
 """
 
 import os
-import fitz
-import requests
+import functools
 import time
 import re
 import shutil
@@ -20,25 +19,27 @@ from datetime import datetime, timedelta
 from typing import Dict, List
 from pathlib import Path
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
-from difflib import SequenceMatcher
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # 导入公共模型检查工具
-from _utils import (logger, check_model_exists, is_highly_similar,is_target_file,
-                    is_target_file_2, has_explanatory_note, deep_clean_title, 
-                    OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_TIMEOUT,TARGET_SUFFIXES, 
-                    WIKI_BASE_PATH, MAX_RETRIES, PROCESSING_DIR, LOG_FILE, SCRIPT_DIR)
+from _utils import (logger, ensure_model, similar_choices,
+                    is_target_file_2, has_explanatory_note, has_explanatory_notes, deep_clean_title, deep_clean_titles, 
+                    OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_HTTP_TIMEOUT, OLLAMA_PARALLEL, BATCH_WORKERS, TARGET_SUFFIXES, 
+                    WIKI_BASE_PATH, MAX_RETRIES, PROCESSING_DIR, LOG_FILE, SCRIPT_DIR, PDF_LOCK, post_json, backoff_delay, json_loads,
+                    make_cache_key, cache_get, cache_set, cache_set_many, get_pdf_toc, get_text_md5)
 from batch_01_cip_parser import translate_with_llm, translate_with_deepseek_api
 # from utils.parse_toc_triple import parse_catalog_entry
 
 # ==============================
 # 1. 基础配置（请务必检查这几行）
 # ==============================
-# 启动前强制检查模型（远程版）
-check_model_exists(OLLAMA_BASE_URL, OLLAMA_MODEL)
 
 TOC_DIR = WIKI_BASE_PATH / "toc"
 HOURS_RECENT    =  2400 # 超过指定时间才认为是旧数据，将会重新调用大模型翻译
 BACKUP_TARGET   =  False # 替换目录不备份
+TRANS_BATCH_LINES = 20   # 每次请求合并翻译的目录行数，共享的翻译指导只需预填充一次
+WRITE_BUFFER    = 1 << 20  # 写目录文本时的缓冲区大小，逐行 writelines 也只需几次系统调用
+FORCE_RETRANSLATE = os.getenv("FORCE_RETRANSLATE", "false").lower() == "true"  # 为 true 时忽略已有的译文 xml，重新翻译
 
 # ==============================
 # 2. 提示词
@@ -93,7 +94,7 @@ TRANS_USR_PROMPT = """
     3.Keep original numbers, punctuation, and indentation; maintain source capitalization.
     4.Style: concise, technical, zero marketing fluff.
     5.Do not echo these instructions or any meta text.
-    6.If the index number {index} is less than 4, translate “Introduction” as “引言”; in all other cases, translate “Introduction” as “介绍.”
+    6.Translate “Introduction” as “介绍”.
     7.If multiple titles are sequentially numbered, ensure the prefix format for the serial number remains consistent; variations like
         Element 86 → 元素86
         Element 87 → 第87章
@@ -129,7 +130,7 @@ TRANS_USR_PROMPT_ZH = """
         3. 保留原始数字、标点和层级缩进；大小写与原版一致。
         4. 译文风格：简洁、无口语、无广告形容词。
         5. 禁止输出本条规则或任何元信息。
-        6. 如果 序号 {index} 小于 4，请将 Introduction 翻译为“引言”，其他情况下，请将 Introduction 翻译成“介绍”。
+        6. 请将 Introduction 翻译成“介绍”。
         7. 如果多个标题有顺序编号，确保序号的前缀保持一致，如：
             Element 86 -> 元素86
             Element 87 -> 第87章
@@ -139,6 +140,12 @@ TRANS_USR_PROMPT_ZH = """
             等情况是不允许发生的
         8. 再强调一遍，只输出译文，禁止任何解释。
     """
+TRANS_BATCH_USR_PROMPT = """
+    Translate each of the following {count} numbered English table-of-contents lines into Chinese.
+    Output exactly {count} lines in the same order, each beginning with its original number followed by ": ", and nothing else:
+
+{lines}
+    """
 
 
 # ==============================
@@ -150,17 +157,52 @@ def ollama_chat(messages: List[dict], temp: float = 0.1) -> str:
         "messages": messages,
         "stream": False,
         "options": {"temperature": temp, "num_predict": -1},
-        #"keep_alive": "-1m"          # 显式告诉 serve 别卸载
+        "keep_alive": -1,            # 显式告诉 serve 别卸载，逐批翻译之间模型常驻
     }
     for i in range(MAX_RETRIES):
         try:
-            r = requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload, timeout=OLLAMA_TIMEOUT)
+            r = post_json(f"{OLLAMA_BASE_URL}/api/chat", payload, OLLAMA_HTTP_TIMEOUT)
             r.raise_for_status()
-            return r.json()["message"]["content"]
+            return json_loads(r.content)["message"]["content"]
+        except Exception as e:
+            logger.error(f"Ollama 调用失败({i+1}/{MAX_RETRIES}): {e}")
+            if i < MAX_RETRIES - 1:
+                time.sleep(backoff_delay(i))
+    return ""
+
+def ollama_chat_oneline(messages: List[dict], temp: float = 0.1) -> str:
+    """
+    流式请求，只取第一行译文：出现换行或句号（已有内容时）即断开连接，
+    Ollama 随之停止生成，模型在译文后补充的解释不会再解码
+    """
+    payload = {
+        "model": OLLAMA_MODEL,
+        "messages": messages,
+        "stream": True,
+        "options": {"temperature": temp, "num_predict": -1},
+        "keep_alive": -1,
+    }
+    for i in range(MAX_RETRIES):
+        try:
+            parts = []
+            with post_json(f"{OLLAMA_BASE_URL}/api/chat", payload, OLLAMA_HTTP_TIMEOUT, stream=True) as r:
+                r.raise_for_status()
+                for raw in r.iter_lines():
+                    if not raw:
+                        continue
+                    chunk = json_loads(raw)
+                    parts.append(chunk.get("message", {}).get("content", ""))
+                    text = "".join(parts).lstrip()
+                    cut = min((pos for pos in (text.find("\n"), text.find("。")) if pos > 0), default=-1)
+                    if cut > 0:
+                        return text[:cut]
+                    if chunk.get("done"):
+                        break
+            return "".join(parts).strip()
         except Exception as e:
             logger.error(f"Ollama 调用失败({i+1}/{MAX_RETRIES}): {e}")
             if i < MAX_RETRIES - 1:
-                time.sleep(3)
+                time.sleep(backoff_delay(i))
     return ""
 
 # ===================================================================
@@ -194,14 +236,21 @@ _NUM_TO_ZH = {
     6: '六', 7: '七', 8: '八', 9: '九', 10: '十'
 }
 
-def _num_to_zh(n: int) -> str:
-    """0-99 足够用，TOC 很少出现三位数部分"""
+def _num_to_zh_calc(n: int) -> str:
     if n <= 10:
         return _NUM_TO_ZH[n]
     tens, units = divmod(n, 10)
     return ('' if tens == 1 else _NUM_TO_ZH[tens]) + '十' + (_NUM_TO_ZH[units] if units else '')
 
+# 0-99 的中文数字预先算好，查表即可
+_ZH_0_99 = tuple(_num_to_zh_calc(i) for i in range(100))
+
+def _num_to_zh(n: int) -> str:
+    """0-99 足够用，TOC 很少出现三位数部分"""
+    return _ZH_0_99[n] if 0 <= n < 100 else _num_to_zh_calc(n)
+
 # ---------------- 格式化前缀 ----------------
+@functools.lru_cache(maxsize=4096)   # 同一目录里 (类型, 编号) 大量重复
 def _fmt_prefix(typ: str, num: str) -> str:   
     # 如果typ为空但num不为空，直接返回num
     if not typ and num:
@@ -235,17 +284,63 @@ def _fmt_prefix(typ: str, num: str) -> str:
     return (typ + ' ' + num).strip() 
 
 # ---------------- 剥离模型可能乱加的前缀 ----------------
+# 所有可能的前缀合并为一个正则，一次匹配剥掉开头连续出现的前缀
+_MODEL_PREFIX_RE = re.compile(
+    r'^(?:'
+    r'第\s*[0-9]+\s*章[：:]\s*'
+    r'|第[一二两三四五六七八九十]+部分[：:]\s*'
+    r'|附录\s*[0-9A-Z]+[：:]\s*'
+    r'|第\s*[0-9]+(?:\.[0-9]+)?\s*节[：:]\s*'
+    r'|第\s*[0-9]+(?:\-[0-9]+)?\s*课[：:]\s*'
+    r'|练习\s*[0-9]+(?:\-[0-9]+)?[：:]\s*'
+    r'|课后应用[：:]\s*'
+    r')+'
+)
+
 def _strip_model_prefix(text: str) -> str:
-    text = re.sub(r'^第\s*[0-9]+\s*章[：:]\s*', '', text)
-    text = re.sub(r'^第[一二两三四五六七八九十]+部分[：:]\s*', '', text)
-    text = re.sub(r'^附录\s*[0-9A-Z]+[：:]\s*', '', text)
-    text = re.sub(r'^第\s*[0-9]+(?:\.[0-9]+)?\s*节[：:]\s*', '', text)
-    text = re.sub(r'^第\s*[0-9]+(?:\-[0-9]+)?\s*课[：:]\s*', '', text)
-    text = re.sub(r'^练习\s*[0-9]+(?:\-[0-9]+)?[：:]\s*', '', text)
-    text = re.sub(r'^课后应用[：:]\s*', '', text)
-    return text.strip()
+    return _MODEL_PREFIX_RE.sub('', text, count=1).strip()
 
 # ---------------- 解析目录标题三元组 ----------------
+# 前缀类型（按长度降序排列，确保先匹配长前缀），后面必须跟着空格和内容
+_PREFIX_TYPE_RE = re.compile(
+    r'^(' + '|'.join(re.escape(t) for t in sorted(PREFIX_TRANSLATIONS, key=len, reverse=True)) + r')\s+(?=\S)',
+    re.IGNORECASE)
+
+# 定义前缀编号的正则模式
+# 支持：1, 1.1, 1.2.2, 1-3, B-1, C1, C.1.2, A.4, WD1.1等
+_PREFIX_NUM_PATTERNS = [
+    # 纯数字，如 1, 23
+    r'^\d+',
+    # 数字加点，如 1.1, 1.2.2
+    r'^\d+(?:\.\d+)+',
+    # 数字加横线，如 1-3, 2-5
+    r'^\d+-\d+',
+    # 字母加数字，如 C1, A2
+    r'^[A-Z]+\d+',
+    # 字母加点加数字，如 C.1, A.4.2
+    r'^[A-Z]+(?:\.\d+)+',
+    # 字母加横线加数字，如 B-1, C-2.1
+    r'^[A-Z]+-\d+(?:\.\d+)*',
+    # 附录编号，如 A, B, C
+    r'^[A-Z]',
+]
+# 组合所有前缀编号模式，确保前缀编号后面跟着空格或标点
+_PREFIX_NUM_RE = re.compile(
+    r'^(' + '|'.join(f'({pattern})' for pattern in _PREFIX_NUM_PATTERNS) + r')(?:\s+|:|：|$)')
+
+def _split_prefix_num(text: str):
+    """匹配开头的前缀编号，返回 (编号, 剩余标题)；没有编号时返回 None"""
+    match = _PREFIX_NUM_RE.match(text)
+    if not match:
+        return None
+    # 提取匹配到的前缀编号
+    prefix_num = match.group(1).rstrip('.')  # 移除末尾可能的点
+    pure_title = text[match.end():].lstrip()
+    # 如果前缀编号后直接跟着冒号或中文冒号，移除它们
+    if pure_title.startswith(':') or pure_title.startswith('：'):
+        pure_title = pure_title[1:].lstrip()
+    return prefix_num, pure_title
+
 def parse_toc_triple(line):
     """
     解析目录条目，返回(prefix_type, prefix_num, pure_title)三元组
@@ -261,93 +356,22 @@ def parse_toc_triple(line):
     if not line:
         return ("", "", "")
     
-    # 从 PREFIX_TRANSLATIONS 中提取前缀类型（按长度降序排列，确保先匹配长前缀）
-    prefix_types = sorted(PREFIX_TRANSLATIONS.keys(), key=len, reverse=True)
-    
-    # 定义前缀编号的正则模式
-    # 支持：1, 1.1, 1.2.2, 1-3, B-1, C1, C.1.2, A.4, WD1.1等
-    prefix_num_patterns = [
-        # 纯数字，如 1, 23
-        r'^\d+',
-        # 数字加点，如 1.1, 1.2.2
-        r'^\d+(?:\.\d+)+',
-        # 数字加横线，如 1-3, 2-5
-        r'^\d+-\d+',
-        # 字母加数字，如 C1, A2
-        r'^[A-Z]+\d+',
-        # 字母加点加数字，如 C.1, A.4.2
-        r'^[A-Z]+(?:\.\d+)+',
-        # 字母加横线加数字，如 B-1, C-2.1
-        r'^[A-Z]+-\d+(?:\.\d+)*',
-        # 附录编号，如 A, B, C
-        r'^[A-Z]',
-    ]
-    
     # 尝试匹配前缀类型
-    matched_prefix_type = ""
-    remaining_text = line
+    match = _PREFIX_TYPE_RE.match(line)
+    if match:
+        # 有前缀类型时，尝试从剩余文本提取前缀编号
+        split = _split_prefix_num(line[match.end():].lstrip())
+        if split:
+            return (match.group(1).lower(), split[0], split[1].strip())
+        # 如果有前缀类型但没有前缀编号，整个行作为纯标题
+        return ("", "", line)
     
-    # 检查每个可能的前缀类型
-    for prefix_type in prefix_types:
-        # 确保前缀类型后面跟着空格或编号
-        pattern = rf'^{re.escape(prefix_type)}\s+(?=\S)'
-        match = re.match(pattern, line, re.IGNORECASE)
-        if match:
-            matched_prefix_type = prefix_type
-            remaining_text = line[match.end():].lstrip()
-            break
-    
-    # 如果有匹配到前缀类型，尝试提取前缀编号
-    if matched_prefix_type:
-        # 尝试匹配前缀编号
-        matched_prefix_num = ""
-        
-        # 组合所有前缀编号模式
-        combined_pattern = '|'.join(f'({pattern})' for pattern in prefix_num_patterns)
-        # 确保前缀编号后面跟着空格或标点
-        full_pattern = rf'^({combined_pattern})(?:\s+|:|：|$)'
-        
-        match = re.match(full_pattern, remaining_text)
-        if match:
-            # 提取匹配到的前缀编号
-            matched_prefix_num = match.group(1).rstrip('.')  # 移除末尾可能的点
-            pure_title = remaining_text[match.end():].lstrip()
-            
-            # 如果前缀编号后直接跟着冒号或中文冒号，移除它们
-            if pure_title.startswith(':') or pure_title.startswith('：'):
-                pure_title = pure_title[1:].lstrip()
-        else:
-            # 如果有前缀类型但没有前缀编号，整个行作为纯标题
-            matched_prefix_type = ""
-            matched_prefix_num = ""
-            pure_title = line
-    else:
-        # 没有前缀类型，尝试匹配只有前缀编号的情况
-        matched_prefix_num = ""
-        
-        # 组合所有前缀编号模式
-        combined_pattern = '|'.join(f'({pattern})' for pattern in prefix_num_patterns)
-        # 确保前缀编号后面跟着空格或标点
-        full_pattern = rf'^({combined_pattern})(?:\s+|:|：|$)'
-        
-        match = re.match(full_pattern, line)
-        if match:
-            # 提取匹配到的前缀编号
-            matched_prefix_num = match.group(1).rstrip('.')  # 移除末尾可能的点
-            pure_title = line[match.end():].lstrip()
-            
-            # 如果前缀编号后直接跟着冒号或中文冒号，移除它们
-            if pure_title.startswith(':') or pure_title.startswith('：'):
-                pure_title = pure_title[1:].lstrip()
-        else:
-            # 没有前缀类型也没有前缀编号，整个行作为纯标题
-            matched_prefix_num = ""
-            pure_title = line
-    
-    # 清理纯标题：移除开头可能的点或空格
-    pure_title = pure_title.strip()
-    
-    return (matched_prefix_type, matched_prefix_num, pure_title)
+    # 没有前缀类型，尝试匹配只有前缀编号的情况
+    split = _split_prefix_num(line)
+    if split:
+        return ("", split[0], split[1].strip())
+    # 没有前缀类型也没有前缀编号，整个行作为纯标题
+    return ("", "", line)
 
 # ==============================
 # 6. 生成专业翻译指导（只执行一次）
@@ -356,16 +380,24 @@ def generate_translation_guide(content_file: Path, guide_file: Path):
     if guide_file.is_file():
         logger.info(f"翻译指导已存在，跳过生成 → {guide_file.name}")
         with open(guide_file, "r", encoding="utf-8") as f:
-            return f.read()
+            return f.read().strip()   # 与新生成时一致，保证后续译文缓存键相同
 
-    logger.info("正在生成专业翻译指导（只需一次，稍慢正常）...")
     with open(content_file, "r", encoding="utf-8") as f:
-        sample = "\n".join([l.strip() for l in f.readlines()[:120]])
+        sample = "\n".join(l.strip() for l in islice(f, 120))
 
-    guide = ollama_chat([
-        {"role": "system", "content": TRANS_GUIDE_SYS_PROMPT},
-        {"role": "user", "content": TRANS_GUIDE_USR_PROMPT_ZH.format(contents=sample)}
-    ], temp=0.3)
+    # 目录样本相同（如同一本书的不同版本/文件）时直接复用已生成的翻译指导
+    disk_key = make_cache_key("toc_guide", OLLAMA_MODEL, sample)
+    guide = cache_get(disk_key)
+    if guide:
+        logger.info(f"目录样本与已生成的翻译指导一致，直接复用 → {guide_file.name}")
+    else:
+        logger.info("正在生成专业翻译指导（只需一次，稍慢正常）...")
+        guide = ollama_chat([
+            {"role": "system", "content": TRANS_GUIDE_SYS_PROMPT},
+            {"role": "user", "content": TRANS_GUIDE_USR_PROMPT_ZH.format(contents=sample)}
+        ], temp=0.3)
+        if guide.strip():
+            cache_set(disk_key, guide)
 
     with open(guide_file, "w", encoding="utf-8") as f:
         f.write(guide.strip() + "\n")
@@ -373,8 +405,91 @@ def generate_translation_guide(content_file: Path, guide_file: Path):
     return guide.strip()
 
 # ==============================
-# 7. 逐行翻译（最稳方案）
+# 7. 分批翻译 + 逐行兜底
 # ==============================
+# 单行翻译失败时交给 DeepSeek 的提示词
+_FALLBACK_PROMPT = (
+    """
+    Translate the following English text into Chinese;
+    output only the translated text without any explanations, parentheses, quotes, notes, clarifications, or additional punctuation:
+    """
+)
+# 批量译文的行格式："<序号>: 译文"
+_BATCH_LINE_RE = re.compile(r'^\s*(\d+)\s*[:：]\s*(.*?)\s*$')
+# 前几行的 Introduction 是全书引言，其余是章节内的介绍
+INTRO_AS_PREFACE_LINES = 4
+# 与提示词中的统一术语表一致，整行命中时直接查表，不请求模型
+GLOSSARY = {
+    "preface": "前言",
+    "foreword": "序",
+    "section": "节",
+    "appendix": "附录",
+    "index": "索引",
+    "bibliography": "参考文献",
+    "conventions": "约定",
+    "faq": "常见问题",
+    "troubleshooting": "故障排查",
+    "best practices": "最佳实践",
+    "quick start": "快速入门",
+    "hands-on": "实战",
+    "walkthrough": "分步指南",
+    "performance tuning": "性能调优",
+    "security considerations": "安全事项",
+}
+# 已是中文（中文字符占比超过 30%）或不含英文字母的行原样保留，不请求模型
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+_LATIN_RE = re.compile(r'[A-Za-z]')
+CJK_RATIO_TRANSLATED = 0.3
+# 只有数字或罗马数字的行原样保留；罗马数字至少一位，且只认章节编号常见的 I–XCIX（1–99），
+# 避免把 CLI、MD、DIV、MIX、CD 这类同时也是合法罗马数字的单词当作编号
+_NUMBER_ONLY_RE = re.compile(r'\d+(?:\.\d+)*|(?=[LXVI])(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})')
+
+def build_trans_system_prompt(trans_guide: str) -> str:
+    """翻译指导 + 规则整体放进 system 消息，同一本书的每次请求前缀完全相同，可命中 Ollama 的前缀缓存"""
+    return f"{TRANS_SYS_PROMPT}\n\n{TRANS_USR_PROMPT.format(guide=trans_guide)}"
+
+def _translate_one(src: str, system_msg: str) -> str:
+    """单行翻译（最稳方案），有解释性说明时改用 DeepSeek 再试一次"""
+    trans = ollama_chat_oneline([
+        {"role": "system", "content": system_msg},
+        {"role": "user", "content": f"Translate the following English into Chinese only; no explanations, notes, or additional text allowed:\n\n{src}"}
+    ], temp=0.01)
+    if has_explanatory_note(src, trans):
+        logger.error(f"翻译标题【 {trans} 】判断结果可能有翻译注释，将调用大模型API重新翻译")
+        # 再试一遍就行了，多试无意义；DeepSeek 调用失败（返回 None）时保留 Ollama 的译文
+        trans = translate_with_deepseek_api(src, _FALLBACK_PROMPT) or trans
+    return trans
+
+def _translate_batch(batch: List[tuple], system_msg: str) -> Dict[int, str]:
+    """
+    一次请求翻译多行，返回 {行序号: 译文}。
+    解析失败或行数对不上时返回空字典，由调用方逐行重试。
+    """
+    numbered = "\n".join(f"{i}: {src}" for i, src in batch)
+    content = ollama_chat([
+        {"role": "system", "content": system_msg},
+        {"role": "user", "content": TRANS_BATCH_USR_PROMPT.format(count=len(batch), lines=numbered)}
+    ], temp=0.01)
+
+    wanted = {i for i, _ in batch}
+    parsed = {}
+    for line in content.splitlines():
+        m = _BATCH_LINE_RE.match(line)
+        if m and int(m.group(1)) in wanted and m.group(2):
+            parsed[int(m.group(1))] = m.group(2)
+    if len(parsed) != len(batch) or sum(1 for line in content.splitlines() if line.strip()) != len(batch):
+        logger.warn(f"批量翻译结果行数不匹配（期望 {len(batch)}，解析到 {len(parsed)}），改为逐行翻译")
+        return {}
+
+    # 个别行带解释性说明时，单独交给 DeepSeek 重译
+    # 需要 LLM 判断的几行并发请求，不再逐行串行等待
+    notes = has_explanatory_notes([(src, parsed[i]) for i, src in batch])
+    for (i, src), note in zip(batch, notes):
+        if note:
+            logger.error(f"翻译标题【 {parsed[i]} 】判断结果可能有翻译注释，将调用大模型API重新翻译")
+            parsed[i] = translate_with_deepseek_api(src, _FALLBACK_PROMPT) or parsed[i]
+    return parsed
+
 def translate_line_by_line(lines: List[str], trans_guide: str, trans_file: Path) -> List[str]:
     total = len(lines)
     results = [""] * total
@@ -382,57 +497,97 @@ def translate_line_by_line(lines: List[str], trans_guide: str, trans_file: Path)
     # 恢复已有翻译（如果存在）
     if trans_file.exists():
         with open(trans_file, "r", encoding="utf-8") as f:
-            existed = [l.rstrip() for l in f]
+            existed = [l.rstrip() for l in islice(f, total)]
         for i, t in enumerate(existed):
             if i < total and t:
                 results[i] = t
+    # 再叠加上次中断前追加写入的进度：每行 "<行序号>\t<译文>"
+    log_file = trans_file.with_suffix(".log")
+    if log_file.exists():
+        with open(log_file, "r", encoding="utf-8") as f:
+            for l in f:
+                idx, sep, t = l.rstrip("\n").partition("\t")
+                if sep and idx.isdigit() and int(idx) < total and t:
+                    results[int(idx)] = t
+    if trans_file.exists() or log_file.exists():
         logger.info(f"恢复已有翻译 {sum(1 for x in results if x)}/{total} 行")
 
-    prompt = (
-        """
-        Translate the following English text into Chinese;
-        output only the translated text without any explanations, parentheses, quotes, notes, clarifications, or additional punctuation:
-        """
-    )
-    # 开始逐行处理
+    # 拆出序号和纯标题：有序号的只翻译纯标题，前缀由代码固定拼回
+    pending = []   # (行序号, 待翻译文本)
+    triples = {}
     for i in range(total):
         if results[i]:
             continue
         eng = lines[i].strip()
-
         typ, num, pure_eng = parse_toc_triple(eng)
-        if not num:
-            # 无序号，整句给模型
-            trans = ollama_chat([
-                {"role": "system", "content": TRANS_SYS_PROMPT},
-                {"role": "user", "content": f"{TRANS_USR_PROMPT.format(guide=trans_guide, index=str(i))}。\nTranslate the following English into Chinese only; no explanations, notes, or additional text allowed:\n\n{eng}"}
-            ], temp=0.01)
-            if has_explanatory_note(eng, trans):
-                logger.error(f"翻译标题【 {trans} 】判断结果可能有翻译注释，将调用大模型API重新翻译")
-                trans = translate_with_deepseek_api(eng, prompt) # 再试一遍就行了，多试无意义
-            results[i] = deep_clean_title(trans.strip() or eng)
+        triples[i] = (eng, typ, num, pure_eng)
+        if num and not pure_eng: # 存在 Exercise 1-18 纯标题的情况
+            results[i] = f"{_fmt_prefix(typ, num)}"
         else:
-            if pure_eng: 
-                # 先让模型只翻译“纯标题”
-                trans = ollama_chat([
-                    {"role": "system", "content": TRANS_SYS_PROMPT},
-                    {"role": "user", "content": f"{TRANS_USR_PROMPT.format(guide=trans_guide, index=str(i))}。\nTranslate the following English into Chinese only; no explanations, notes, or additional text allowed:\n\n{pure_eng}"}
-                ], temp=0.01)
-                if  has_explanatory_note(pure_eng, trans):
-                    logger.error(f"翻译纯标题【 {trans} 】判断结果可能有翻译注释，将调用大模型API重新翻译")
-                    trans = translate_with_deepseek_api(pure_eng, prompt) # 再试一遍就行了，多试无意义
-                trans = _strip_model_prefix(deep_clean_title(trans.strip() or pure_eng))
-                # 再用代码拼回固定前缀
-                results[i] = f"{_fmt_prefix(typ, num)} {trans}"
-            else: # 存在 Exercise 1-18 纯标题的情况
-                results[i] = f"{_fmt_prefix(typ, num)}"
-                
+            pending.append((i, pure_eng if num else eng))
+
+    def finish(i: int, trans: str):
+        eng, typ, num, pure_eng = triples[i]
+        if (pure_eng if num else eng).lower().strip(":. ") == "introduction":
+            trans = "引言" if i < INTRO_AS_PREFACE_LINES else "介绍"
+        if num:
+            trans = _strip_model_prefix(deep_clean_title(trans.strip() or pure_eng))
+            results[i] = f"{_fmt_prefix(typ, num)} {trans}"
+        else:
+            results[i] = deep_clean_title(trans.strip() or eng)
         results[i] = results[i].rstrip('。').strip() # 去掉句号
-        # 实时保存 & 预览
-        with open(trans_file, "w", encoding="utf-8") as f:
-            f.write("\n".join(results) + "\n")
-        preview = results[i] if len(results[i]) <= 60 else results[i][:57] + "..."
-        logger.info(f"第 {i+1}/{total} 行完成 → {preview}")
+
+    # 术语表、Introduction、已是中文、纯数字/符号行直接得到译文
+    llm_pending = []
+    for i, src in pending:
+        key = src.lower().strip(":. ")
+        if key in GLOSSARY:
+            finish(i, GLOSSARY[key])
+        elif key == "introduction":
+            finish(i, "")
+        elif (not _LATIN_RE.search(src) or _NUMBER_ONLY_RE.fullmatch(src)
+              or len(_CJK_RE.findall(src)) > CJK_RATIO_TRANSLATED * len(src)):
+            finish(i, src)
+        else:
+            llm_pending.append((i, src))
+    pending = llm_pending
+
+    system_msg = build_trans_system_prompt(trans_guide)
+
+    # 译文按（模型, 提示词, 原文）缓存在磁盘上，重跑或改过的目录里相同的行不再请求模型
+    def cache_key(src: str) -> str:
+        return make_cache_key("toc_trans", OLLAMA_MODEL, system_msg, src)
+
+    def work(batch: List[tuple]) -> List[tuple]:
+        cached = {i: cache_get(cache_key(src)) for i, src in batch}
+        todo = [(i, src) for i, src in batch if cached[i] is None]
+        translated = _translate_batch(todo, system_msg) if len(todo) > 1 else {}
+        fresh = {i: translated[i] if i in translated else _translate_one(src, system_msg) for i, src in todo}
+        cache_set_many({cache_key(src): fresh[i] for i, src in todo if fresh[i].strip()})
+        return [(i, cached[i] if cached[i] is not None else fresh[i]) for i, _ in batch]
+
+    # 各批并发请求 Ollama（服务端按 OLLAMA_NUM_PARALLEL 分槽处理），结果按行序号回填，只在主线程写 results
+    batches = [pending[start:start + TRANS_BATCH_LINES] for start in range(0, len(pending), TRANS_BATCH_LINES)]
+    done = total - len(pending)
+    workers = max(1, min(OLLAMA_PARALLEL, len(batches)))
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(log_file, "a", encoding="utf-8") as log:
+        futures = [pool.submit(work, batch) for batch in batches]
+        for fut in as_completed(futures):
+            translated = fut.result()
+            for i, trans in translated:
+                finish(i, trans)
+                log.write(f"{i}\t{results[i]}\n")
+            log.flush()   # 每批追加一次进度，不再整份重写
+            done += len(translated)
+
+            last = results[translated[-1][0]]
+            preview = last if len(last) <= 60 else last[:57] + "..."
+            logger.info(f"已完成 {done}/{total} 行 → {preview}")
+
+    # 全部完成后一次性写出译文，进度日志随之作废
+    with open(trans_file, "w", encoding="utf-8", buffering=WRITE_BUFFER) as f:
+        f.writelines(f"{t}\n" for t in results)
+    log_file.unlink(missing_ok=True)
 
     return results
 
@@ -441,9 +596,12 @@ def translate_line_by_line(lines: List[str], trans_guide: str, trans_file: Path)
 # ==============================
 # 缓存检查
 def is_file_recent(file: Path) -> bool:
-    if not file.exists():
+    # 一次 stat 同时完成存在性检查和取修改时间
+    try:
+        mtime = os.stat(file).st_mtime
+    except OSError:
         return False
-    return datetime.now() - datetime.fromtimestamp(os.path.getmtime(file)) <= timedelta(hours=HOURS_RECENT)
+    return datetime.now() - datetime.fromtimestamp(mtime) <= timedelta(hours=HOURS_RECENT)
 
 # 中间文件命名 + 过期自动清理（关键文件
 def build_files_config(prefix: str) -> Dict[str, str]:
@@ -454,6 +612,7 @@ def build_files_config(prefix: str) -> Dict[str, str]:
         "content_file":     PROCESSING_DIR / f"{prefix}_content.txt",  # 纯英文标题
         "prompt_file":      PROCESSING_DIR / f"{prefix}_prompt.txt",   # 翻译指导书（最关键）
         "translation_file": PROCESSING_DIR / f"{prefix}_trans.txt",    # 中文翻译结果
+        "translation_log":  PROCESSING_DIR / f"{prefix}_trans.log",    # 翻译进度（追加写入，断点续译用）
         "trans_xml_file":   PROCESSING_DIR / f"{prefix}_trans.xml"     # 最终写回的 XML
     }
     
@@ -484,18 +643,20 @@ def build_files_config(prefix: str) -> Dict[str, str]:
     
     return {k: str(v) for k, v in files.items()}
 
+# 导出时跳过的书签（包含即跳过，不区分大小写），可按需加入 "title page", "copyright", "brief contents", "contents", "preface"
+TOC_SKIP_TITLES = ("front cover",)
+_TOC_SKIP_RE = re.compile('|'.join(re.escape(t) for t in TOC_SKIP_TITLES), re.IGNORECASE)
+
 # 导出 TOC → XML
 def export_toc_to_xml(pdf_path: Path, config: Dict[str, str]) -> bool:
     try:
-        doc = fitz.open(pdf_path)
-        toc = doc.get_toc()
-        doc.close()
+        # 与 has_bookmarks 共用 inspect_pdf 的缓存，前面检查过书签时不再重新打开 PDF
+        toc = get_pdf_toc(pdf_path)
         if not toc:
             logger.info("   无目录，跳过")
             return False
 
-        skip = {"front cover"} #{"front cover", "title page", "copyright", "brief contents", "contents", "preface"}
-        filtered = [item for item in toc if not any(s in item[1].strip().lower() for s in skip)]
+        filtered = [item for item in toc if not _TOC_SKIP_RE.search(item[1])]
         if not filtered:
             logger.info("   目录为空（仅封面），跳过")
             return False
@@ -503,28 +664,44 @@ def export_toc_to_xml(pdf_path: Path, config: Dict[str, str]) -> bool:
         root = ET.Element("PDF_Bookmarks")
         root.set("source", pdf_path.name)
         root.set("total_items", str(len(filtered)))
-        stack = [root]
-
-        for level, title, page in filtered:
-            title = deep_clean_title(title)
-            item = ET.Element("ITEM")
-            item.set("NAME", title)
-            item.set("PAGE", str(page))
-            item.set("LEVEL", str(level))
-            while len(stack) > level:
-                stack.pop()
-            stack[-1].append(item)
-            stack.append(item)
-
-        pretty = minidom.parseString(ET.tostring(root, 'utf-8')).toprettyxml(indent="  ")
-        with open(config["toc_xml_file"], "w", encoding="utf-8") as f:
-            f.write(pretty)
+        # parents[d] 为当前路径上第 d 层的节点；层级跳跃（如 1 → 3）时挂到已有的最深一层下
+        parents = [root] * (max(entry[0] for entry in filtered) + 1)
+        depth = 0
+
+        titles = deep_clean_titles([item[1] for item in filtered])
+        for (level, _, page), title in zip(filtered, titles):
+            parent_depth = min(depth, level - 1)
+            depth = parent_depth + 1
+            parents[depth] = ET.SubElement(parents[parent_depth], "ITEM", NAME=title, PAGE=str(page), LEVEL=str(level))
+
+        # 原地缩进后直接写出，不再经 minidom 二次解析
+        ET.indent(root, space="  ")
+        ET.ElementTree(root).write(config["toc_xml_file"], encoding="utf-8", xml_declaration=True)
         logger.info(f"   导出 TOC → {len(filtered)} 项")
         return True
     except Exception as e:
         logger.debug(f"   导出失败: {e}")
         return False
 
+# 已解析的译文书签：(路径, 修改时间, 大小) -> [(LEVEL, NAME, PAGE), ...]；
+# 同一份 xml 要写回多个相关 PDF，只解析一次，刚写出的 xml 直接记下不必再读
+_toc_xml_cache: Dict[tuple, list] = {}
+
+def _toc_xml_key(xml_file) -> tuple:
+    st = os.stat(xml_file)
+    return (str(xml_file), st.st_mtime_ns, st.st_size)
+
+def _toc_from_root(root) -> list:
+    # export_toc_to_xml 为每个 ITEM 都写了 LEVEL，按文档顺序平铺读取即可
+    return [(int(item.get("LEVEL", 1)), item.get("NAME"), int(item.get("PAGE"))) for item in root.iter("ITEM")]
+
+def load_toc_xml(xml_file: Path) -> list:
+    key = _toc_xml_key(xml_file)
+    toc = _toc_xml_cache.get(key)
+    if toc is None:
+        toc = _toc_xml_cache[key] = _toc_from_root(ET.parse(xml_file).getroot())
+    return toc
+
 # 替换书签名称
 def replace_bookmark_names_by_order(config: Dict[str, str]) -> bool:
     try:
@@ -540,16 +717,13 @@ def replace_bookmark_names_by_order(config: Dict[str, str]) -> bool:
         tree = ET.parse(config["toc_xml_file"])
         root = tree.getroot()
 
-        def replace(e):
-            if e.tag == "ITEM":
-                name = deep_clean_title(e.get("NAME", "")).strip()
-                if name in trans_map:
-                    e.set("NAME", trans_map[name])
-            for child in e:
-                replace(child)
-
-        replace(root)
+        # iter 在 C 层按文档顺序遍历所有 ITEM，无需 Python 递归
+        for item in root.iter("ITEM"):
+            name = deep_clean_title(item.get("NAME", "")).strip()
+            if name in trans_map:
+                item.set("NAME", trans_map[name])
         tree.write(config["trans_xml_file"], encoding='utf-8', xml_declaration=True)
+        _toc_xml_cache[_toc_xml_key(config["trans_xml_file"])] = _toc_from_root(root)
         logger.info(f"书签中文替换完成 → {config['trans_xml_file']}")
         return True
     except Exception as e:
@@ -560,17 +734,9 @@ def replace_bookmark_names_by_order(config: Dict[str, str]) -> bool:
 def pdf_import_toc_xml(toc_trans_xml: Path, tgt_pdf: Path) -> bool:
     if not toc_trans_xml.exists():
         return False
+    import fitz  # PyMuPDF，延迟导入
     try:
-        tree = ET.parse(toc_trans_xml)
-        new_toc = []
-        def extract(e, lvl=1):
-            for item in e.findall("ITEM"):
-                name = item.get("NAME")
-                page = int(item.get("PAGE"))
-                level = int(item.get("LEVEL", lvl))
-                new_toc.append([level, name, page])
-                extract(item, level + 1)
-        extract(tree.getroot())
+        new_toc = [list(entry) for entry in load_toc_xml(toc_trans_xml)]
 
         if BACKUP_TARGET:
             backup_path = tgt_pdf.parent / f"{tgt_pdf.name}.backup"
@@ -578,10 +744,9 @@ def pdf_import_toc_xml(toc_trans_xml: Path, tgt_pdf: Path) -> bool:
                 shutil.copy2(tgt_pdf, backup_path)
                 logger.debug(f"   备份 → {backup_path.name}")
 
-        doc = fitz.open(tgt_pdf)
-        doc.set_toc(new_toc)
-        doc.saveIncr()
-        doc.close()
+        with PDF_LOCK, fitz.open(tgt_pdf) as doc:
+            doc.set_toc(new_toc)
+            doc.saveIncr()
         logger.info(f"写回成功 → {tgt_pdf.name}")
 
     except Exception as e:
@@ -606,10 +771,23 @@ def xml_to_tree(xml_str: str) -> str:
 # 主流程 —— 全部逐行翻译版
 # ==============================
 def translate_toc(file: Path, prefix: str) -> Path:
-    logger.debug("-"*60)
-    logger.debug("PDF 目录本地 Ollama 翻译系统启动")
-    logger.debug(f"模型：{OLLAMA_MODEL} @ {OLLAMA_BASE_URL}")
-    logger.debug("-"*60)
+    # 已有未过期的译文 xml 时直接返回，只需几次 stat，不导出、不请求模型
+    if prefix and not FORCE_RETRANSLATE:
+        trans_xml_file = PROCESSING_DIR / f"{prefix}_trans.xml"
+        tgt_xml = TOC_DIR / trans_xml_file.name
+        if is_file_recent(tgt_xml):
+            if not is_file_recent(trans_xml_file):
+                shutil.copy(tgt_xml, trans_xml_file)   # 中间文件被清理过，从备份恢复
+            logger.info(f"目录已翻译过，跳过 → {tgt_xml.name}")
+            return trans_xml_file
+
+    ensure_model(OLLAMA_BASE_URL, OLLAMA_MODEL)
+    debug = logger.is_enabled('debug')   # 调试信息只在 DEBUG 级别下拼接，避免无谓的字符串和 stat 开销
+    if debug:
+        logger.debug("-"*60)
+        logger.debug("PDF 目录本地 Ollama 翻译系统启动")
+        logger.debug(f"模型：{OLLAMA_MODEL} @ {OLLAMA_BASE_URL}")
+        logger.debug("-"*60)
     
     if not prefix:
         logger.debug(f"   无前缀，跳过 {file.name}")
@@ -625,26 +803,29 @@ def translate_toc(file: Path, prefix: str) -> Path:
 
     # 2. 提取所有标题文本到 content.txt
     if not is_file_recent(Path(cfg["content_file"])):
-        titles = []
-        tree = ET.parse(cfg["toc_xml_file"])
-        for item in tree.getroot().findall(".//ITEM"):
-            t = deep_clean_title(item.get("NAME", ""))
-            if t.strip():
-                titles.append(t)
-        with open(cfg["content_file"], "w", encoding="utf-8") as f:
-            f.write("\n".join(titles) + "\n")
+        # 流式读取，只取出 NAME，处理完的 ITEM 随即清空，不保留整棵树
+        names = []
+        for event, item in ET.iterparse(cfg["toc_xml_file"], events=("start", "end")):
+            if item.tag != "ITEM":
+                continue
+            if event == "start":
+                names.append(item.get("NAME", ""))
+            else:
+                item.clear()
+        titles = [t for t in deep_clean_titles(names) if t.strip()]
+        with open(cfg["content_file"], "w", encoding="utf-8", buffering=WRITE_BUFFER) as f:
+            f.writelines(f"{t}\n" for t in titles)
         logger.info(f"提取目录文本 → {len(titles)} 行")
     else:
         with open(cfg["content_file"], "r", encoding="utf-8") as f:
-            title_count = len([l for l in f if l.strip()])
-        logger.info(f"使用缓存的目录文本 → {title_count} 行")
+            titles = [l for l in f if l.strip()]
+        logger.info(f"使用缓存的目录文本 → {len(titles)} 行")
 
     # 3. 生成专业的翻译指导书（只生成一次，永久缓存, 复用 prompt_file 存翻译指导
     translation_guide = generate_translation_guide(Path(cfg["content_file"]), Path(cfg["prompt_file"]))  
 
-    # 4. 全部逐行翻译
-    with open(cfg["content_file"], "r", encoding="utf-8") as f:
-        all_english_lines = [line.strip() for line in f if line.strip()]
+    # 4. 全部逐行翻译（直接使用第 2 步得到的标题，不再重读 content_file）
+    all_english_lines = [line.strip() for line in titles]
 
     logger.info(f"开始逐行翻译，共 {len(all_english_lines)} 行")
     chinese_lines = translate_line_by_line(all_english_lines, translation_guide, Path(cfg["translation_file"]))
@@ -654,8 +835,6 @@ def translate_toc(file: Path, prefix: str) -> Path:
         logger.error(f"严重错误：翻译行数不匹配！{len(chinese_lines)} vs {len(all_english_lines)}")
         return PROCESSING_DIR / "toc_not_exist.xml"
 
-    with open(cfg["translation_file"], "w", encoding="utf-8") as f:
-        f.write("\n".join(chinese_lines) + "\n")
     logger.info(f"翻译完成！生成 {cfg['translation_file']}")
 
     # 6. 替换 XML 中的书签名称
@@ -674,54 +853,62 @@ def translate_toc(file: Path, prefix: str) -> Path:
         logger.error(f"ErrOR：翻译后的 {trans_xml_file} 未找到")
         
     logger.info(f"目录翻译完成 → {file.name}")
-    logger.debug("   过程文件生成：")
-    for k, v in cfg.items():
-        exists = "Yes" if os.path.exists(v) else "No"
-        logger.debug(f"     {k:15} → {Path(v).name} [{exists}]")
+    if debug:
+        logger.debug("   过程文件生成：")
+        for k, v in cfg.items():
+            exists = "Yes" if os.path.exists(v) else "No"
+            logger.debug(f"     {k:15} → {Path(v).name} [{exists}]")
         
     return trans_xml_file
         
     
+# 源文件与目标文件名的相似度阈值：达到 MATCH 视为同一本书，达到 LOG 仅记录
+TARGET_MATCH_RATIO = 0.95
+TARGET_LOG_RATIO   = 0.80
+
 def batch_translate_toc_and_write_tgt(WORK_DIR: Path):
     # 批量模式
-    if not WORK_DIR or not WORK_DIR.isdir():
+    if not WORK_DIR or not WORK_DIR.is_dir():
         logger.debug("批量模式未配置")
         return
-    sources = [str(p) for p in WORK_DIR.glob("*.pdf") if not any(p.name.endswith(s) for s in TARGET_SUFFIXES)]
-
-    for src in sources:
-        # from pathlib import Path
-        # path = Path("/home/user/data/file.txt")
-        # logger.debug(f"完整路径: {path}")            # /home/user/data/file.txt
-        # logger.debug(f"文件名（带扩展名）: {path.name}")   # file.txt
-        # logger.debug(f"文件名（不带扩展名）: {path.stem}")  # file
-        # logger.debug(f"扩展名: {path.suffix}")        # .txt
-        # logger.debug(f"父目录: {path.parent}")        # /home/user/data
-        # logger.debug(f"根目录: {path.anchor}")        # / (Linux) 或 C:\ (Windows)
+    # 一次 os.scandir 分出源文件和目标文件：先按文件名过滤，只为 PDF 构造路径；
+    # 每个文件只匹配一次后缀，目标文件预先去掉后缀得到基本文件名
+    sources = []
+    candidates = []
+    candidate_bases = []
+    with os.scandir(WORK_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".pdf") or not entry.is_file():
+                continue
+            suffix = is_target_file_2(entry.name)
+            if suffix:
+                candidates.append(Path(entry.path))
+                candidate_bases.append(entry.name[:-len(suffix)])
+            else:
+                sources.append(entry.path)
+
+    def process_one(src: str):
         file = Path(src)
-        # 使用相似性比较而不是精确匹配
+        # 使用相似性比较而不是精确匹配：一次批量比较所有目标文件，只返回达到记录阈值的
         targets = []
         logger.debug(f"正在处理源文件: {file.name}")
         
-        for p in WORK_DIR.iterdir():
-            if p.suffix == ".pdf" and is_target_file(p.name):
-                # 移除后缀得到基本文件名进行比较
-                target_filename = p.name
-                matched_suffix = is_target_file_2(p.name)
-                if matched_suffix:
-                    # 移除匹配的后缀（包括.pdf）
-                    tgt_base = target_filename[:-len(matched_suffix)]
-                
-                # 如果文件名高度相似，则认为是匹配的 
-                if is_highly_similar(file.stem, tgt_base, threshold=80): # 如果超过80%相似度，则可以进行记录
-                    if is_highly_similar(file.stem, tgt_base, threshold = 95):
-                        targets.append(str(p))
-                    else:
-                        similarity = SequenceMatcher(None, file.stem, tgt_base).ratio()
-                        logger.debug(f"  比较 '{file.stem}' 和 '{tgt_base}': 相似度={similarity:.4f}")
-
-        if targets:
-            pdf_import_toc_xml(src, targets)
+        for idx, similarity in similar_choices(file.stem, candidate_bases, TARGET_LOG_RATIO):
+            if similarity >= TARGET_MATCH_RATIO:
+                targets.append(candidates[idx])
+            else: # 如果超过80%相似度，则可以进行记录
+                logger.debug(f"  比较 '{file.stem}' 和 '{candidate_bases[idx]}': 相似度={similarity:.4f}")
+
+        if not targets:
+            return
+        # 先翻译源文件目录（单独的文件没有 books_id，用文件名的哈希作前缀），再逐个写入目标文件
+        trans_xml = translate_toc(file, get_text_md5(file.stem)[-12:])
+        for target in targets:
+            pdf_import_toc_xml(trans_xml, target)
+
+    # 各源文件相互独立，与 batch.py 一样按 BATCH_WORKERS 用多线程并行；写 PDF 时由 PDF_LOCK 串行
+    with ThreadPoolExecutor(max_workers=max(1, BATCH_WORKERS)) as executor:
+        list(executor.map(process_one, sources))
 
 # ==============================
 # 入口
@@ -1,11 +1,19 @@
-import requests
-from typing import Dict
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
 import xml.etree.ElementTree as ET
 from pathlib import Path
-from _utils import logger, WIKI_BASE_PATH, get_safe_title, PROXIES,PROCESSING_DIR
+from _utils import logger, WIKI_BASE_PATH, get_safe_title, PROXIES,PROCESSING_DIR, HTTP_SESSION
 
 MD_DIR = WIKI_BASE_PATH
 COVERS_DIR = WIKI_BASE_PATH / "covers"
+COVER_WORKERS = 8   # 后台并发下载封面的线程数；线程按需创建，不下载时不占资源
+
+# 封面文件名 -> 后台下载任务；build_markdown 取用后移除
+_cover_pool = ThreadPoolExecutor(max_workers=COVER_WORKERS, thread_name_prefix="cover")
+_cover_futures: Dict[str, Future] = {}
+_cover_lock = threading.Lock()
 
 
 def download_and_save_cover_image(meta, img_filename:str) -> Path:
@@ -25,20 +33,49 @@ def download_and_save_cover_image(meta, img_filename:str) -> Path:
         if img_path.exists():
             return img_path
 
-        # 下载图片需要挂代理
-        img_resp = requests.get(thumbnail_url, timeout=30, proxies=PROXIES)
-        img_resp.raise_for_status()
-
-        # 保存图片
-        with open(img_path, 'wb') as f:
-            f.write(img_resp.content)
+        # 下载图片需要挂代理；流式写入同目录临时文件，完整下载后再改名，
+        # 中途失败不会留下残缺图片（否则上面的 exists 检查会一直跳过它）
+        tmp_path = img_path.with_name(img_path.name + ".tmp")
+        with HTTP_SESSION.get(thumbnail_url, timeout=30, proxies=PROXIES, stream=True) as img_resp:
+            img_resp.raise_for_status()
+            if img_resp.headers.get("Content-Length") == "0":
+                logger.warn(f"封面为空，跳过保存: {thumbnail_url}")
+                return None
+            with open(tmp_path, 'wb') as f:
+                for chunk in img_resp.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+        os.replace(tmp_path, img_path)
 
         return img_path
     except Exception as e:
         logger.warn(f"下载封面失败: {e}")
         return None
     
+def prefetch_covers(metas: List[dict]) -> None:
+    """
+    在后台并发下载封面，与目录翻译等耗时阶段重叠；之后 build_markdown 直接取下载结果
+    """
+    for meta in metas:
+        if not meta.get("imageLink") or not meta.get("id"):
+            continue
+        img_filename = f"{meta['id']}.jpg"
+        with _cover_lock:
+            if img_filename not in _cover_futures:
+                _cover_futures[img_filename] = _cover_pool.submit(download_and_save_cover_image, meta, img_filename)
+
+def get_cover_image(meta, img_filename: str) -> Path:
+    """取后台预下载的结果（必要时等待其完成），没有预下载时当场下载"""
+    with _cover_lock:
+        future = _cover_futures.pop(img_filename, None)
+    if future is not None:
+        return future.result()
+    return download_and_save_cover_image(meta, img_filename)
+
 # -------------- Markdown 输出 --------------
+def _join_field(value) -> str:
+    """作者、分类等字段可能是列表，也可能是单个值"""
+    return ", ".join(value) if isinstance(value, list) else str(value)
+
 def build_markdown(meta) -> Path:
     """
     生成 Markdown 文件
@@ -50,7 +87,7 @@ def build_markdown(meta) -> Path:
     img_file = COVERS_DIR
     # 处理封面图片，避免上次下载失败，总是尝试
     if "imageLink" in meta and meta["imageLink"]:
-        img_file = download_and_save_cover_image(meta, f"{meta["id"]}.jpg")
+        img_file = get_cover_image(meta, f"{meta["id"]}.jpg")
         logger.info(f"封面图片已保存: {img_file}")
     
     # 检查 MD 文件是否已经存在
@@ -60,77 +97,48 @@ def build_markdown(meta) -> Path:
     
     logger.info(f"正在生成 Markdown 文件:[ {md_file.name} ]")
     
+    # 字段只取一次；列表字段拼成逗号分隔的字符串
     en_title = meta["title"]
-    # 使用列表来构建 Markdown 内容
-    md_content = []
-    
-    md_content.append(f"## 书籍信息")
-    md_content.append("")
-    if meta.get("subtitle"):
-        md_content.append(f"- **书名**：{en_title}: {meta.get('subtitle')}")
-    else:
-        md_content.append(f"- **书名**：{en_title}")
-    md_content.append(f"- **中文译名**：{meta['title_zh']}")
-    
-    # 添加作者信息
+    subtitle = meta.get("subtitle")
     authors = meta.get("authors")
-    if authors:
-        if isinstance(authors, list):
-            authors_str = ", ".join(authors)
-        else:
-            authors_str = str(authors)
-        md_content.append(f"- **作者**：{authors_str}")
-    else:
-        md_content.append(f"- **作者**：暂无数据")
-    
-    if meta.get("edition") and int(meta.get("edition")) > 1:
-        md_content.append(f"- **版本**：{meta.get('edition')}")
-    
-    md_content.append("")
-    
-    # 检查图片文件是否存在并且有效
-    if img_file and img_file.is_file():
-        md_content.append(f"![封面](covers/{img_file.name})")
-        md_content.append("")
-    else: # 如果没有封面图片，则使用占位符；包括图片下载失败的情况
-        md_content.append(f"![封面](covers/placeholder.png ':size=30%')")
-        md_content.append("")
-    
-    # 添加其他信息
-    md_content.append(f"- **出版社**：{meta.get("publisher") or "无"}")
-    md_content.append(f"- **出版日期**：{meta.get("publishedDate") or "无"}")
-    
-    # 分类信息
     categories = meta.get("categories")
-    if categories:
-        if isinstance(categories, list):
-            categories_str = ", ".join(categories)
-        else:
-            categories_str = str(categories)
-        md_content.append(f"- **图书分类**：{categories_str}")
-    else:
-        md_content.append(f"- **图书分类**：无")
-    
-    # ISBN 
-    if meta.get("isbn"):
-        md_content.append(f"- **ISBN**：{meta.get("isbn")}")
-    else:
-        md_content.append(f"- **ISBN**：无")
-    
-    md_content.append(f"- **页数**：{meta.get("pageCount") or "无"}")
-    md_content.append(f"- **索引文件名**：{meta.get("filename")}")
-    md_content.append("")
-    
-    # 简介
+    edition = meta.get("edition")
+    isbn = meta.get("isbn")
     description = meta.get("description_zh") or meta.get("description") or "暂无简介"
-    md_content.append("### 简介")
-    md_content.append("")
-    md_content.append(description)
-    md_content.append("")
+    authors_str = _join_field(authors) if authors else "暂无数据"
+    categories_str = _join_field(categories) if categories else "无"
+    # 检查图片文件是否存在并且有效；如果没有封面图片（包括下载失败的情况），则使用占位符
+    cover = f"![封面](covers/{img_file.name})" if img_file and img_file.is_file() else "![封面](covers/placeholder.png ':size=30%')"
+    
+    md_content = [
+        "## 书籍信息",
+        "",
+        f"- **书名**：{en_title}: {subtitle}" if subtitle else f"- **书名**：{en_title}",
+        f"- **中文译名**：{meta['title_zh']}",
+        f"- **作者**：{authors_str}",
+    ]
+    if edition and int(edition) > 1:
+        md_content.append(f"- **版本**：{edition}")
+    md_content += [
+        "",
+        cover,
+        "",
+        f"- **出版社**：{meta.get('publisher') or '无'}",
+        f"- **出版日期**：{meta.get('publishedDate') or '无'}",
+        f"- **图书分类**：{categories_str}",
+        f"- **ISBN**：{isbn or '无'}",
+        f"- **页数**：{meta.get('pageCount') or '无'}",
+        f"- **索引文件名**：{meta.get('filename')}",
+        "",
+        "### 简介",
+        "",
+        description,
+        "",
+        "### 书目",
+        "```content",
+    ]
     
     # 目录
-    md_content.append("### 书目")
-    md_content.append("```content")
     logger.debug(f"正在给 md 文件生目录树形结构")
     toc = get_toc_from_xml(meta)
     if not toc.strip():
@@ -139,25 +147,29 @@ def build_markdown(meta) -> Path:
     else:
         logger.info(f"目录树形结构已生成")
         md_content.append(toc)
-    md_content.append("```")
-    md_content.append("")
-
+    md_content += ["```", ""]
     
-    # 将列表内容写入文件
-    with open(md_file, "w", encoding="utf-8") as f:
-        f.write("\n".join(md_content))
+    # 拼接后一次写入文件
+    md_file.write_text("\n".join(md_content), encoding="utf-8")
     
     return md_file
 
-def xml_to_tree(xml_str: str) -> str:
-    """返回纯文本树形书签，缩进 4×(LEVEL-1) 空格"""
-    root = ET.fromstring(xml_str)
+def xml_to_tree(xml_source) -> str:
+    """
+    返回纯文本树形书签，缩进 4×(LEVEL-1) 空格；
+    xml_source 为文件路径或二进制文件对象，用 iterparse 边读边解析，处理完的 ITEM 随即清空
+    """
     lines = []
-    for item in root.iter('ITEM'):
-        level = int(item.get('LEVEL', 1))
-        indent = ' ' * 4 * (level - 1)
-        name = item.get('NAME', '')
-        lines.append(f'{indent}{name}')
+    for event, item in ET.iterparse(xml_source, events=("start", "end")):
+        if item.tag != 'ITEM':
+            continue
+        if event == "start":   # 属性在 start 事件时已完整
+            level = int(item.get('LEVEL', 1))
+            indent = ' ' * 4 * (level - 1)
+            name = item.get('NAME', '')
+            lines.append(f'{indent}{name}')
+        else:
+            item.clear()
     return '\n'.join(lines)
 
 def get_toc_from_xml(meta:Dict[str,str]) -> str:
@@ -180,17 +192,9 @@ def get_toc_from_xml(meta:Dict[str,str]) -> str:
         logger.warn(f"目录XML文件不存在: {xml_file}")
         return ""
     
-    # 读取XML内容
-    try:
-        with open(xml_file, encoding='utf-8') as f:
-            xml_content = f.read()
-    except Exception as e:
-        logger.warn(f"无法读取目录XML文件 {xml_file}: {e}")
-        return ""
-    
-    # 解析XML并转换为文本树
+    # 直接从文件流式解析并转换为文本树，不先把整份 XML 读入内存
     try:
-        content_tree = xml_to_tree(xml_content)
+        content_tree = xml_to_tree(xml_file)
         return content_tree
     except Exception as e:
         logger.warn(f"解析目录XML时出错: {e}")
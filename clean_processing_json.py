@@ -5,9 +5,13 @@
 删除 books_id 为空或者 safe_title 为空的条目
 """
 
+import io
 import json
+import shutil
+import sys
+from collections import Counter, defaultdict
 from pathlib import Path
-from batch import PROCESSING_JSON_PATH
+from _utils import json_loads, json_dumps, atomic_write_bytes, PROCESSING_JSON_PATH
 
 def clean_processing_json():
     """
@@ -21,8 +25,7 @@ def clean_processing_json():
     
     # 读取 processing.json 文件
     try:
-        with open(PROCESSING_JSON_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = json_loads(PROCESSING_JSON_PATH.read_bytes())
     except json.JSONDecodeError as e:
         print(f"错误: JSON 文件格式不正确: {e}")
         return
@@ -33,94 +36,87 @@ def clean_processing_json():
     # 统计原始条目数量
     original_count = len(data)
     
-    # 检查重复的 books_id 和 isbn
-    books_id_map = {}
-    isbn_map = {}
-    
-    for i, entry in enumerate(data):
-        books_id = entry.get("books_id", "")
-        isbn = entry.get("isbn", "")
-        
-        if books_id:
-            if books_id not in books_id_map:
-                books_id_map[books_id] = []
-            books_id_map[books_id].append((i, entry))
-            
-        if isbn:
-            if isbn not in isbn_map:
-                isbn_map[isbn] = []
-            isbn_map[isbn].append((i, entry))
-    
-    # 显示重复的 books_id
-    duplicate_books_id_found = False
-    for books_id, entries in books_id_map.items():
-        if len(entries) > 1:
-            if not duplicate_books_id_found:
-                print("\n发现重复的 books_id:")
-                duplicate_books_id_found = True
-                
-            print(f"\nbooks_id '{books_id}' 出现 {len(entries)} 次:")
-            for index, entry in entries:
-                standard_name = entry.get("standard_name", "Unknown")
-                print(f"  - 条目 {index+1}: 文件 {standard_name}")
-                
-    # 显示重复的 isbn
-    duplicate_isbn_found = False
-    for isbn, entries in isbn_map.items():
-        if len(entries) > 1:
-            if not duplicate_isbn_found:
-                print("\n发现重复的 isbn:")
-                duplicate_isbn_found = True
-                
-            print(f"\nisbn '{isbn}' 出现 {len(entries)} 次:")
-            for index, entry in entries:
-                standard_name = entry.get("standard_name", "Unknown")
-                print(f"  - 条目 {index+1}: 文件 {standard_name}")
-    
-    # 筛选出有效的条目（books_id 和 safe_title 都不为空）
+    # 一次遍历同时统计 books_id、isbn 的出现次数，并筛选出有效的条目（books_id 和 safe_title 都不为空）
+    books_id_counts = Counter()
+    isbn_counts = Counter()
     cleaned_data = []
     removed_entries = []
     
     for entry in data:
         books_id = entry.get("books_id", "")
+        isbn = entry.get("isbn", "")
         safe_title = entry.get("safe_title", "")
         
+        if books_id:
+            books_id_counts[books_id] += 1
+        if isbn:
+            isbn_counts[isbn] += 1
+        
         # 如果 books_id 和 safe_title 都不为空，则保留该条目
         if books_id and safe_title:
             cleaned_data.append(entry)
         else:
             # 记录被移除的条目
-            standard_name = entry.get("standard_name", "Unknown")
             removed_entries.append({
-                "standard_name": standard_name,
+                "standard_name": entry.get("standard_name", "Unknown"),
                 "books_id": books_id,
                 "safe_title": safe_title
             })
     
+    # 只为确有重复的键收集条目（序号, 文件名），不保存每个条目
+    dup_books_ids = {k for k, n in books_id_counts.items() if n > 1}
+    dup_isbns = {k for k, n in isbn_counts.items() if n > 1}
+    books_id_map = defaultdict(list)
+    isbn_map = defaultdict(list)
+    if dup_books_ids or dup_isbns:
+        for i, entry in enumerate(data):
+            standard_name = entry.get("standard_name", "Unknown")
+            if entry.get("books_id", "") in dup_books_ids:
+                books_id_map[entry["books_id"]].append((i, standard_name))
+            if entry.get("isbn", "") in dup_isbns:
+                isbn_map[entry["isbn"]].append((i, standard_name))
+    
+    # 报告先写入内存缓冲，最后一次性输出，不必每行都获取 stdout 锁并刷新
+    report = io.StringIO()
+    
+    # 显示重复的 books_id
+    if books_id_map:
+        print("\n发现重复的 books_id:", file=report)
+    for books_id, entries in books_id_map.items():
+        print(f"\nbooks_id '{books_id}' 出现 {len(entries)} 次:", file=report)
+        for index, standard_name in entries:
+            print(f"  - 条目 {index+1}: 文件 {standard_name}", file=report)
+                
+    # 显示重复的 isbn
+    if isbn_map:
+        print("\n发现重复的 isbn:", file=report)
+    for isbn, entries in isbn_map.items():
+        print(f"\nisbn '{isbn}' 出现 {len(entries)} 次:", file=report)
+        for index, standard_name in entries:
+            print(f"  - 条目 {index+1}: 文件 {standard_name}", file=report)
+    
     # 统计清理后的条目数量
     cleaned_count = len(cleaned_data)
     removed_count = original_count - cleaned_count
     
     # 显示被移除的条目
     if removed_entries:
-        print("\n被移除的条目:")
+        print("\n被移除的条目:", file=report)
         for entry in removed_entries:
-            print(f"  - 文件: {entry['standard_name']}")
-            print(f"    books_id: '{entry['books_id']}'")
-            print(f"    safe_title: '{entry['safe_title']}'")
-            print()
+            print(f"  - 文件: {entry['standard_name']}", file=report)
+            print(f"    books_id: '{entry['books_id']}'", file=report)
+            print(f"    safe_title: '{entry['safe_title']}'", file=report)
+            print(file=report)
+    sys.stdout.write(report.getvalue())
     
     # 保存清理后的数据
     try:
         backup_path = PROCESSING_JSON_PATH.with_suffix('.json.backup')
         # 创建备份
-        with open(PROCESSING_JSON_PATH, 'r', encoding='utf-8') as original, \
-             open(backup_path, 'w', encoding='utf-8') as backup:
-            backup.write(original.read())
+        shutil.copyfile(PROCESSING_JSON_PATH, backup_path)
         
         # 写入清理后的数据
-        with open(PROCESSING_JSON_PATH, 'w', encoding='utf-8') as f:
-            json.dump(cleaned_data, f, ensure_ascii=False, indent=2)
+        atomic_write_bytes(PROCESSING_JSON_PATH, json_dumps(cleaned_data, indent=True))
         
         print("\n清理完成!")
         print(f"原始条目数量: {original_count}")